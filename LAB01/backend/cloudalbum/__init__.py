@@ -19,6 +19,10 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_login import LoginManager
 from flask_jwt_extended import JWTManager
+from cloudalbum.util.thumbnail_pool import ThumbnailExecutor
+from cloudalbum.util.cache import LRUCache
+from cloudalbum.util.revocation import RevocationStore
+from cloudalbum.util.password import PasswordHasher
 
 
 class JSONEncoder(json.JSONEncoder):
@@ -37,6 +41,10 @@ class JSONEncoder(json.JSONEncoder):
 db = SQLAlchemy()
 login = LoginManager()
 jwt = JWTManager()
+thumbnail_executor = ThumbnailExecutor()
+photo_lists = LRUCache()
+revocations = RevocationStore()
+password_hasher = PasswordHasher()
 
 
 def create_app(script_info=None):
@@ -61,6 +69,10 @@ def create_app(script_info=None):
 
     # set up extensions
     db.init_app(app)
+    thumbnail_executor.init_app(app)
+    photo_lists.init_app(app, 'photo_lists', app.config['PHOTO_LIST_CACHE_SIZE'])
+    revocations.init_app(app)
+    password_hasher.init_app(app)
 
     # register blueprints
     from cloudalbum.api.users import users_blueprint
@@ -77,6 +89,9 @@ def create_app(script_info=None):
         try:
             db.create_all()
             app.logger.info('Create database tables')
+            from cloudalbum.database.models import add_missing_columns
+            for column in add_missing_columns(db.engine):
+                app.logger.info('Add database column {0}'.format(column))
         except Exception as e:
             app.logger.error(e)
 
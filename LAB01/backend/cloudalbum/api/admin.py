@@ -4,7 +4,7 @@ from flask import Blueprint, make_response
 from flask import current_app as app
 from flask_restplus import Api, Resource
 from werkzeug.exceptions import InternalServerError
-from cloudalbum import db
+from cloudalbum import db, thumbnail_executor, photo_lists, revocations, password_hasher
 import shutil
 
 admin_blueprint = Blueprint('admin', __name__)
@@ -40,5 +40,38 @@ class HealthCheck(Resource):
             raise InternalServerError('Healthcheck failed: {0}: {1}'.format(get_ip_addr(), e))
 
 
+@api.route('/thumbnail_pool')
+class ThumbnailPool(Resource):
+    @api.doc(responses={200: 'thumbnail pool saturation metrics'})
+    def get(self):
+        """Thumbnail process pool metrics"""
+        return make_response({'ok': True, 'thumbnail_pool': thumbnail_executor.stats()}, 200)
+
+
+@api.route('/caches')
+class Caches(Resource):
+    @api.doc(responses={200: 'cache hit ratio metrics'})
+    def get(self):
+        """In-process cache metrics"""
+        return make_response({'ok': True, 'caches': {'photo_lists': photo_lists.stats()}}, 200)
+
+
+@api.route('/revocations')
+class Revocations(Resource):
+    @api.doc(responses={200: 'token revocation check metrics'})
+    def get(self):
+        """Revocation checks answered by the local filter and by the database"""
+        return make_response({'ok': True, 'revocations': revocations.stats()}, 200)
+
+
+@api.route('/password_hasher')
+class PasswordHashPool(Resource):
+    @api.doc(responses={200: 'password hashing pool saturation metrics'})
+    def get(self):
+        """Password hashing pool metrics"""
+        return make_response({'ok': True, 'password_hasher': password_hasher.stats()}, 200)
+
+
 def get_ip_addr():
     return '{0}'.format(socket.gethostname())
+
@@ -7,7 +7,7 @@
     :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
     :license: MIT, see LICENSE for more details.
 """
-import os, uuid
+import os, uuid, mimetypes
 from flask import current_app as app, make_response
 from flask import Blueprint, request
 from flask_restplus import Api, Resource, fields
@@ -20,8 +20,15 @@ from jsonschema.exceptions import ValidationError
 from cloudalbum import db
 from cloudalbum.database.models import Photo
 from cloudalbum.schemas import validate_photo_info
-from cloudalbum.util.file_control import email_normalize, delete, save, insert_basic_info
+from cloudalbum.util.file_control import email_normalize, delete, save, insert_basic_info, send_photo
+from cloudalbum.util.file_control import content_digest, find_duplicate, upload_photos, ALLOWED_EXTENSIONS
+from cloudalbum.util.file_control import album_version, bump_album_version, album_etag, cached_user_photos
+from cloudalbum.util.jwt_helper import register_jwt_error_handler
+from cloudalbum.util.pagination import CursorError, encode_cursor, page_args
+from cloudalbum.util.response import stream_response
+from cloudalbum.util.file_control import THUMBNAIL_MIMETYPES, thumbnail_file, negotiate_thumbnail_format
 from werkzeug.exceptions import BadRequest, InternalServerError
+from sqlalchemy.orm import load_only
 
 
 authorizations = {
@@ -44,6 +51,7 @@ api = Api(photos_blueprint, doc='/swagger/',
           version='0.1',
           security='Bearer Auth',
           authorizations=authorizations)
+register_jwt_error_handler(api)
 
 photo_info = api.model('New_photo', {
     'tags': fields.String,
@@ -63,6 +71,27 @@ photo_info = api.model('New_photo', {
 photo_get_parser = api.parser()
 photo_get_parser.add_argument('mode', type=str, location='args')
 
+photo_list_parser = api.parser()
+photo_list_parser.add_argument('limit', type=int, location='args', help='page size, the whole list without it')
+photo_list_parser.add_argument('cursor', type=str, location='args', help='cursor of the previous page')
+photo_list_parser.add_argument('fields', type=str, location='args',
+                               help='comma separated fields to return, e.g. id,taken_date')
+
+
+def parse_fields(value):
+    """
+    Parse the fields= query parameter of the photo list.
+    :param value: comma separated Photo.JSON_FIELDS names, or None for every field
+    :return: list of field names or None
+    """
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in Photo.JSON_FIELDS]
+    if unknown:
+        raise BadRequest('unknown fields: {0}'.format(','.join(unknown)))
+    return fields
+
 file_upload_parser = api.parser()
 file_upload_parser.add_argument('file', location='files', type=FileStorage, required=True)
 file_upload_parser.add_argument('tags', type=str, location='form')
@@ -78,6 +107,20 @@ file_upload_parser.add_argument('city', type=str, location='form')
 file_upload_parser.add_argument('nation', type=str, location='form')
 file_upload_parser.add_argument('address', type=str, location='form')
 
+bulk_upload_parser = file_upload_parser.copy()
+bulk_upload_parser.remove_argument('file')
+bulk_upload_parser.add_argument('files', location='files', type=FileStorage, required=True, action='append')
+
+
+def with_etag(resp, etag):
+    """
+    Tag a photo list response, clients revalidate it with If-None-Match.
+    """
+    resp.set_etag(etag)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
+
 
 @api.route('/ping')
 @api.doc('photos ping!')
@@ -99,14 +142,21 @@ class FileUpload(Resource):
         extension = (filename_orig.rsplit('.', 1)[1]).lower()
         current_user = get_jwt_identity()
 
-        if extension.lower() not in ['jpg', 'jpeg', 'bmp', 'gif', 'png']:
+        if extension.lower() not in ALLOWED_EXTENSIONS:
             app.logger.error('File format is not supported:{0}'.format(filename_orig))
             raise BadRequest('File format is not supported:{0}'.format(filename_orig))
 
         try:
+            content_hash = content_digest(form['file'])
+            duplicate = find_duplicate(current_user['user_id'], content_hash)
+            if duplicate is not None:
+                app.logger.debug('Duplicate upload:user_id:{0}, photo_id:{1}'.format(current_user['user_id'],
+                                                                                       duplicate.id))
+                return make_response({'ok': True, "photo_id": duplicate.id, 'duplicate': True}, 200)
+
             filename = secure_filename("{0}.{1}".format(uuid.uuid4(), extension))
             filesize = save(form['file'], filename, current_user['email'])
-            insert_basic_info(current_user['user_id'], filename, filename_orig, filesize, form)
+            insert_basic_info(current_user['user_id'], filename, filename_orig, filesize, form, content_hash)
             committed = Photo.query.filter_by(user_id=current_user['user_id'],
                                               filename=filename,
                                               filename_orig=filename_orig).first()
@@ -116,6 +166,33 @@ class FileUpload(Resource):
             raise InternalServerError('File upload failed: {0}'.format(e))
 
 
+@api.route('/files')
+@api.expect(bulk_upload_parser)
+class BulkFileUpload(Resource):
+    @api.doc(responses={
+        200: 'One result per file: photo_id, photo_id and duplicate, or error',
+        400: 'Too many files',
+        500: 'Internal server error'
+    })
+    @jwt_required
+    def post(self):
+        """Upload many photos in one request, the form fields apply to every file"""
+        form = bulk_upload_parser.parse_args()
+        current_user = get_jwt_identity()
+
+        if len(form['files']) > app.config['BULK_UPLOAD_MAX_FILES']:
+            app.logger.error('Too many files:{0}'.format(len(form['files'])))
+            raise BadRequest('Too many files, max:{0}'.format(app.config['BULK_UPLOAD_MAX_FILES']))
+
+        try:
+            results = upload_photos(current_user['user_id'], current_user['email'], form['files'], form)
+            app.logger.debug('success:bulk upload:user_id:{0}, files:{1}'.format(current_user['user_id'], len(results)))
+            return make_response({'ok': True, 'results': results}, 200)
+        except Exception as e:
+            app.logger.error('Bulk upload failed:user_id:{0}: {1}'.format(current_user['user_id'], e))
+            raise InternalServerError('Bulk upload failed: {0}'.format(e))
+
+
 @api.route('/<photo_id>/info')
 @api.doc('upload a photo information with photo_id')
 class InfoUpload(Resource):
@@ -150,6 +227,7 @@ class InfoUpload(Resource):
             photo.nation = valid_data['nation']
             photo.address = valid_data['address']
             db.session.add(photo)
+            bump_album_version(photo.user_id)
             db.session.commit()
             app.logger.debug('success:photo info update:{}'.format(valid_data))
             return make_response({'ok': True, 'photos': photo.to_json()}, 200)
@@ -168,18 +246,62 @@ class List(Resource):
     @api.doc(
         responses=
         {
-            200: "Return the whole photos list",
+            200: "Return the whole photos list, or one page of it with limit/cursor",
+            304: "Album unchanged since the ETag in If-None-Match",
+            400: "Invalid limit, cursor or fields",
             500: "Internal server error"
         }
     )
     @jwt_required
+    @api.expect(photo_list_parser)
     def get(self):
         """Get all photos as list"""
+        try:
+            limit, after = page_args(request.args, app.config['PHOTO_PAGE_MAX_LIMIT'], int)
+        except CursorError as e:
+            raise BadRequest(str(e))
+        fields = parse_fields(request.args.get('fields'))
+
         try:
             current_user = get_jwt_identity()['user_id']
-            photos = [photo.to_json() for photo in Photo.query.filter_by(user_id=current_user)]
-            app.logger.debug('success:photos_list: {0}'.format(photos))
-            return make_response({'ok': True, 'photos': photos}, 200)
+            version = album_version(current_user)
+            etag = album_etag(current_user, version, request.query_string)
+            if request.if_none_match.contains(etag):
+                resp = app.response_class(status=304)
+                resp.set_etag(etag)
+                return resp
+
+            cached = cached_user_photos(current_user, version)
+            if cached is not None:
+                if after is not None:
+                    cached = [photo for photo in cached if photo['id'] > after]
+                page = cached if limit is None else cached[:limit]
+                photos = ({name: photo[name] for name in fields} for photo in page) if fields else page
+                app.logger.debug('success:photos_list:user_id:{0}'.format(current_user))
+                if limit is None:
+                    return with_etag(stream_response(photos, 200), etag)
+                cursor = encode_cursor(page[-1]['id']) if len(cached) > limit else None
+                return with_etag(stream_response(photos, 200, cursor=cursor), etag)
+
+            query = Photo.query.filter_by(user_id=current_user)
+            if fields is not None:
+                # SELECT only the requested columns
+                query = query.options(load_only(*fields))
+            if limit is None:
+                # Rows are fetched in batches while the response is written.
+                photos = (photo.to_json(fields) for photo in query.order_by(Photo.id).yield_per(500))
+                app.logger.debug('success:photos_list:user_id:{0}'.format(current_user))
+                return with_etag(stream_response(photos, 200), etag)
+
+            # Keyset pagination: seek past the last returned id instead of OFFSET,
+            # so every page costs the same index range scan.
+            if after is not None:
+                query = query.filter(Photo.id > after)
+            page = query.order_by(Photo.id).limit(limit + 1).all()
+            cursor = encode_cursor(page[limit - 1].id) if len(page) > limit else None
+            photos = (photo.to_json(fields) for photo in page[:limit])
+            app.logger.debug('success:photos_list:user_id:{0}'.format(current_user))
+            return with_etag(stream_response(photos, 200, cursor=cursor), etag)
         except Exception as e:
             app.logger.error('Photos list retrieving failed')
             app.logger.error(e)
@@ -208,6 +330,7 @@ class OnePhoto(Resource):
                 raise BadRequest('Not exist photo_id')
             filename = db_photo.filename
             db.session.delete(db_photo)
+            bump_album_version(db_photo.user_id)
             db.session.commit()
             file_deleted = delete(filename, user['email'])
 
@@ -227,6 +350,8 @@ class OnePhoto(Resource):
         responses=
         {
             200: "Success",
+            206: "Partial content for a Range request",
+            304: "Not modified",
             500: "Internal server error"
         }
     )
@@ -248,17 +373,18 @@ class OnePhoto(Resource):
             photo = db.session.query(Photo).filter_by(id=photo_id).first()
 
             if mode == "thumbnail":
-                full_path = full_path / "thumbnails" / photo.filename
+                fmt = negotiate_thumbnail_format(request.accept_mimetypes)
+                # Photos uploaded before the format was enabled only have the JPEG thumbnail.
+                if not thumbnail_file(full_path / "thumbnails", photo.filename, fmt).exists():
+                    fmt = 'jpeg'
+                full_path = thumbnail_file(full_path / "thumbnails", photo.filename, fmt)
+                content_type = THUMBNAIL_MIMETYPES[fmt]
             else:
                 full_path = full_path / photo.filename
-
-            with full_path.open('rb') as f:
-                contents = f.read()
-                resp = make_response(contents)
+                content_type = mimetypes.guess_type(photo.filename)[0] or "image/jpeg"
 
             app.logger.debug("filepath:{}".format(str(full_path)))
-            resp.content_type = "image/jpeg"
-            return resp
+            return send_photo(full_path, content_type)
         except Exception as e:
             app.logger.error('ERROR:get photo failed:photo_id:{}'.format(photo_id))
             app.logger.error(e)
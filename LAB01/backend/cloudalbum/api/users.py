@@ -4,17 +4,18 @@ from flask import jsonify
 from flask_restplus import Api, Resource, fields
 from flask_jwt_extended import (create_access_token, create_refresh_token, jwt_required, get_jwt_identity, get_raw_jwt)
 from jsonschema import ValidationError
-from werkzeug.security import generate_password_hash, check_password_hash
-from cloudalbum import db
+from cloudalbum import db, password_hasher
 from cloudalbum.database.models import User
 from cloudalbum.schemas import validate_user
-from cloudalbum.util.jwt_helper import add_token_to_set
-from werkzeug.exceptions import BadRequest, InternalServerError
+from cloudalbum.util.jwt_helper import add_token_to_set, register_jwt_error_handler
+from cloudalbum.util.password import PasswordHasherBusy
+from werkzeug.exceptions import BadRequest, InternalServerError, ServiceUnavailable
 
 
 users_blueprint = Blueprint('users', __name__)
 api = Api(users_blueprint, doc='/swagger/', title='Users',
           description='CloudAlbum-users: \n prefix url "/users" is already exist.', version='0.1')
+register_jwt_error_handler(api)
 
 response = api.model('Response', {
     'code': fields.Integer,
@@ -104,7 +105,7 @@ class Signup(Resource):
             email = user_data['email']
             if not db_user:
                 user = User(username=user_data['username'],
-                            email=email, password=generate_password_hash(user_data['password']))
+                            email=email, password=password_hasher.hash(user_data['password']))
                 db.session.add(user)
                 db.session.commit()
                 return make_response({'ok': True, 'users': user.to_json()}, 201)
@@ -114,6 +115,9 @@ class Signup(Resource):
         except ValidationError as e:
             app.logger.error('ERROR: {0}\n{1}'.format(e.message, req_data))
             raise BadRequest(e.message)
+        except PasswordHasherBusy as e:
+            app.logger.error('ERROR: {0}'.format(e))
+            raise ServiceUnavailable(str(e))
 
 
 @api.route('/signin')
@@ -134,7 +138,12 @@ class Signin(Resource):
                 app.logger.error('Not existed user!')
                 raise BadRequest('Not existed user!')
             else:
-                if check_password_hash(db_user.password, signin_data['password']):
+                if password_hasher.check(db_user.password, signin_data['password']):
+                    new_hash = password_hasher.rehash(db_user.password, signin_data['password'])
+                    if new_hash is not None:
+                        db_user.password = new_hash
+                        db.session.commit()
+                        app.logger.info('Password hash upgraded to {0}: {1}'.format(password_hasher.method, db_user.id))
                     token_data = {'user_id': db_user.id, 'username': db_user.username, 'email': db_user.email}
                     access_token = create_access_token(identity=token_data)
                     refresh_token = create_refresh_token(identity=token_data)
@@ -148,6 +157,9 @@ class Signin(Resource):
         except ValidationError as e:
             app.logger.error('ERROR: {0}\n{1}'.format(e.message, req_data))
             raise BadRequest(e.message)
+        except PasswordHasherBusy as e:
+            app.logger.error('ERROR: {0}'.format(e))
+            raise ServiceUnavailable(str(e))
 
 
 @api.route('/signout', doc=False)
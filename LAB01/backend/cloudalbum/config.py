@@ -23,6 +23,17 @@ class BaseConfig:
     JWT_ACCESS_TOKEN_EXPIRES = os.getenv('JWT_ACCESS_TOKEN_EXPIRES', datetime.timedelta(days=1))
     JWT_BLACKLIST_ENABLED = os.getenv('JWT_BLACKLIST_ENABLED', True)
     JWT_BLACKLIST_TOKEN_CHECKS = ['access']
+    # Signed-out tokens: 'database' (shared by every worker) or 'memory' (this worker only).
+    # Other workers see a revocation after at most REVOCATION_SYNC_INTERVAL seconds.
+    REVOCATION_BACKEND = os.getenv('REVOCATION_BACKEND', 'database')
+    REVOCATION_SYNC_INTERVAL = int(os.getenv('REVOCATION_SYNC_INTERVAL', 5))
+    REVOCATION_FILTER_CAPACITY = int(os.getenv('REVOCATION_FILTER_CAPACITY', 100000))
+    # Password hashing pool. Stored hashes made with another PASSWORD_HASH_METHOD (e.g. fewer
+    # iterations) are upgraded on the next successful sign-in. Beyond the queue depth sign-in returns 503.
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:150000')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', max((os.cpu_count() or 1) // 2, 1)))
+    PASSWORD_HASH_QUEUE_DEPTH = int(os.getenv('PASSWORD_HASH_QUEUE_DEPTH', 0))  # 0: four times the workers
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = os.getenv('SQLALCHEMY_ECHO', True)
@@ -30,6 +41,32 @@ class BaseConfig:
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(os.getcwd(), '/tmp'))
     THUMBNAIL_WIDTH = os.getenv('THUMBNAIL_WIDTH', 300)
     THUMBNAIL_HEIGHT = os.getenv('THUMBNAIL_HEIGHT', 200)
+    # Thumbnail formats in preference order, formats this Pillow build cannot encode are skipped
+    THUMBNAIL_FORMATS = os.getenv('THUMBNAIL_FORMATS', 'avif,webp,jpeg').split(',')
+
+    # Thumbnail process pool, THUMBNAIL_WORKERS=0 renders on the request thread.
+    THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', os.cpu_count() or 1))
+    THUMBNAIL_QUEUE_DEPTH = int(os.getenv('THUMBNAIL_QUEUE_DEPTH', 0))  # 0: twice the workers
+    THUMBNAIL_TIMEOUT = float(os.getenv('THUMBNAIL_TIMEOUT', 10))
+    THUMBNAIL_WAIT = os.getenv('THUMBNAIL_WAIT', 'true').lower() == 'true'
+
+    # POST /photos/files: files per request, and files saved at the same time
+    BULK_UPLOAD_MAX_FILES = int(os.getenv('BULK_UPLOAD_MAX_FILES', 500))
+    BULK_UPLOAD_CONCURRENCY = int(os.getenv('BULK_UPLOAD_CONCURRENCY', 4))
+
+    # Photo list pages, ?limit= is capped to this
+    PHOTO_PAGE_MAX_LIMIT = int(os.getenv('PHOTO_PAGE_MAX_LIMIT', 1000))
+    # Per-user photo list cache (number of users), entries are also dropped when the album version changes.
+    # Albums with more than PHOTO_LIST_CACHE_MAX_ITEMS photos are always read from the database.
+    PHOTO_LIST_CACHE_SIZE = int(os.getenv('PHOTO_LIST_CACHE_SIZE', 1000))
+    PHOTO_LIST_CACHE_TTL = float(os.getenv('PHOTO_LIST_CACHE_TTL', 300))
+    PHOTO_LIST_CACHE_MAX_ITEMS = int(os.getenv('PHOTO_LIST_CACHE_MAX_ITEMS', 5000))
+
+    # Photo responses: browser cache lifetime, and optional offload of the file transfer to the web server.
+    # PHOTO_ACCEL_REDIRECT is the nginx internal location mapped to UPLOAD_FOLDER, e.g. '/protected/'.
+    PHOTO_MAX_AGE = int(os.getenv('PHOTO_MAX_AGE', 3600))
+    PHOTO_ACCEL_REDIRECT = os.getenv('PHOTO_ACCEL_REDIRECT', '')
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
 
 
 class DevelopmentConfig(BaseConfig):
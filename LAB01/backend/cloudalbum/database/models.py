@@ -8,7 +8,7 @@
     :license: MIT, see LICENSE for more details.
 """
 from flask_login import UserMixin
-from sqlalchemy import Float, DateTime, ForeignKey, Integer, String
+from sqlalchemy import Float, DateTime, ForeignKey, Integer, String, Index, inspect
 from datetime import datetime
 from cloudalbum import db
 
@@ -23,6 +23,8 @@ class User(UserMixin, db.Model):
     email = db.Column(String(100), unique=True)
     username = db.Column(String(50), unique=False)
     password = db.Column(String(100), unique=False)
+    # bumped whenever the user's photo list changes, the photo list ETag is derived from it
+    album_version = db.Column(Integer, nullable=False, default=0, server_default='0')
 
     photos = db.relationship('Photo',
                              backref='user',
@@ -44,14 +46,35 @@ class User(UserMixin, db.Model):
         }
 
 
+class RevokedToken(db.Model):
+    """
+    Signed-out JWT token ids, kept until the token expires.
+    """
+    __tablename__ = 'RevokedToken'
+
+    jti = db.Column(String(64), primary_key=True)
+    exp = db.Column(DateTime, nullable=False, index=True)
+
+
 class Photo(db.Model):
     """
     Database Model class for Photo table
     """
     __tablename__ = 'Photo'
+    # attributes returned by to_json, in order
+    JSON_FIELDS = ('id', 'user_id', 'tags', 'desc', 'filename_orig', 'filename', 'filesize', 'geotag_lat',
+                   'geotag_lng', 'upload_date', 'taken_date', 'make', 'model', 'width', 'height', 'city',
+                   'nation', 'address')
+    __table_args__ = (
+        # per-user content hash lookup for duplicate uploads
+        Index('ix_photo_user_id_content_hash', 'user_id', 'content_hash'),
+        # keyset pagination of the photo list
+        Index('ix_photo_user_id_id', 'user_id', 'id'),
+    )
 
     id = db.Column(Integer, primary_key=True)
     user_id = db.Column(Integer, ForeignKey(User.id))
+    content_hash = db.Column(String(64), unique=False)
     tags = db.Column(String(400), unique=False)
     desc = db.Column(String(400), unique=False)
     filename_orig = db.Column(String(400), unique=False)
@@ -70,10 +93,11 @@ class Photo(db.Model):
     address = db.Column(String(400), unique=False)
 
     def __init__(self, user_id, filename_orig, filename, filesize, upload_date, tags, desc, geotag_lat, geotag_lng,
-                 taken_date, make, model, width, height, city, nation, address):
+                 taken_date, make, model, width, height, city, nation, address, content_hash=None):
         """Initialize"""
 
         self.user_id = user_id
+        self.content_hash = content_hash
         self.tags = tags
         self.desc = desc
         self.filename_orig = filename_orig
@@ -96,27 +120,36 @@ class Photo(db.Model):
 
         return '<%r %r %r>' % (self.__tablename__, self.user_id, self.upload_date)
 
-    def to_json(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'tags': self.tags,
-            'desc': self.desc,
-            'filename_orig': self.filename_orig,
-            'filename': self.filename,
-            'filesize': self.filesize,
-            'geotag_lat': self.geotag_lat,
-            'geotag_lng': self.geotag_lng,
-            'upload_date': self.upload_date,
-            'taken_date': self.taken_date,
-            'make': self.make,
-            'model': self.model,
-            'width': self.width,
-            'height': self.height,
-            'city': self.city,
-            'nation': self.nation,
-            'address': self.address
-        }
+    def to_json(self, fields=None):
+        """
+        :param fields: attribute names to include, every JSON_FIELDS attribute by default
+        :return: dict
+        """
+        return {name: getattr(self, name) for name in (fields or self.JSON_FIELDS)}
 
     def insert_column(self, col, data):
         self[col] = data
+
+
+# Columns added to tables after their first release, db.create_all() does not alter existing tables.
+ADDED_COLUMNS = (
+    (User, 'album_version', 'INTEGER NOT NULL DEFAULT 0'),
+    (Photo, 'content_hash', 'VARCHAR(64)'),
+)
+
+
+def add_missing_columns(engine):
+    """
+    Add the ADDED_COLUMNS missing from a database created by an older release.
+    :param engine: SQLAlchemy engine, e.g. db.engine
+    :return: list of 'table.column' added
+    """
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    added = []
+    for model, column, ddl in ADDED_COLUMNS:
+        table = model.__tablename__
+        if column not in {existing['name'] for existing in inspector.get_columns(table)}:
+            engine.execute('ALTER TABLE {0} ADD COLUMN {1} {2}'.format(quote(table), quote(column), ddl))
+            added.append('{0}.{1}'.format(table, column))
+    return added
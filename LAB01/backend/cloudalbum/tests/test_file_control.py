@@ -0,0 +1,95 @@
+"""
+    cloudalbum/tests/test_file_control.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Test cases for image file handling
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import time
+import tempfile
+import unittest
+from concurrent.futures import TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, features
+from cloudalbum.tests.base import BaseTestCase
+from cloudalbum.util.file_control import render_thumbnail
+from cloudalbum.util.thumbnail_pool import ThumbnailExecutor
+
+
+class TestThumbnailExecutor(BaseTestCase):
+    """Tests for the thumbnail process pool."""
+
+    def make_executor(self, workers, queue_depth=0):
+        self.app.config['THUMBNAIL_WORKERS'] = workers
+        self.app.config['THUMBNAIL_QUEUE_DEPTH'] = queue_depth
+        executor = ThumbnailExecutor(self.app)
+        self.addCleanup(executor.shutdown)
+        return executor
+
+    def test_runs_in_pool(self):
+        """Ensure jobs run in the pool and are counted."""
+        executor = self.make_executor(workers=1)
+        self.assertEqual(8, executor.run(pow, 2, 3))
+
+        stats = executor.stats()
+        self.assertEqual(1, stats['submitted'])
+        self.assertEqual(0, stats['fallbacks'])
+        self.assertEqual(1, stats['workers'])
+
+    def test_fallback_without_workers(self):
+        """Ensure jobs run synchronously when the pool is disabled."""
+        executor = self.make_executor(workers=0)
+        self.assertEqual(8, executor.run(pow, 2, 3))
+        self.assertEqual(1, executor.stats()['fallbacks'])
+
+    def test_timeout_raised(self):
+        """Ensure a job exceeding THUMBNAIL_TIMEOUT is reported instead of returning None."""
+        self.app.config['THUMBNAIL_TIMEOUT'] = 0.05
+        executor = self.make_executor(workers=1)
+        self.assertRaises(TimeoutError, executor.run, time.sleep, 1)
+        self.assertEqual(1, executor.stats()['timeouts'])
+
+    def test_broken_pool_restarted(self):
+        """Ensure a pool broken by a dead worker is replaced, later jobs run in the new pool."""
+        executor = self.make_executor(workers=1)
+        self.assertRaises(BrokenProcessPool, executor.run, os._exit, 1)
+        self.assertEqual(8, executor.run(pow, 2, 3))
+
+        stats = executor.stats()
+        self.assertEqual(1, stats['restarts'])
+        self.assertEqual(0, stats['fallbacks'])
+
+    def test_render_thumbnail(self):
+        """Ensure the pool worker function renders a bounded thumbnail."""
+        workdir = tempfile.mkdtemp()
+        source = os.path.join(workdir, 'original.jpg')
+        destination = os.path.join(workdir, 'thumbnail.jpg')
+        Image.new('RGB', (4000, 3000)).save(source, 'JPEG')
+
+        executor = self.make_executor(workers=1)
+        executor.run(render_thumbnail, source, destination, (300, 200))
+
+        # the width is rounded differently across Pillow versions (266 or 267)
+        width, height = Image.open(destination).size
+        self.assertEqual(200, height)
+        self.assertAlmostEqual(4000 * 200 / 3000, width, delta=1)
+
+    @unittest.skipUnless(features.check('webp'), 'Pillow built without WebP')
+    def test_render_thumbnail_formats(self):
+        """Ensure a thumbnail is written for every requested format."""
+        workdir = tempfile.mkdtemp()
+        source = os.path.join(workdir, 'original.jpg')
+        destination = os.path.join(workdir, 'thumbnail.jpg')
+        Image.new('RGB', (4000, 3000)).save(source, 'JPEG')
+
+        render_thumbnail(source, destination, (300, 200), ['webp', 'jpeg'])
+
+        self.assertEqual('JPEG', Image.open(destination).format)
+        self.assertEqual('WEBP', Image.open(destination + '.webp').format)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,3 +7,182 @@
     :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
     :license: MIT, see LICENSE for more details.
 """
+import io
+import unittest
+from PIL import Image
+from cloudalbum import photo_lists
+from cloudalbum.tests.base import BaseTestCase
+from cloudalbum.tests.test_users import auto_signup, auto_signin
+
+
+def auth_header(self):
+    """Signup and signin a test user, return Authorization header"""
+    response, test_user = auto_signup(self)
+    del test_user['username']
+    access_token = auto_signin(self, test_user).get_json()['accessToken']
+    return {'Authorization': 'Bearer ' + access_token}
+
+
+def jpeg_bytes(color=(120, 80, 40), size=(640, 480)):
+    stream = io.BytesIO()
+    Image.new('RGB', size, color).save(stream, 'JPEG')
+    return stream.getvalue()
+
+
+def upload(self, headers, contents, filename='photo.jpg'):
+    data = {
+        'file': (io.BytesIO(contents), filename),
+        'tags': 'test', 'desc': 'test photo', 'make': 'make', 'model': 'model',
+        'width': '640', 'height': '480', 'taken_date': '2019:08:01 10:00:00',
+        'geotag_lat': '37.5', 'geotag_lng': '127.0', 'city': 'Seoul', 'nation': 'Korea', 'address': 'address'
+    }
+    return self.client.post('/photos/file', headers=headers, data=data, content_type='multipart/form-data')
+
+
+class TestPhotoService(BaseTestCase):
+    """Tests for the Photos Service."""
+
+    def test_upload(self):
+        """Ensure a photo upload returns its photo_id."""
+        headers = auth_header(self)
+        response = upload(self, headers, jpeg_bytes())
+
+        self.assert200(response)
+        self.assertTrue(response.json['photo_id'])
+
+    def test_duplicate_upload(self):
+        """Ensure identical content uploaded twice returns the existing photo_id."""
+        headers = auth_header(self)
+        contents = jpeg_bytes()
+
+        first = upload(self, headers, contents)
+        second = upload(self, headers, contents, filename='copy.jpg')
+        other = upload(self, headers, jpeg_bytes(color=(0, 0, 0)))
+
+        self.assertEqual(first.json['photo_id'], second.json['photo_id'])
+        self.assertTrue(second.json['duplicate'])
+        self.assertNotEqual(first.json['photo_id'], other.json['photo_id'])
+
+    def test_bulk_upload(self):
+        """Ensure many files are stored in one request with a result per file."""
+        headers = auth_header(self)
+        existing = upload(self, headers, jpeg_bytes(color=(0, 0, 0))).json['photo_id']
+        data = {
+            'files': [(io.BytesIO(jpeg_bytes(color=(200, 0, 0))), 'a.jpg'),
+                      (io.BytesIO(jpeg_bytes(color=(0, 200, 0))), 'b.png'),
+                      (io.BytesIO(jpeg_bytes(color=(200, 0, 0))), 'again.jpg'),
+                      (io.BytesIO(jpeg_bytes(color=(0, 0, 0))), 'known.jpg'),
+                      (io.BytesIO(b'text'), 'notes.txt')],
+            'tags': 'bulk'
+        }
+        response = self.client.post('/photos/files', headers=headers, data=data, content_type='multipart/form-data')
+
+        self.assert200(response)
+        results = response.json['results']
+        self.assertEqual(['a.jpg', 'b.png', 'again.jpg', 'known.jpg', 'notes.txt'],
+                         [result['filename'] for result in results])
+        self.assertEqual({'filename': 'again.jpg', 'photo_id': results[0]['photo_id'], 'duplicate': True}, results[2])
+        self.assertEqual({'filename': 'known.jpg', 'photo_id': existing, 'duplicate': True}, results[3])
+        self.assertIn('error', results[4])
+
+        photos = self.client.get('/photos/', headers=headers).json['photos']
+        self.assertEqual(3, len(photos))
+        self.assertEqual(['bulk', 'bulk'], [photo['tags'] for photo in photos if photo['id'] != existing])
+
+    def test_list_pagination(self):
+        """Ensure the list is paged with a cursor and every photo is returned once."""
+        headers = auth_header(self)
+        uploaded = [upload(self, headers, jpeg_bytes(color=(i, i, i))).json['photo_id'] for i in range(5)]
+
+        seen, cursor = [], None
+        while True:
+            query = {'limit': 2, 'cursor': cursor} if cursor else {'limit': 2}
+            response = self.client.get('/photos/', headers=headers, query_string=query)
+            self.assert200(response)
+            self.assertLessEqual(len(response.json['photos']), 2)
+            seen += [photo['id'] for photo in response.json['photos']]
+            cursor = response.json['cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(sorted(uploaded), seen)
+        self.assertEqual(5, len(self.client.get('/photos/', headers=headers).json['photos']))
+        self.assert400(self.client.get('/photos/', headers=headers, query_string={'cursor': 'bogus'}))
+
+    def test_list_fields(self):
+        """Ensure fields= limits the returned attributes."""
+        headers = auth_header(self)
+        upload(self, headers, jpeg_bytes())
+
+        response = self.client.get('/photos/', headers=headers, query_string={'fields': 'id,taken_date'})
+        self.assert200(response)
+        self.assertEqual({'id', 'taken_date'}, set(response.json['photos'][0]))
+        self.assert400(self.client.get('/photos/', headers=headers, query_string={'fields': 'id,content_hash'}))
+
+    def test_list_etag(self):
+        """Ensure an unchanged album revalidates to 304 and an upload changes the ETag."""
+        headers = auth_header(self)
+        upload(self, headers, jpeg_bytes())
+
+        response = self.client.get('/photos/', headers=headers)
+        etag = response.headers['ETag']
+        cached = self.client.get('/photos/', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertStatus(cached, 304)
+
+        upload(self, headers, jpeg_bytes(color=(0, 0, 0)))
+        changed = self.client.get('/photos/', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assert200(changed)
+        self.assertEqual(2, len(changed.json['photos']))
+        self.assertNotEqual(etag, changed.headers['ETag'])
+
+    def test_list_cache(self):
+        """Ensure a repeated list is served from the cache and an upload or delete invalidates it."""
+        headers = auth_header(self)
+        photo_id = upload(self, headers, jpeg_bytes()).json['photo_id']
+
+        self.client.get('/photos/', headers=headers)
+        hits = photo_lists.stats()['hits']
+        response = self.client.get('/photos/', headers=headers, query_string={'limit': 1, 'fields': 'id'})
+        self.assertEqual([{'id': photo_id}], response.json['photos'])
+        self.assertEqual(hits + 1, photo_lists.stats()['hits'])
+
+        upload(self, headers, jpeg_bytes(color=(0, 0, 0)))
+        self.assertEqual(2, len(self.client.get('/photos/', headers=headers).json['photos']))
+        self.client.delete('/photos/{0}'.format(photo_id), headers=headers)
+        self.assertEqual(1, len(self.client.get('/photos/', headers=headers).json['photos']))
+
+    def test_get_photo_range_and_etag(self):
+        """Ensure photos are served with Range support and revalidate to 304."""
+        headers = auth_header(self)
+        contents = jpeg_bytes()
+        photo_id = upload(self, headers, contents).json['photo_id']
+
+        response = self.client.get('/photos/{0}'.format(photo_id), headers=headers)
+        self.assert200(response)
+        self.assertEqual(contents, response.data)
+        self.assertEqual('image/jpeg', response.content_type)
+        self.assertIn('private', response.headers['Cache-Control'])
+
+        partial = self.client.get('/photos/{0}'.format(photo_id), headers=dict(headers, Range='bytes=0-99'))
+        self.assertStatus(partial, 206)
+        self.assertEqual(contents[:100], partial.data)
+
+        cached = self.client.get('/photos/{0}'.format(photo_id),
+                                 headers=dict(headers, **{'If-None-Match': response.headers['ETag']}))
+        self.assertStatus(cached, 304)
+
+    def test_get_photo_accel_redirect(self):
+        """Ensure the file transfer is handed to nginx when PHOTO_ACCEL_REDIRECT is set."""
+        headers = auth_header(self)
+        photo_id = upload(self, headers, jpeg_bytes()).json['photo_id']
+        self.app.config['PHOTO_ACCEL_REDIRECT'] = '/protected/'
+        self.addCleanup(self.app.config.__setitem__, 'PHOTO_ACCEL_REDIRECT', '')
+
+        response = self.client.get('/photos/{0}'.format(photo_id), headers=headers)
+        self.assert200(response)
+        self.assertTrue(response.headers['X-Accel-Redirect'].startswith('/protected/'))
+        self.assertEqual(b'', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
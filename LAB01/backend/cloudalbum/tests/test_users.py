@@ -8,9 +8,17 @@
     :license: MIT, see LICENSE for more details.
 """
 import json
+import threading
+import time
 import unittest
 import random
+from unittest import mock
+from sqlalchemy import create_engine
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash
 from cloudalbum.tests.base import BaseTestCase
+from cloudalbum import password_hasher
+from cloudalbum.database.models import RevokedToken, User, add_missing_columns
+from cloudalbum.util.password import normalize_method
 
 
 def auto_signup(self):
@@ -161,6 +169,97 @@ class TestUserService(BaseTestCase):
         # second signout should fail
         # self.assert500(response)
 
+    def test_signed_out_token_revoked(self):
+        """Ensure a signed-out token is stored until it expires and rejected afterwards."""
+        response, test_user = auto_signup(self)
+        del test_user['username']
+        headers = {'Authorization': 'Bearer ' + auto_signin(self, test_user).get_json()['accessToken']}
+
+        self.assert200(self.client.get('/photos/', headers=headers))
+        self.assert200(self.client.post('/users/signout', headers=headers, content_type='application/json'))
+
+        self.assertEqual(1, RevokedToken.query.count())
+        self.assertEqual(401, self.client.get('/photos/', headers=headers).status_code)
+
+    def test_password_rehashed_on_signin(self):
+        """Ensure a hash made with an older PASSWORD_HASH_METHOD is upgraded on the next signin."""
+        method = password_hasher.method
+        try:
+            password_hasher.method = 'pbkdf2:sha256:1000'
+            response, test_user = auto_signup(self)
+            self.assertTrue(User.query.first().password.startswith('pbkdf2:sha256:1000$'))
+
+            password_hasher.method = method
+            del test_user['username']
+            self.assert200(auto_signin(self, test_user))
+            self.assertFalse(password_hasher.needs_rehash(User.query.first().password))
+            self.assert200(auto_signin(self, test_user))
+        finally:
+            password_hasher.method = method
+
+    def test_signin_rejected_when_hasher_busy(self):
+        """Ensure signin answers 503 instead of queueing when every hashing slot is taken."""
+        response, test_user = auto_signup(self)
+        del test_user['username']
+        for _ in range(password_hasher.queue_depth):
+            password_hasher._slots.acquire()
+        try:
+            self.assertEqual(503, auto_signin(self, test_user).status_code)
+        finally:
+            for _ in range(password_hasher.queue_depth):
+                password_hasher._slots.release()
+
+    def test_signin_timeout(self):
+        """Ensure a hash running past PASSWORD_HASH_TIMEOUT answers 503 and keeps its slot until done."""
+        response, test_user = auto_signup(self)
+        del test_user['username']
+        timeout = password_hasher.timeout
+        started, finish = threading.Event(), threading.Event()
+
+        def slow_check(pwhash, password):
+            started.set()
+            finish.wait(5)
+            return True
+
+        try:
+            password_hasher.timeout = 0.05
+            with mock.patch('cloudalbum.util.password.check_password_hash', slow_check):
+                self.assertEqual(503, auto_signin(self, test_user).status_code)
+                self.assertTrue(started.wait(5))
+                self.assertEqual(1, password_hasher.stats()['in_flight'])
+                finish.set()
+                deadline = time.time() + 5
+                while password_hasher.stats()['in_flight'] and time.time() < deadline:
+                    time.sleep(0.01)
+            self.assertEqual(0, password_hasher.stats()['in_flight'])
+        finally:
+            finish.set()
+            password_hasher.timeout = timeout
+
+    def test_default_iterations_not_rehashed(self):
+        """Ensure a method without an iteration count matches the hashes werkzeug makes with it."""
+        self.assertEqual('pbkdf2:sha256:{0}'.format(DEFAULT_PBKDF2_ITERATIONS), normalize_method('pbkdf2:sha256'))
+        self.assertEqual('pbkdf2:sha256:1000', normalize_method('pbkdf2:sha256:1000'))
+        self.assertEqual('sha256', normalize_method('sha256'))
+
+        method = password_hasher.method
+        try:
+            password_hasher.method = normalize_method('pbkdf2:sha256')
+            self.assertFalse(password_hasher.needs_rehash(generate_password_hash('secret', 'pbkdf2:sha256')))
+        finally:
+            password_hasher.method = method
+
+    def test_album_version_column_added(self):
+        """Ensure a User table created before album_version gets the column, with 0 for existing users."""
+        engine = create_engine('sqlite://')
+        engine.execute('CREATE TABLE "User" (id INTEGER PRIMARY KEY, email VARCHAR(100), '
+                       'username VARCHAR(50), password VARCHAR(100))')
+        engine.execute('INSERT INTO "User" (email) VALUES (\'old@mario.com\')')
+
+        self.assertEqual(['User.album_version'], add_missing_columns(engine))
+        self.assertEqual([], add_missing_columns(engine))
+        self.assertEqual(0, engine.execute('SELECT album_version FROM "User"').scalar())
+
 
 if __name__ == '__main__':
     unittest.main()
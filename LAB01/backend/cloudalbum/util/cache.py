@@ -0,0 +1,100 @@
+"""
+    cloudalbum/util/cache.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    In-process LRU cache with per-entry expiry.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread-safe in-process LRU cache with per-entry expiry and hit/miss counters.
+    Every cache registered with init_app is listed by /admin/caches.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = dict(hits=0, misses=0, evictions=0, expirations=0)
+
+    def init_app(self, app, name, maxsize):
+        """
+        :param app: Flask.application
+        :param name: cache name in the metrics
+        :param maxsize: maximum number of entries, 0 disables the cache
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            self._entries.clear()
+        app.extensions.setdefault('caches', {})[name] = self
+
+    def get(self, key, default=None):
+        """
+        :param key: hashable key
+        :param default: returned on a miss or an expired entry
+        :return: cached value
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= now:
+                del self._entries[key]
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        :param key: hashable key
+        :param value: value to cache
+        :param ttl: seconds until the entry expires, None to keep it until evicted
+        """
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def clear(self):
+        """
+        Drop every entry and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._stats = dict(hits=0, misses=0, evictions=0, expirations=0)
+
+    def stats(self):
+        """
+        Cache metrics.
+        :return: dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        stats['maxsize'] = self.maxsize
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0
+        return stats
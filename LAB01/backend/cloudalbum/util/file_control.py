@@ -8,18 +8,85 @@
     :license: MIT, see LICENSE for more details.
 """
 import os
-from flask import current_app as app
+import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask import current_app as app, send_file
+from sqlalchemy.orm import load_only
+from werkzeug.utils import secure_filename
 from PIL import Image
 from pathlib import Path
 from datetime import datetime
-from cloudalbum.database.models import Photo
-from cloudalbum import db
+from cloudalbum.database.models import Photo, User
+from cloudalbum import db, thumbnail_executor, photo_lists
+
+
+ALLOWED_EXTENSIONS = ['jpg', 'jpeg', 'bmp', 'gif', 'png']
+THUMBNAIL_MIMETYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}
 
 
 def email_normalize(email):
     return email.replace('@', '_at_').replace('.', '_dot_')
 
 
+def thumbnail_file(thumb_path, filename, fmt='jpeg'):
+    """
+    Thumbnail file location. The JPEG thumbnail keeps the original file name, other formats add an extension.
+    :param thumb_path: pathlib.Path, thumbnails directory
+    :param filename: secure file name
+    :param fmt: thumbnail format
+    :return: pathlib.Path
+    """
+    return thumb_path / (filename if fmt == 'jpeg' else '{0}.{1}'.format(filename, fmt))
+
+
+def thumbnail_formats():
+    """
+    Configured thumbnail formats in preference order, limited to what this Pillow build can encode.
+    :return: list of formats, always including 'jpeg'
+    """
+    Image.init()
+    formats = [fmt for fmt in app.config['THUMBNAIL_FORMATS'] if fmt in THUMBNAIL_MIMETYPES and fmt.upper() in Image.SAVE]
+    if 'jpeg' not in formats:
+        formats.append('jpeg')
+    return formats
+
+
+def negotiate_thumbnail_format(accept_mimetypes, available=None):
+    """
+    Pick the preferred thumbnail format the client explicitly accepts, JPEG otherwise.
+    Wildcards do not count: browsers send */* even for images they cannot decode.
+    :param accept_mimetypes: werkzeug MIMEAccept, e.g. request.accept_mimetypes
+    :param available: formats to choose from, thumbnail_formats() by default
+    :return: thumbnail format
+    """
+    accepted = set(value for value, quality in accept_mimetypes if quality > 0)
+    for fmt in available or thumbnail_formats():
+        if THUMBNAIL_MIMETYPES.get(fmt) in accepted:
+            return fmt
+    return 'jpeg'
+
+
+def render_thumbnail(source, destination, size, formats=('jpeg',)):
+    """
+    Render a thumbnail file. Runs inside the thumbnail process pool, so it must not touch the application.
+    JPEG sources are decoded in draft mode, directly at the smallest scale covering the thumbnail.
+    The image is decoded and resized once, then encoded in every requested format.
+    :param source: original image path
+    :param destination: JPEG thumbnail path, other formats are written next to it with their extension
+    :param size: (max width, max height)
+    :param formats: thumbnail formats
+    :return: None
+    """
+    im = Image.open(source)
+    scale = min(size[0] / im.width, size[1] / im.height, 1.0)
+    im.draft('RGB', (max(1, int(im.width * scale)), max(1, int(im.height * scale))))
+    im = im.convert('RGB')
+    im.thumbnail(size, Image.ANTIALIAS)
+    for fmt in formats:
+        im.save(destination if fmt == 'jpeg' else '{0}.{1}'.format(destination, fmt), fmt.upper())
+
+
 def make_thumbnail(path, filename):
     """
     Generate thumbnail from original image file.
@@ -29,17 +96,22 @@ def make_thumbnail(path, filename):
     """
     thumb_path = path / 'thumbnails'
     thumb_file_location = thumb_path / filename
+    size = (int(app.config['THUMBNAIL_WIDTH']), int(app.config['THUMBNAIL_HEIGHT']))
 
     try:
         if not thumb_path.exists():
-            thumb_path.mkdir()
+            thumb_path.mkdir(exist_ok=True)
             app.logger.info("Create folder for thumbnails: %s", str(thumb_path))
 
-        im = Image.open(path / filename)
-        im = im.convert('RGB')
-        im.thumbnail((300, 200, Image.ANTIALIAS))
-        im.save(thumb_file_location)
-        app.logger.debug("success:thumbnail saved!:{}".format(str(thumb_file_location)))
+        thumbnail_executor.run(render_thumbnail, str(path / filename), str(thumb_file_location), size,
+                               thumbnail_formats())
+        if thumbnail_executor.wait:
+            app.logger.debug("success:thumbnail saved!:{}".format(str(thumb_file_location)))
+        else:
+            app.logger.debug("thumbnail queued:{}".format(str(thumb_file_location)))
+    except TimeoutError:
+        app.logger.error("ERROR:Thumbnails creation timed out after {0}s:{1}".format(thumbnail_executor.timeout,
+                                                                                  str(thumb_file_location)))
     except Exception as e:
         app.logger.error("ERROR:Thumbnails creation error:{}".format(str(thumb_file_location)))
         app.logger.error(e)
@@ -54,14 +126,15 @@ def delete(filename, email):
     """
     try:
         base_path = Path(app.config['UPLOAD_FOLDER']) / email_normalize(email)
-        thumbnail_file_location = base_path / 'thumbnails' / filename
         original_file_location = base_path / filename
 
-        if thumbnail_file_location.exists():
-            Path.unlink(thumbnail_file_location)
-            app.logger.debug('success:thumbnail file deleted:filepath:{}'.format(thumbnail_file_location))
-        else:
-            app.logger.debug('DEBUG:thumbnail file not exist:filepath:{}'.format(thumbnail_file_location))
+        for fmt in THUMBNAIL_MIMETYPES:
+            thumbnail_file_location = thumbnail_file(base_path / 'thumbnails', filename, fmt)
+            if thumbnail_file_location.exists():
+                Path.unlink(thumbnail_file_location)
+                app.logger.debug('success:thumbnail file deleted:filepath:{}'.format(thumbnail_file_location))
+            elif fmt == 'jpeg':
+                app.logger.debug('DEBUG:thumbnail file not exist:filepath:{}'.format(thumbnail_file_location))
 
         if original_file_location.exists():
             Path.unlink(original_file_location)
@@ -77,6 +150,33 @@ def delete(filename, email):
         raise e
 
 
+def send_photo(full_path, mimetype):
+    """
+    Stream an image file without loading it into memory.
+    The file is handed to the WSGI server (wsgi.file_wrapper / sendfile), Range requests get partial
+    content and If-None-Match / If-Modified-Since revalidate to 304. With PHOTO_ACCEL_REDIRECT or
+    USE_X_SENDFILE, the front web server sends the bytes instead.
+    :param full_path: pathlib.Path, image file under UPLOAD_FOLDER
+    :param mimetype: content type of the image
+    :return: flask.Response
+    """
+    accel_prefix = app.config['PHOTO_ACCEL_REDIRECT']
+    if accel_prefix:
+        # nginx serves the file from its internal location, including Range and conditional requests.
+        relative = full_path.relative_to(app.config['UPLOAD_FOLDER']).as_posix()
+        resp = app.response_class(mimetype=mimetype)
+        resp.headers['X-Accel-Redirect'] = '{0}/{1}'.format(accel_prefix.rstrip('/'), relative)
+    else:
+        resp = send_file(str(full_path), mimetype=mimetype, conditional=True,
+                         cache_timeout=app.config['PHOTO_MAX_AGE'])
+
+    # Photos belong to a signed-in user, shared caches must not keep them.
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    resp.headers['Vary'] = 'Accept'
+    return resp
+
+
 def save(upload_file, filename, email):
     """
     Upload input file (photo) to specific path for individual user.
@@ -91,7 +191,7 @@ def save(upload_file, filename, email):
 
     try:
         if not path.exists():
-            path.mkdir()
+            path.mkdir(exist_ok=True)
             app.logger.info("folder created:{}".format(str(path)))
 
         original_full_path = path / filename
@@ -108,27 +208,191 @@ def save(upload_file, filename, email):
         raise e
 
 
-def insert_basic_info(user_id, filename, filename_orig, filesize, form):
-    new_photo = Photo(user_id=user_id,
-                      filename=filename,
-                      filename_orig=filename_orig,
-                      filesize=filesize,
-                      upload_date=datetime.today(),
-                      tags=form['tags'],
-                      desc=form['desc'],
-                      geotag_lat=form['geotag_lat'],
-                      geotag_lng=form['geotag_lng'],
-                      taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S"),
-                      make=form['make'],
-                      model=form['model'],
-                      width=form['width'],
-                      height=form['height'],
-                      city=form['city'],
-                      nation=form['nation'],
-                      address=form['address'])
+def content_digest(upload_file):
+    """
+    SHA-256 of an uploaded file, read in chunks. The stream is rewound afterwards.
+    :param upload_file: file object
+    :return: hex digest
+    """
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: upload_file.stream.read(64 * 1024), b''):
+        sha256.update(chunk)
+    upload_file.stream.seek(0)
+    return sha256.hexdigest()
+
+
+def find_duplicate(user_id, content_hash):
+    """
+    Look up a photo of the same user with identical content.
+    :param user_id: user id
+    :param content_hash: SHA-256 hex digest of the original file
+    :return: Photo ORM object or None
+    """
+    return Photo.query.filter_by(user_id=user_id, content_hash=content_hash).first()
+
+
+def bump_album_version(user_id):
+    """
+    Increment the user's album version in the current transaction, the caller commits.
+    :param user_id: user id
+    :return: None
+    """
+    User.query.filter_by(id=user_id).update({User.album_version: User.album_version + 1},
+                                            synchronize_session=False)
+    photo_lists.pop(user_id)
+
+
+def album_version(user_id):
+    """
+    :param user_id: user id
+    :return: current album version of the user
+    """
+    return db.session.query(User.album_version).filter_by(id=user_id).scalar() or 0
+
+
+def cached_user_photos(user_id, version):
+    """
+    Every photo of a user as to_json() dicts, from the photo list cache while it holds the current album version.
+    Other workers bump the version too, so an entry for an older version is never served.
+    :param user_id: user id
+    :param version: current album version
+    :return: list of dicts ordered by id, None when the cache is disabled or the album is too large
+    """
+    if photo_lists.maxsize <= 0:
+        return None
+    cached = photo_lists.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    max_items = app.config['PHOTO_LIST_CACHE_MAX_ITEMS']
+    rows = Photo.query.filter_by(user_id=user_id).order_by(Photo.id).limit(max_items + 1).all()
+    photos = [photo.to_json() for photo in rows] if len(rows) <= max_items else None
+    photo_lists.set(user_id, (version, photos), ttl=app.config['PHOTO_LIST_CACHE_TTL'])
+    return photos
+
+
+def album_etag(user_id, version, *variant):
+    """
+    Strong ETag of a photo list response.
+    :param user_id: user id
+    :param version: album version
+    :param variant: anything else the body depends on, e.g. the query string
+    :return: ETag value (unquoted)
+    """
+    return hashlib.sha1(repr((user_id, version) + variant).encode('utf-8')).hexdigest()
+
+
+def photo_mapping(user_id, filename, filename_orig, filesize, form, content_hash=None):
+    """
+    Column values of a new photo.
+    :param form: parsed upload form
+    :return: dict of Photo attribute -> value
+    """
+    return dict(user_id=user_id,
+                content_hash=content_hash,
+                filename=filename,
+                filename_orig=filename_orig,
+                filesize=filesize,
+                upload_date=datetime.today(),
+                tags=form['tags'],
+                desc=form['desc'],
+                geotag_lat=form['geotag_lat'],
+                geotag_lng=form['geotag_lng'],
+                taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S") if form['taken_date'] else None,
+                make=form['make'],
+                model=form['model'],
+                width=form['width'],
+                height=form['height'],
+                city=form['city'],
+                nation=form['nation'],
+                address=form['address'])
+
+
+def insert_basic_info(user_id, filename, filename_orig, filesize, form, content_hash=None):
+    new_photo = Photo(**photo_mapping(user_id, filename, filename_orig, filesize, form, content_hash))
 
     app.logger.debug('new_photo: {0}'.format(new_photo))
     db.session.add(new_photo)
+    bump_album_version(user_id)
     db.session.commit()
 
 
+def is_allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def upload_photos(user_id, email, files, form):
+    """
+    Bulk upload: files are saved (original and thumbnail) by a pool of BULK_UPLOAD_CONCURRENCY threads,
+    thumbnails still go through the thumbnail process pool. The new photos are inserted with one
+    executemany and committed together with one album version bump.
+    :param user_id: user id
+    :param email: user email address
+    :param files: list of werkzeug.datastructures.FileStorage
+    :param form: parsed form, its fields (tags, desc, ...) apply to every file
+    :return: one result dict per file, in input order
+    """
+    results = [{'filename': upload.filename} for upload in files]
+    pending = []
+    hashes = {}
+    repeated = []
+    # the session is not shared with the pool threads, duplicates are looked up here
+    for upload, result in zip(files, results):
+        if not is_allowed_file(upload.filename or ''):
+            result['error'] = 'file format is not supported'
+            continue
+        content_hash = content_digest(upload)
+        if content_hash in hashes:
+            repeated.append((result, hashes[content_hash]))
+            continue
+        duplicate = find_duplicate(user_id, content_hash)
+        if duplicate is not None:
+            result.update(photo_id=duplicate.id, duplicate=True)
+            continue
+        extension = upload.filename.rsplit('.', 1)[1].lower()
+        filename = secure_filename('{0}.{1}'.format(uuid.uuid4(), extension))
+        hashes[content_hash] = result
+        pending.append((upload, result, filename, content_hash))
+
+    flask_app = app._get_current_object()
+
+    def store(upload, filename):
+        with flask_app.app_context():
+            return save(upload, filename, email)
+
+    rows = []
+    saved = {}
+    with ThreadPoolExecutor(max_workers=app.config['BULK_UPLOAD_CONCURRENCY']) as pool:
+        futures = [pool.submit(store, upload, filename) for upload, _, filename, _ in pending]
+        for (upload, result, filename, content_hash), future in zip(pending, futures):
+            try:
+                filesize = future.result()
+            except Exception as e:
+                app.logger.error('Bulk upload failed:user_id:{0}:{1}: {2}'.format(user_id, upload.filename, e))
+                result['error'] = 'upload failed'
+                continue
+            rows.append(photo_mapping(user_id, filename, upload.filename, filesize, form, content_hash))
+            saved[filename] = result
+
+    if rows:
+        try:
+            db.session.bulk_insert_mappings(Photo, rows)
+            bump_album_version(user_id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for filename in saved:
+                delete(filename, email)
+            raise e
+        committed = Photo.query.options(load_only('id', 'filename')) \
+            .filter(Photo.user_id == user_id, Photo.filename.in_(list(saved)))
+        for photo in committed:
+            saved[photo.filename]['photo_id'] = photo.id
+
+    # the same content sent twice in one request is stored once
+    for result, first in repeated:
+        if 'error' in first:
+            result['error'] = first['error']
+        else:
+            result.update(photo_id=first['photo_id'], duplicate=True)
+    return results
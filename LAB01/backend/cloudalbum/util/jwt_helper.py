@@ -7,31 +7,40 @@
     :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
     :license: MIT, see LICENSE for more details.
 """
-from sqlalchemy.orm.exc import NoResultFound
-
-blacklist_set = set()
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+from cloudalbum import revocations
 
 
 def add_token_to_set(decoded_token):
     """
-    Adds a new token to the set. It is not revoked when it is added.
-    :param identity_claim:
+    Revoke a signed-out token until it expires.
+    :param decoded_token: raw JWT claims of the token
     """
-
-    jti = decoded_token['jti']
-    blacklist_set.add(jti)
+    revocations.revoke(decoded_token['jti'], decoded_token['exp'])
 
 
 def is_blacklisted_token_set(decoded_token):
     """
-    Checks if the given token is revoked or not. Because we are adding all the
-    tokens that we create into this database, if the token is not present
-    in the database we are going to consider it revoked, as we don't know where
-    it was created.
-    """
-    jti = decoded_token['jti']
-    try:
-        if jti in blacklist_set:
-            return True
-    except NoResultFound:
-        return False
+    Checks if the given token is revoked or not.
+    """
+    return revocations.is_revoked(decoded_token['jti'])
+
+
+def handle_jwt_error(e):
+    """
+    flask-restplus answers 500 to any exception it has no handler for, so the 401 handlers
+    flask_jwt_extended registers on the application never run for requests routed to an Api.
+    :param e: missing, invalid, expired or revoked token
+    :return: 401 response
+    """
+    return {'ok': False, 'msg': str(e)}, 401
+
+
+def register_jwt_error_handler(api):
+    """
+    Answer 401 to token errors raised by the resources of a flask-restplus Api.
+    :param api: flask_restplus.Api
+    """
+    api.errorhandler(JWTExtendedException)(handle_jwt_error)
+    api.errorhandler(PyJWTError)(handle_jwt_error)
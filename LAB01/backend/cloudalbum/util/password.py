@@ -0,0 +1,152 @@
+"""
+    cloudalbum/util/password.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Thread pool which hashes and checks passwords off the request thread.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+
+class PasswordHasherBusy(Exception):
+    """Every hashing slot is taken, the caller should retry later."""
+
+
+def normalize_method(method):
+    """
+    Spell out the iteration count werkzeug fills in for 'pbkdf2:<hash>', stored hashes carry it.
+    :param method: werkzeug hash method, e.g. 'pbkdf2:sha256'
+    :return: method as it appears in the hashes, e.g. 'pbkdf2:sha256:150000'
+    """
+    if not method.startswith('pbkdf2:'):
+        return method
+    args = method[7:].split(':')
+    iterations = len(args) > 1 and int(args[1] or 0) or DEFAULT_PBKDF2_ITERATIONS
+    return 'pbkdf2:{0}:{1}'.format(args[0], iterations)
+
+
+class PasswordHasher(object):
+    """
+    Bounded thread pool for password hashing, owned by the application.
+    hashlib's PBKDF2 releases the GIL, so PASSWORD_HASH_WORKERS caps the cores spent on
+    hashing while the other request threads keep serving photos. At most
+    PASSWORD_HASH_QUEUE_DEPTH hashes are queued or running, beyond that PasswordHasherBusy
+    is raised at once instead of piling sign-in requests up behind each other. A hash still
+    running after PASSWORD_HASH_TIMEOUT also raises PasswordHasherBusy, its slot is only freed
+    when the hash is done.
+    """
+
+    def __init__(self, app=None):
+        self.pool = None
+        self.workers = 0
+        self.queue_depth = 0
+        self.method = 'pbkdf2:sha256'
+        self.timeout = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._stats = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.shutdown()
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.queue_depth = app.config['PASSWORD_HASH_QUEUE_DEPTH'] or self.workers * 4
+        self.method = normalize_method(app.config['PASSWORD_HASH_METHOD'])
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(self.queue_depth)
+        self._stats = dict(hashed=0, checked=0, rehashed=0, rejected=0, timeouts=0, in_flight=0, peak_in_flight=0)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+        app.extensions['password_hasher'] = self
+        app.logger.info('Password hashing pool: workers:{0}, queue_depth:{1}, method:{2}'.format(
+            self.workers, self.queue_depth, self.method))
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self._incr('rejected')
+            raise PasswordHasherBusy('Too many sign-in requests, retry later')
+        with self._lock:
+            self._stats['in_flight'] += 1
+            self._stats['peak_in_flight'] = max(self._stats['peak_in_flight'], self._stats['in_flight'])
+        slots, stats = self._slots, self._stats
+
+        def release(future=None):
+            slots.release()
+            with self._lock:
+                stats['in_flight'] -= 1
+
+        try:
+            future = self.pool.submit(fn, *args)
+        except BaseException:
+            release()
+            raise
+        future.add_done_callback(release)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self._incr('timeouts')
+            raise PasswordHasherBusy('Password hashing timed out, retry later')
+
+    def hash(self, password):
+        """
+        :param password: plain text password
+        :return: hash with the configured PASSWORD_HASH_METHOD
+        """
+        pwhash = self._run(generate_password_hash, password, self.method)
+        self._incr('hashed')
+        return pwhash
+
+    def check(self, pwhash, password):
+        """
+        :param pwhash: stored hash, its own method and cost are used
+        :param password: plain text password
+        :return: True if the password matches
+        """
+        matched = self._run(check_password_hash, pwhash, password)
+        self._incr('checked')
+        return matched
+
+    def needs_rehash(self, pwhash):
+        """
+        :param pwhash: stored hash
+        :return: True if it was made with other parameters than PASSWORD_HASH_METHOD
+        """
+        return pwhash.split('$', 1)[0] != self.method
+
+    def rehash(self, pwhash, password):
+        """
+        Upgrade a hash after a successful check with the plain text password.
+        :return: new hash, or None when pwhash is already up to date
+        """
+        if not self.needs_rehash(pwhash):
+            return None
+        new_hash = self.hash(password)
+        self._incr('rehashed')
+        return new_hash
+
+    def _incr(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """
+        Pool saturation metrics.
+        :return: dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        stats['queue_depth'] = self.queue_depth
+        stats['method'] = self.method
+        stats['saturation'] = stats['in_flight'] / self.queue_depth if self.queue_depth else 0
+        return stats
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
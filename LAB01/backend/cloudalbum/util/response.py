@@ -8,6 +8,13 @@
     :license: MIT, see LICENSE for more details.
 """
 import copy
+import datetime
+import decimal
+import json
+from flask import current_app as app, stream_with_context
+
+# Characters of encoded items buffered before a chunk is written to the client
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 dic_default_response = {
@@ -75,3 +82,52 @@ def response_with_msg_data(code, msg, data):
     except:
         # application.logger.debug("Undefined error: %s" % code)
         raise ValueError
+
+
+def json_default(o):
+    if isinstance(o, datetime.datetime):
+        return str(o)
+    if isinstance(o, decimal.Decimal):
+        return int(o) if o == o.to_integral_value() else float(o)
+    if isinstance(o, set):
+        return list(o)
+    raise TypeError('Object of type {0} is not JSON serializable'.format(type(o).__name__))
+
+
+_encoder = json.JSONEncoder(separators=(',', ':'), default=json_default)
+
+
+def iter_json_list(items, chunk_size=STREAM_CHUNK_SIZE, **extra):
+    """
+    Encode {'ok': true, 'photos': [...], **extra} chunk by chunk, items are pulled one at a time.
+    :param items: iterable of JSON serializable items
+    :param chunk_size: characters buffered before a chunk is yielded
+    :param extra: other top level keys, callables are called once every item has been encoded
+    :return: generator of str chunks
+    """
+    buffer, size = ['{"ok":true,"photos":['], 0
+    for count, item in enumerate(items):
+        encoded = _encoder.encode(item)
+        buffer.append(',' + encoded if count else encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    buffer.append(']')
+    for key, value in extra.items():
+        buffer.append(',{0}:{1}'.format(_encoder.encode(key), _encoder.encode(value() if callable(value) else value)))
+    buffer.append('}')
+    yield ''.join(buffer)
+
+
+def stream_response(items, code, **extra):
+    """
+    JSON list response written while the items are produced,
+    so memory use does not grow with the length of the list.
+    :param items: iterable of JSON serializable items
+    :param code: HTTP status code
+    :param extra: other top level keys, see iter_json_list
+    :return: streamed flask.Response
+    """
+    return app.response_class(stream_with_context(iter_json_list(items, **extra)), status=code,
+                              mimetype='application/json')
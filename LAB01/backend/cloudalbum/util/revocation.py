@@ -0,0 +1,182 @@
+"""
+    cloudalbum/util/revocation.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Revocation of signed-out JWT tokens.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime
+
+
+class BloomFilter(object):
+    """
+    Fixed size Bloom filter over strings. False positives are possible, false negatives are not.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        # m = -n ln(p) / ln(2)^2 bits, k = m / n ln(2) hash functions
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.sha256(value.encode('utf-8')).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class MemoryRevocationBackend(object):
+    """
+    Revoked jtis of this process only. Other workers do not see them.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, jti, exp):
+        with self._lock:
+            self._entries[jti] = exp
+
+    def is_revoked(self, jti):
+        exp = self._entries.get(jti)
+        return exp is not None and exp > time.time()
+
+    def active(self):
+        now = time.time()
+        with self._lock:
+            return [jti for jti, exp in self._entries.items() if exp > now]
+
+    def prune(self):
+        now = time.time()
+        with self._lock:
+            for jti in [jti for jti, exp in self._entries.items() if exp <= now]:
+                del self._entries[jti]
+
+
+class SQLAlchemyRevocationBackend(object):
+    """
+    Revoked jtis in a table, shared by every worker using the database.
+    """
+
+    def __init__(self, db, model):
+        """
+        :param db: flask_sqlalchemy.SQLAlchemy
+        :param model: mapped class with jti and exp (UTC datetime) columns
+        """
+        self.db = db
+        self.model = model
+
+    def revoke(self, jti, exp):
+        self.db.session.merge(self.model(jti=jti, exp=datetime.utcfromtimestamp(exp)))
+        self.db.session.commit()
+
+    def is_revoked(self, jti):
+        query = self.db.session.query(self.model.jti)
+        return query.filter(self.model.jti == jti, self.model.exp > datetime.utcnow()).first() is not None
+
+    def active(self):
+        query = self.db.session.query(self.model.jti)
+        return [row.jti for row in query.filter(self.model.exp > datetime.utcnow())]
+
+    def prune(self):
+        self.model.query.filter(self.model.exp <= datetime.utcnow()).delete(synchronize_session=False)
+        self.db.session.commit()
+
+
+class RevocationStore(object):
+    """
+    Signed-out tokens by jti, each kept until the token's exp.
+    A local Bloom filter answers the common "not revoked" case without leaving the process. It is
+    rebuilt from the backend every sync_interval seconds, which also picks up the revocations of
+    other workers and prunes expired entries. Only filter hits are confirmed with the backend.
+    """
+
+    def __init__(self, backend=None, sync_interval=5, capacity=100000):
+        self.backend = backend or MemoryRevocationBackend()
+        self.sync_interval = sync_interval
+        self.capacity = capacity
+        self._filter = BloomFilter(capacity)
+        self._synced_at = None
+        self._lock = threading.Lock()
+        self._stats = dict(checks=0, filter_hits=0, revoked=0, syncs=0)
+
+    def init_app(self, app):
+        """
+        :param app: Flask.application
+        """
+        backend = app.config['REVOCATION_BACKEND']
+        if backend == 'database':
+            from cloudalbum import db
+            from cloudalbum.database.models import RevokedToken
+            self.backend = SQLAlchemyRevocationBackend(db, RevokedToken)
+        elif backend == 'memory':
+            self.backend = MemoryRevocationBackend()
+        else:
+            raise ValueError('Unknown REVOCATION_BACKEND: {0}'.format(backend))
+        self.sync_interval = app.config['REVOCATION_SYNC_INTERVAL']
+        self.capacity = app.config['REVOCATION_FILTER_CAPACITY']
+        with self._lock:
+            self._filter, self._synced_at = BloomFilter(self.capacity), None
+        app.extensions['revocations'] = self
+
+    def revoke(self, jti, exp):
+        """
+        :param jti: token id
+        :param exp: token expiry, epoch seconds
+        """
+        self.backend.revoke(jti, exp)
+        with self._lock:
+            self._filter.add(jti)
+
+    def is_revoked(self, jti):
+        """
+        :param jti: token id
+        :return: True if the token was signed out
+        """
+        self._stats['checks'] += 1
+        if self._synced_at is None or time.monotonic() - self._synced_at > self.sync_interval:
+            self.sync()
+        if jti not in self._filter:
+            return False
+        self._stats['filter_hits'] += 1
+        revoked = self.backend.is_revoked(jti)
+        if revoked:
+            self._stats['revoked'] += 1
+        return revoked
+
+    def sync(self):
+        """
+        Prune expired entries and rebuild the filter from the backend.
+        """
+        with self._lock:
+            if self._synced_at is not None and time.monotonic() - self._synced_at <= self.sync_interval:
+                return
+            self.backend.prune()
+            rebuilt = BloomFilter(self.capacity)
+            for jti in self.backend.active():
+                rebuilt.add(jti)
+            self._filter, self._synced_at = rebuilt, time.monotonic()
+            self._stats['syncs'] += 1
+
+    def stats(self):
+        """
+        Revocation check metrics.
+        :return: dict
+        """
+        stats = dict(self._stats)
+        stats['backend'] = type(self.backend).__name__
+        return stats
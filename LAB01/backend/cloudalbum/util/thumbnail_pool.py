@@ -0,0 +1,126 @@
+"""
+    cloudalbum/util/thumbnail_pool.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Process pool which renders thumbnails off the request thread.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ThumbnailExecutor(object):
+    """
+    Bounded process pool for CPU bound thumbnail rendering, owned by the application.
+    At most THUMBNAIL_QUEUE_DEPTH jobs are in flight. When the pool is saturated or
+    disabled (THUMBNAIL_WORKERS = 0), the job runs on the calling thread.
+    A pool broken by a dying worker process is replaced by a new one.
+    """
+
+    def __init__(self, app=None):
+        self.pool = None
+        self.workers = 0
+        self.queue_depth = 0
+        self.timeout = None
+        self.wait = True
+        self._slots = None
+        self._lock = threading.Lock()
+        self._stats = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.shutdown()
+        self.workers = app.config['THUMBNAIL_WORKERS']
+        self.queue_depth = app.config['THUMBNAIL_QUEUE_DEPTH'] or max(self.workers * 2, 1)
+        self.timeout = app.config['THUMBNAIL_TIMEOUT']
+        self.wait = app.config['THUMBNAIL_WAIT']
+        self._slots = threading.BoundedSemaphore(self.queue_depth)
+        self._stats = dict(submitted=0, completed=0, failed=0, timeouts=0, fallbacks=0, restarts=0,
+                           in_flight=0, peak_in_flight=0)
+
+        # Worker processes are started lazily on the first submit, i.e. after gunicorn forked its workers.
+        if self.workers > 0:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        app.extensions['thumbnail_executor'] = self
+        app.logger.info('Thumbnail pool: workers:{0}, queue_depth:{1}'.format(self.workers, self.queue_depth))
+
+    def run(self, fn, *args):
+        """
+        Run fn(*args) in the process pool.
+        :param fn: picklable module level function
+        :return: fn result, or None when not waiting (THUMBNAIL_WAIT).
+                 Raises TimeoutError when THUMBNAIL_TIMEOUT expired.
+        """
+        pool = self.pool
+        if pool is None or not self._slots.acquire(blocking=False):
+            self._incr('fallbacks')
+            return fn(*args)
+
+        try:
+            future = pool.submit(fn, *args)
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._slots.release()
+            if isinstance(e, BrokenProcessPool):
+                self._restart(pool)
+            self._incr('fallbacks')
+            return fn(*args)
+
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['in_flight'] += 1
+            self._stats['peak_in_flight'] = max(self._stats['peak_in_flight'], self._stats['in_flight'])
+        future.add_done_callback(self._done)
+
+        if not self.wait:
+            return None
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # The job keeps running in the pool, the request just stops waiting for it.
+            self._incr('timeouts')
+            raise
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory), the job is not retried on the request thread.
+            self._restart(pool)
+            raise
+
+    def _restart(self, broken):
+        with self._lock:
+            if self.pool is not broken:
+                return
+            broken.shutdown(wait=False)
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._stats['restarts'] += 1
+
+    def _done(self, future):
+        self._slots.release()
+        with self._lock:
+            self._stats['in_flight'] -= 1
+            self._stats['failed' if future.cancelled() or future.exception() else 'completed'] += 1
+
+    def _incr(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """
+        Pool saturation metrics.
+        :return: dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        stats['queue_depth'] = self.queue_depth
+        stats['cpu_count'] = os.cpu_count()
+        stats['saturation'] = stats['in_flight'] / self.queue_depth if self.queue_depth else 0
+        return stats
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
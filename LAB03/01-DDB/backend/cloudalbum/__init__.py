@@ -11,6 +11,7 @@ from flask_cors import CORS
 from flask_login import LoginManager
 from flask_jwt_extended import JWTManager
 from flask_bcrypt import Bcrypt
+from cloudalbum.util.password import PasswordHasher
 
 class JSONEncoder(json.JSONEncoder):
     ''' extend json-encoder class'''
@@ -28,6 +29,7 @@ class JSONEncoder(json.JSONEncoder):
 db = SQLAlchemy()
 login = LoginManager()
 jwt = JWTManager()
+password_hasher = PasswordHasher()
 
 
 def create_app(script_info=None):
@@ -60,6 +62,7 @@ def create_app(script_info=None):
 
     # set up extensions
     # database.init_app(application)
+    password_hasher.init_app(app)
 
     # register blueprints
     from cloudalbum.api.users import users_blueprint
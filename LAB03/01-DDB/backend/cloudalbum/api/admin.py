@@ -4,6 +4,7 @@ import boto3
 from flask import Blueprint
 from flask import current_app as app
 from flask_restplus import Api, Resource
+from cloudalbum import password_hasher
 from cloudalbum.util.response import m_response, err_response
 import shutil
 from botocore.exceptions import ClientError
@@ -48,6 +49,14 @@ class HealthCheck(Resource):
             return err_response({'msg': 'healthcheck failed', "hostname": get_ip_addr()}, 500)
 
 
+@api.route('/password_hasher')
+class PasswordHashPool(Resource):
+    @api.doc(responses={200: 'password hashing pool saturation metrics'})
+    def get(self):
+        """Password hashing pool metrics"""
+        return m_response(password_hasher.stats(), 200)
+
+
 def get_ip_addr():
     return '{0}'.format(socket.gethostname())
 
@@ -5,12 +5,13 @@ from flask_jwt_extended import (create_access_token, create_refresh_token, jwt_r
 from flask import jsonify, make_response
 from flask_restplus import Api, Resource, fields
 from jsonschema import ValidationError
-from werkzeug.security import check_password_hash
+from cloudalbum import password_hasher
 from cloudalbum.schemas import validate_user
 from cloudalbum.database.model_ddb import User
 from cloudalbum.solution import solution_put_new_user, solution_get_user_data_with_idx
 from cloudalbum.util.response import m_response, err_response
 from cloudalbum.util.jwt_helper import add_token_to_set
+from cloudalbum.util.password import PasswordHasherBusy
 
 
 users_blueprint = Blueprint('users', __name__)
@@ -152,6 +153,9 @@ class Signup(Resource):
             app.logger.error('ERROR:invalid signup data format:{0}'.format(req_data))
             app.logger.error(e)
             return err_response( e.message, 400)
+        except PasswordHasherBusy as e:
+            app.logger.error('ERROR:signup rejected:{}'.format(e))
+            return err_response( str(e), 503)
         except Exception as e:
             app.logger.error('ERROR:unexpected signup error:{}'.format(req_data))
             app.logger.error(e)
@@ -179,7 +183,11 @@ class Signin(Resource):
 
             token_data = {'user_id': db_user.id, 'username':db_user.username, 'email':db_user.email}
 
-            if db_user is not None and check_password_hash(db_user.password, signin_data['password']):
+            if db_user is not None and password_hasher.check(db_user.password, signin_data['password']):
+                new_hash = password_hasher.rehash(db_user.password, signin_data['password'])
+                if new_hash is not None:
+                    db_user.update(actions=[User.password.set(new_hash)])
+                    app.logger.info('Password hash upgraded to {0}: {1}'.format(password_hasher.method, db_user.id))
 
                 access_token = create_access_token(identity=token_data)
                 refresh_token = create_refresh_token(identity=token_data)
@@ -195,6 +203,9 @@ class Signin(Resource):
             app.logger.error(e)
 
             return err_response( e.message, 400)
+        except PasswordHasherBusy as e:
+            app.logger.error('ERROR:signin rejected:{}'.format(e))
+            return err_response( str(e), 503)
         except Exception as e:
             app.logger.error('ERROR:unexpected error:{0}'.format(req_data))
             app.logger.error(e)
@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from flask import current_app as app
-from werkzeug.security import generate_password_hash
+from cloudalbum import password_hasher
 from cloudalbum.database.model_ddb import User, Photo
 
 
@@ -12,7 +12,7 @@ def solution_put_new_user(new_user_id, user_data):
 
     user = User(new_user_id)
     user.email = user_data['email']
-    user.password = generate_password_hash(user_data['password'])
+    user.password = password_hasher.hash(user_data['password'])
     user.username = user_data['username']
     user.save()
 
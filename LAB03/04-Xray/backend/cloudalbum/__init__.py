@@ -12,6 +12,10 @@ from flask_cors import CORS
 from flask_login import LoginManager
 from flask_jwt_extended import JWTManager
 from flask_bcrypt import Bcrypt
+from cloudalbum.util.job_queue import PhotoJobQueue
+from cloudalbum.util.cache import LRUCache
+from cloudalbum.util.jwks import KeyRegistry
+from cloudalbum.util.revocation import RevocationStore
 
 
 class JSONEncoder(json.JSONEncoder):
@@ -28,6 +32,13 @@ class JSONEncoder(json.JSONEncoder):
 
 login = LoginManager()
 jwt = JWTManager()
+photo_jobs = PhotoJobQueue()
+presigned_urls = LRUCache()
+photo_lists = LRUCache()
+jwks = KeyRegistry()
+verified_tokens = LRUCache()
+cognito_users = LRUCache()
+revocations = RevocationStore()
 
 
 def create_app(script_info=None):
@@ -68,6 +79,18 @@ def create_app(script_info=None):
     app.logger.addHandler(logging.StreamHandler(sys.stdout))
     app.logger.setLevel(logging.DEBUG)
 
+    presigned_urls.init_app(app, 'presigned_urls', app.config['PRESIGNED_URL_CACHE_SIZE'])
+    photo_lists.init_app(app, 'photo_lists', app.config['PHOTO_LIST_CACHE_SIZE'])
+    jwks.init_app(app)
+    verified_tokens.init_app(app, 'verified_tokens', app.config['VERIFIED_TOKEN_CACHE_SIZE'])
+    cognito_users.init_app(app, 'cognito_users', app.config['COGNITO_USER_CACHE_SIZE'])
+    revocations.init_app(app)
+
+    # create the DynamoDB tables which do not exist yet
+    from cloudalbum.database import create_table
+    with app.app_context():
+        create_table()
+
     # register blueprints
     from cloudalbum.api.users import users_blueprint
     app.register_blueprint(users_blueprint, url_prefix='/users')
@@ -78,6 +101,10 @@ def create_app(script_info=None):
     from cloudalbum.api.admin import admin_blueprint
     app.register_blueprint(admin_blueprint, url_prefix='/admin')
 
+    # start post-upload processing workers
+    from cloudalbum.util.file_control import process_photo, mark_processing_failed
+    photo_jobs.init_app(app, process_photo, mark_processing_failed)
+
     @jwt.token_in_blacklist_loader
     def check_if_token_in_blacklist_DB(decrypted_token):
         from cloudalbum.util.jwt_helper import is_blacklisted_token_set
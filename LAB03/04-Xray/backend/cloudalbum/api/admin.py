@@ -5,6 +5,7 @@ from flask import Blueprint
 from flask import current_app as app
 from flask_restplus import Api, Resource
 from cloudalbum.util.response import m_response, err_response
+from cloudalbum import photo_jobs, revocations
 import shutil
 from botocore.exceptions import ClientError
 
@@ -47,6 +48,31 @@ class HealthCheck(Resource):
             return err_response({'msg': 'healthcheck failed', "hostname": get_ip_addr()}, 500)
 
 
+@api.route('/photo_jobs')
+class PhotoJobs(Resource):
+    @api.doc(responses={200: 'post-upload processing queue status'})
+    def get(self):
+        """Post-upload processing queue status"""
+        return m_response(photo_jobs.stats(), 200)
+
+
+@api.route('/caches')
+class Caches(Resource):
+    @api.doc(responses={200: 'in-process cache metrics'})
+    def get(self):
+        """Hit/miss counters of the in-process caches"""
+        caches = app.extensions.get('caches', {})
+        return m_response({name: cache.stats() for name, cache in caches.items()}, 200)
+
+
+@api.route('/revocations')
+class Revocations(Resource):
+    @api.doc(responses={200: 'token revocation check metrics'})
+    def get(self):
+        """Revocation checks answered by the local filter and by the backend"""
+        return m_response(revocations.stats(), 200)
+
+
 def get_ip_addr():
     return '{0}'.format(socket.gethostname())
 
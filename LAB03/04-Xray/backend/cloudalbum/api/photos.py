@@ -1,15 +1,22 @@
 from flask import Blueprint, request
 from flask_restplus import Api, Resource, fields
 
-from cloudalbum.util.jwt_helper import cog_jwt_required, get_token_from_header, get_cognito_user
-from cloudalbum.util.response import m_response, err_response
+from cloudalbum.util.jwt_helper import cog_jwt_required
+from cloudalbum.util.response import m_response, err_response, stream_response, traced_items
+from cloudalbum.util.pagination import encode_cursor, page_args
 from werkzeug.datastructures import FileStorage
 from flask import current_app as app
 from werkzeug.utils import secure_filename
 
 from cloudalbum.util.file_control import delete_s3, save_s3, create_photo_info, presigned_url, with_presigned_url
+from cloudalbum.util.file_control import content_digest, find_duplicate
+from cloudalbum.util.file_control import negotiate_thumbnail_format, photo_thumbnail_format
+from cloudalbum.util.file_control import parse_fields, list_photos
+from cloudalbum.util.file_control import ALLOWED_EXTENSIONS, upload_photos, delete_photos
+from cloudalbum.util.file_control import album_version, bump_album_version, album_etag
 from cloudalbum.database.model_ddb import Photo
 from cloudalbum.solution import solution_put_photo_info_ddb
+from cloudalbum import photo_jobs
 import uuid
 
 authorizations = {
@@ -48,9 +55,19 @@ photo_info = api.model('New_photo', {
     'address': fields.String
 })
 
+bulk_delete = api.model('Bulk_delete', {
+    'photo_ids': fields.List(fields.String, required=True)
+})
+
 photo_get_parser = api.parser()
 photo_get_parser.add_argument('mode', type=str, location='args')
 
+photo_list_parser = api.parser()
+photo_list_parser.add_argument('limit', type=int, location='args', help='page size, the whole list without it')
+photo_list_parser.add_argument('cursor', type=str, location='args', help='cursor of the previous page')
+photo_list_parser.add_argument('fields', type=str, location='args',
+                               help='comma separated fields to return, e.g. id,thumbSrc,taken_date')
+
 file_upload_parser = api.parser()
 file_upload_parser.add_argument('file', location='files', type=FileStorage, required=True)
 file_upload_parser.add_argument('tags', type=str, location='form')
@@ -66,13 +83,17 @@ file_upload_parser.add_argument('city', type=str, location='form')
 file_upload_parser.add_argument('address', type=str, location='form')
 file_upload_parser.add_argument('nation', type=str, location='form')
 
+bulk_upload_parser = file_upload_parser.copy()
+bulk_upload_parser.remove_argument('file')
+bulk_upload_parser.add_argument('files', location='files', type=FileStorage, required=True, action='append')
+
 
 @api.route('/ping')
 @api.doc('photos ping!')
 class Ping(Resource):
     @api.doc(responses={200: 'pong success'})
     @cog_jwt_required
-    def get(self):
+    def get(self, principal):
 
         app.logger.debug('success:pong!')
         return m_response({'msg': 'pong!'}, 200)
@@ -82,36 +103,102 @@ class Ping(Resource):
 @api.expect(file_upload_parser)
 class FileUpload(Resource):
     @cog_jwt_required
-    def post(self):
-        token = get_token_from_header(request)
+    def post(self, principal):
+        user_id = None
         try:
             app.logger.debug(dir(file_upload_parser))
             form = file_upload_parser.parse_args()
             filename_orig = form['file'].filename
             extension = (filename_orig.rsplit('.', 1)[1]).lower()
 
-            if extension.lower() not in ['jpg', 'jpeg', 'bmp', 'gif', 'png']:
+            if extension.lower() not in ALLOWED_EXTENSIONS:
                 app.logger.error('ERROR:file format is not supported:{0}'.format(filename_orig))
                 return err_response('ERROR:file format is not supported:{0}'.format(filename_orig),  400)
 
-            current_user = get_cognito_user(token)
+            current_user = principal.user
+            user_id = current_user['user_id']
+
+            content_hash = content_digest(form['file'])
+            duplicate_id = find_duplicate(user_id, content_hash)
+            if duplicate_id:
+                app.logger.debug('duplicate upload:user_id:{0}, photo_id:{1}'.format(user_id, duplicate_id))
+                return m_response({"photo_id": duplicate_id, "duplicate": True}, 200)
 
             filename = secure_filename("{0}.{1}".format(uuid.uuid4(), extension))
             filesize = save_s3(form['file'], filename, current_user['email'])
 
-            user_id = current_user['user_id']
-
-            new_photo = create_photo_info(user_id, filename, filesize, form)
+            new_photo = create_photo_info(user_id, filename, filesize, form, content_hash)
 
             solution_put_photo_info_ddb(user_id, new_photo)
+            bump_album_version(user_id)
+            photo_jobs.enqueue(user_id, filename, current_user['email'])
+
+            return m_response({"photo_id": filename, "processing_state": new_photo.processing_state}, 200)
+        except Exception as e:
+            app.logger.error('ERROR:file upload failed:user_id:{}'.format(user_id))
+            app.logger.error(e)
+            return err_response(e, 500)
+
+
+@api.route('/files')
+@api.expect(bulk_upload_parser)
+class BulkFileUpload(Resource):
+    @api.doc(responses={
+        200: "One result per file: photo_id and processing_state, photo_id and duplicate, or error",
+        400: "Too many files",
+        500: "Internal server error"
+    })
+    @cog_jwt_required
+    def post(self, principal):
+        """Upload many photos in one request, the form fields apply to every file"""
+        user_id = None
+        try:
+            form = bulk_upload_parser.parse_args()
+            if len(form['files']) > app.config['BULK_UPLOAD_MAX_FILES']:
+                app.logger.error('ERROR:too many files:{0}'.format(len(form['files'])))
+                return err_response('ERROR:too many files, max:{0}'.format(app.config['BULK_UPLOAD_MAX_FILES']), 400)
+
+            current_user = principal.user
+            user_id = current_user['user_id']
 
-            return m_response({"photo_id": filename}, 200)
+            results = upload_photos(user_id, current_user['email'], form['files'], form)
+            app.logger.debug('success:bulk upload:user_id:{0}, files:{1}'.format(user_id, len(results)))
+            return m_response({'results': results}, 200)
         except Exception as e:
-            app.logger.error('ERROR:file upload failed:user_id:{}'.format(get_cognito_user(token)['user_id']))
+            app.logger.error('ERROR:bulk upload failed:user_id:{}'.format(user_id))
             app.logger.error(e)
             return err_response(e, 500)
 
 
+@api.route('/delete')
+class BulkDelete(Resource):
+    @api.doc(responses={
+        200: "One result per photo id: deleted, or error",
+        400: "Invalid or too many photo ids",
+        500: "Internal server error"
+    })
+    @cog_jwt_required
+    @api.expect(bulk_delete)
+    def post(self, principal):
+        """Delete many photos in one request"""
+        body = request.get_json(silent=True)
+        photo_ids = body.get('photo_ids') if isinstance(body, dict) else None
+        if not isinstance(photo_ids, list) or not all(isinstance(photo_id, str) for photo_id in photo_ids):
+            return err_response('ERROR:photo_ids must be a list of photo ids', 400)
+        if len(photo_ids) > app.config['BULK_DELETE_MAX_IDS']:
+            return err_response('ERROR:too many photo ids, max:{0}'.format(app.config['BULK_DELETE_MAX_IDS']), 400)
+
+        user_id = None
+        try:
+            user = principal.user
+            user_id = user['user_id']
+            results = delete_photos(user_id, user['email'], photo_ids)
+            app.logger.debug('success:bulk delete:user_id:{0}, photos:{1}'.format(user_id, len(results)))
+            return m_response({'results': results}, 200)
+        except Exception as e:
+            app.logger.error('ERROR:bulk delete failed:user_id:{}'.format(user_id))
+            app.logger.error(e)
+            return err_response(e, 500)
 
 
 @api.route('/')
@@ -119,24 +206,49 @@ class List(Resource):
     @api.doc(
         responses=
         {
-            200: "Return the whole photos list",
+            200: "Return the whole photos list, or one page of it with limit/cursor",
+            304: "Album unchanged since the ETag in If-None-Match",
+            400: "Invalid limit, cursor or fields",
             500: "Internal server error"
         }
     )
     @cog_jwt_required
-    def get(self):
+    @api.expect(photo_list_parser)
+    def get(self, principal):
         """Get all photos as list"""
-        token = get_token_from_header(request)
         try:
-            user = get_cognito_user(token)
-            photos = Photo.query(user['user_id'])
+            limit, after = page_args(request.args, app.config['PHOTO_PAGE_MAX_LIMIT'])
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return err_response(str(e), 400)
+
+        try:
+            user = principal.user
+            fmt = negotiate_thumbnail_format(request.accept_mimetypes)
+            version = album_version(user['user_id'])
+            etag = album_etag(user['user_id'], version, request.query_string, fmt)
+            if request.if_none_match.contains(etag):
+                resp = app.response_class(status=304)
+                resp.set_etag(etag)
+                resp.headers['Vary'] = 'Accept'
+                return resp
 
-            data = {'photos': []}
-            [data['photos'].append(with_presigned_url(user, photo)) for photo in photos]
+            photos, next_id = list_photos(user['user_id'], version, limit, after, fields)
+            items = (with_presigned_url(user, photo, fmt, fields) for photo in photos)
 
-            app.logger.debug("success:photos_list:{}".format(data))
+            app.logger.debug("success:photos_list:user_id:{}".format(user['user_id']))
 
-            return m_response(data['photos'], 200)
+            items = traced_items(items, 'photos_list')
+
+            if limit is None:
+                resp = stream_response(items, 200)
+            else:
+                resp = stream_response(items, 200, cursor=lambda: encode_cursor(next_id()) if next_id() else None)
+            resp.set_etag(etag)
+            resp.cache_control.private = True
+            resp.cache_control.no_cache = True
+            resp.headers['Vary'] = 'Accept'
+            return resp
         except Exception as e:
             app.logger.error("ERROR:photos list failed")
             app.logger.error(e)
@@ -154,13 +266,13 @@ class OnePhoto(Resource):
         }
     )
     @cog_jwt_required
-    def delete(self, photo_id):
+    def delete(self, photo_id, principal):
         """one photo delete"""
-        token = get_token_from_header(request)
         try:
-            user = get_cognito_user(token)
+            user = principal.user
             photo = Photo.get(user['user_id'], photo_id)
             photo.delete()
+            bump_album_version(user['user_id'])
 
             file_deleted = delete_s3(photo.filename, user['email'])
 
@@ -187,14 +299,17 @@ class OnePhoto(Resource):
     )
     @cog_jwt_required
     @api.expect(photo_get_parser)
-    def get(self, photo_id):
-        token = get_token_from_header(request)
+    def get(self, photo_id, principal):
         try:
             mode = request.args.get('mode')
-            user = get_cognito_user(token)
+            user = principal.user
             email = user['email']
 
-            return presigned_url(photo_id, email, True if mode else False)
+            fmt = negotiate_thumbnail_format(request.accept_mimetypes) if mode else 'jpeg'
+            if fmt != 'jpeg':
+                fmt = photo_thumbnail_format(Photo.get(user['user_id'], photo_id), fmt)
+
+            return presigned_url(photo_id, email, True if mode else False, fmt)
         except Exception as e:
             app.logger.error('ERROR:get photo failed:photo_id:{}'.format(photo_id))
             app.logger.error(e)
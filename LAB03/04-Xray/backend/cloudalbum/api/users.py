@@ -8,7 +8,7 @@ from jsonschema import ValidationError
 from cloudalbum.schemas import validate_user
 from cloudalbum.solution import solution_signup_cognito
 from cloudalbum.util.response import m_response, err_response
-from cloudalbum.util.jwt_helper import add_token_to_set, get_token_from_header, get_cognito_user, cog_jwt_required
+from cloudalbum.util.jwt_helper import add_token_to_set, cog_jwt_required
 
 
 users_blueprint = Blueprint('users', __name__)
@@ -231,14 +231,15 @@ class Signout(Resource):
         200:'signout success',
         500:'login required'
     })
-    def delete(self):
+    def delete(self, principal):
         """user signout"""
-        token = get_token_from_header(request)
+        token = principal.token
         try:
             client = boto3.client('cognito-idp')
             response = client.global_sign_out(
                 AccessToken=token
             )
+            add_token_to_set(token)
 
             app.logger.debug("Access token expired: {}".format(token))
             return m_response({'accessToken':token}, 200)
@@ -15,8 +15,27 @@ class BaseConfig:
     JWT_BLACKLIST_TOKEN_CHECKS = ['access']
 
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(os.getcwd(), '/tmp'))
-    THUMBNAIL_WIDTH = os.getenv('THUMBNAIL_WIDTH', 300)
-    THUMBNAIL_HEIGHT = os.getenv('THUMBNAIL_HEIGHT', 200)
+    THUMBNAIL_WIDTH = int(os.getenv('THUMBNAIL_WIDTH', 300))
+    THUMBNAIL_HEIGHT = int(os.getenv('THUMBNAIL_HEIGHT', 200))
+    THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 85))
+    # Thumbnail formats in preference order, formats this Pillow build cannot encode are skipped
+    THUMBNAIL_FORMATS = os.getenv('THUMBNAIL_FORMATS', 'avif,webp,jpeg').split(',')
+
+    # Renditions encoded from one decode of each upload: name -> (max width, max height)
+    THUMBNAIL_RENDITIONS = {
+        'grid': (THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT),
+        'preview': (int(os.getenv('PREVIEW_WIDTH', 1024)), int(os.getenv('PREVIEW_HEIGHT', 768))),
+        'hero': (int(os.getenv('HERO_WIDTH', 2048)), int(os.getenv('HERO_HEIGHT', 1536))),
+    }
+
+    # Post-upload processing queue, JOB_QUEUE_WORKERS=0 processes each upload inline.
+    JOB_QUEUE_DB = os.getenv('JOB_QUEUE_DB', os.path.join(UPLOAD_FOLDER, 'cloudalbum_jobs.db'))
+    JOB_QUEUE_WORKERS = int(os.getenv('JOB_QUEUE_WORKERS', 2))
+    JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv('JOB_QUEUE_MAX_ATTEMPTS', 5))
+    JOB_QUEUE_POLL_INTERVAL = float(os.getenv('JOB_QUEUE_POLL_INTERVAL', 5))
+    JOB_QUEUE_LEASE = float(os.getenv('JOB_QUEUE_LEASE', 300))
+    # Failed jobs are deleted this many seconds after their last attempt
+    JOB_QUEUE_FAILED_RETENTION = float(os.getenv('JOB_QUEUE_FAILED_RETENTION', 7 * 24 * 3600))
 
     AWS_REGION = os.getenv('AWS_REGION', 'ap-southeast-1')
 
@@ -24,15 +43,52 @@ class BaseConfig:
     DDB_RCU = os.getenv('DDB_RCU', 10)
     DDB_WCU = os.getenv('DDB_WCU', 10)
 
+    # Photo list pages, ?limit= is capped to this
+    PHOTO_PAGE_MAX_LIMIT = int(os.getenv('PHOTO_PAGE_MAX_LIMIT', 1000))
+    # Per-user photo list cache (number of users), entries are also dropped when the album version changes.
+    # Albums with more than PHOTO_LIST_CACHE_MAX_ITEMS photos are always read from DynamoDB.
+    PHOTO_LIST_CACHE_SIZE = int(os.getenv('PHOTO_LIST_CACHE_SIZE', 1000))
+    PHOTO_LIST_CACHE_TTL = float(os.getenv('PHOTO_LIST_CACHE_TTL', 300))
+    PHOTO_LIST_CACHE_MAX_ITEMS = int(os.getenv('PHOTO_LIST_CACHE_MAX_ITEMS', 5000))
+
     # S3
     S3_PHOTO_BUCKET = os.getenv('S3_PHOTO_BUCKET', 'cloudalbum-<your-initial>')
     S3_PRESIGNED_URL_EXPIRE_TIME = os.getenv('S3_PRESIGNED_URL_EXPIRE_TIME', 3600)
+    # A presigned URL is handed out again until this fraction of its lifetime has elapsed
+    PRESIGNED_URL_CACHE_SIZE = int(os.getenv('PRESIGNED_URL_CACHE_SIZE', 10000))
+    PRESIGNED_URL_REUSE_FRACTION = float(os.getenv('PRESIGNED_URL_REUSE_FRACTION', 0.5))
+    # Originals above the threshold are sent as a multipart upload, S3_UPLOAD_CONCURRENCY parts at a time.
+    S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024))
+    S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024))
+    S3_UPLOAD_CONCURRENCY = int(os.getenv('S3_UPLOAD_CONCURRENCY', 4))
+    # POST /photos/files: files per request, and originals uploaded to S3 at the same time
+    BULK_UPLOAD_MAX_FILES = int(os.getenv('BULK_UPLOAD_MAX_FILES', 500))
+    BULK_UPLOAD_CONCURRENCY = int(os.getenv('BULK_UPLOAD_CONCURRENCY', 8))
+    # POST /photos/delete: photo ids per request
+    BULK_DELETE_MAX_IDS = int(os.getenv('BULK_DELETE_MAX_IDS', 1000))
 
     # Cognito
     COGNITO_POOL_ID = os.getenv('COGNITO_POOL_ID', '<YOUR_POOL_ID>')
     COGNITO_CLIENT_ID = os.getenv('COGNITO_CLIENT_ID', '<YOUR_CLIENT_ID>')
     COGNITO_CLIENT_SECRET = os.getenv('COGNITO_CLIENT_SECRET', '<YOUR_CLIENT_SECRET>')
     COGNITO_DOMAIN = os.getenv('COGNITO_DOMAIN', '<YOUR_COGNITO_DOMAIN>')
+    # User pool signing keys: background refresh after JWKS_TTL seconds,
+    # reload on an unknown kid at most once per JWKS_MIN_RELOAD_INTERVAL seconds.
+    JWKS_TTL = int(os.getenv('JWKS_TTL', 3600))
+    JWKS_MIN_RELOAD_INTERVAL = int(os.getenv('JWKS_MIN_RELOAD_INTERVAL', 30))
+    # Claims of verified tokens, kept until the token expires (number of tokens)
+    VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv('VERIFIED_TOKEN_CACHE_SIZE', 10000))
+    # Cognito GetUser results by sub (number of users, seconds)
+    COGNITO_USER_CACHE_SIZE = int(os.getenv('COGNITO_USER_CACHE_SIZE', 10000))
+    COGNITO_USER_CACHE_TTL = int(os.getenv('COGNITO_USER_CACHE_TTL', 300))
+    # Signed-out tokens: 'sqlite' (workers of one host), 'dynamodb' (every instance) or 'memory' (this worker only,
+    # a signed-out token keeps working on the other workers). Other workers see a revocation after at most
+    # REVOCATION_SYNC_INTERVAL seconds, REVOCATION_DYNAMODB_SYNC_INTERVAL with 'dynamodb' whose syncs scan the table.
+    REVOCATION_BACKEND = os.getenv('REVOCATION_BACKEND', 'sqlite')
+    REVOCATION_SQLITE_PATH = os.getenv('REVOCATION_SQLITE_PATH', '/tmp/cloudalbum-revocations.db')
+    REVOCATION_SYNC_INTERVAL = int(os.getenv('REVOCATION_SYNC_INTERVAL', 5))
+    REVOCATION_DYNAMODB_SYNC_INTERVAL = int(os.getenv('REVOCATION_DYNAMODB_SYNC_INTERVAL', 60))
+    REVOCATION_FILTER_CAPACITY = int(os.getenv('REVOCATION_FILTER_CAPACITY', 100000))
 
 
 class DevelopmentConfig(BaseConfig):
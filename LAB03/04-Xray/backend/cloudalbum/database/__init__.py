@@ -1,15 +1,18 @@
-
-from cloudalbum.database.model_ddb import Photo
+from cloudalbum.database.model_ddb import Photo, AlbumVersion
 from flask import current_app as app
 
-if not Photo.exists():
-    Photo.create_table(read_capacity_units=app.config['DDB_RCU'], write_capacity_units=app.config['DDB_WCU'], wait=True)
-    app.logger.debug('DynamoDB Photo table created!')
 
 def create_table():
-    Photo.create_table()
-    app.logger.debug("Dynamodb Photos table created")
+    """
+    Create the missing tables with DDB_RCU/DDB_WCU capacity. Needs an application context.
+    """
+    for model in (Photo, AlbumVersion):
+        if not model.exists():
+            model.create_table(read_capacity_units=app.config['DDB_RCU'], write_capacity_units=app.config['DDB_WCU'],
+                               wait=True)
+            app.logger.debug('DynamoDB {0} table created!'.format(model.Meta.table_name))
 
 def delete_table():
     Photo.delete_table()
+    AlbumVersion.delete_table()
     app.logger.debug("Dynamodb Users table deleted")
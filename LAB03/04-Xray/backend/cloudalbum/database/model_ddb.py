@@ -2,11 +2,33 @@ from datetime import datetime
 
 import boto3
 from pynamodb.models import Model
-from pynamodb.attributes import UnicodeAttribute, NumberAttribute, UTCDateTimeAttribute
+from pynamodb.attributes import UnicodeAttribute, NumberAttribute, UTCDateTimeAttribute, UnicodeSetAttribute
+from pynamodb.attributes import TTLAttribute
+from pynamodb.indexes import GlobalSecondaryIndex, KeysOnlyProjection
 from tzlocal import get_localzone
 
 AWS_REGION = boto3.session.Session().region_name
 
+# Photo.processing_state values, items stored before the processing queue have none (= ready)
+PROCESSING_PENDING = 'pending'
+PROCESSING_READY = 'ready'
+PROCESSING_FAILED = 'failed'
+
+
+class ContentHashIndex(GlobalSecondaryIndex):
+    """
+    Per-user SHA-256 of the original file, used to detect duplicate uploads.
+    """
+
+    class Meta:
+        index_name = 'photo-content-hash-index'
+        read_capacity_units = 5
+        write_capacity_units = 5
+        projection = KeysOnlyProjection()
+
+    user_id = UnicodeAttribute(hash_key=True)
+    content_hash = UnicodeAttribute(range_key=True)
+
 
 class Photo(Model):
     """
@@ -19,6 +41,8 @@ class Photo(Model):
 
     user_id = UnicodeAttribute(hash_key=True)
     id = UnicodeAttribute(range_key=True)
+    content_hash_index = ContentHashIndex()
+    content_hash = UnicodeAttribute(null=True)
     tags = UnicodeAttribute(null=True)
     desc = UnicodeAttribute(null=True)
     filename_orig = UnicodeAttribute(null=True)
@@ -35,6 +59,35 @@ class Photo(Model):
     city = UnicodeAttribute(null=True)
     nation = UnicodeAttribute(null=True)
     address = UnicodeAttribute(null=True)
+    processing_state = UnicodeAttribute(null=True)
+    thumbnail_formats = UnicodeSetAttribute(null=True)
+
+
+class AlbumVersion(Model):
+    """
+    Per-user album version, bumped whenever the user's photo list changes.
+    """
+
+    class Meta:
+        table_name = 'AlbumVersion'
+        region = AWS_REGION
+
+    user_id = UnicodeAttribute(hash_key=True)
+    version = NumberAttribute(default=0)
+
+
+class RevokedToken(Model):
+    """
+    Signed-out token ids, deleted by DynamoDB TTL once the token has expired.
+    """
+
+    class Meta:
+        table_name = 'RevokedToken'
+        region = AWS_REGION
+
+    jti = UnicodeAttribute(hash_key=True)
+    exp = TTLAttribute()
+
 
 def photo_deserialize(photo):
     photo_json = {}
@@ -56,5 +109,6 @@ def photo_deserialize(photo):
     photo_json['city'] = photo.city
     photo_json['nation'] = photo.nation
     photo_json['address'] = photo.address
+    photo_json['processing_state'] = photo.processing_state or PROCESSING_READY
     return photo_json
 
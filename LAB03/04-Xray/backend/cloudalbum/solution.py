@@ -11,13 +11,13 @@ def solution_put_photo_info_ddb(user_id, new_photo):
         app.logger.error(e)
         raise e
 
-def solution_put_object_to_s3(s3_client, key, upload_file_stream):
+def solution_put_object_to_s3(s3_client, key, upload_file_stream, content_type='image/jpeg'):
     try:
         s3_client.put_object(
             Bucket=app.config['S3_PHOTO_BUCKET'],
             Key=key,
             Body=upload_file_stream,
-            ContentType='image/jpeg',
+            ContentType=content_type,
             StorageClass='STANDARD'
         )
         app.logger.debug('success:put object into s3:key:{}'.format(key))
@@ -28,11 +28,12 @@ def solution_put_object_to_s3(s3_client, key, upload_file_stream):
         raise e
 
 
-def solution_generate_s3_presigned_url(s3_client, key):
+def solution_generate_s3_presigned_url(s3_client, key, expires_in=3600):
     url = s3_client.generate_presigned_url(
         'get_object',
         Params={'Bucket': app.config['S3_PHOTO_BUCKET'],
-                'Key': key})
+                'Key': key},
+        ExpiresIn=expires_in)
     return url
 
 
@@ -0,0 +1,61 @@
+import time
+import unittest
+
+from cloudalbum.tests.base import BaseTestCase
+from cloudalbum.util.cache import LRUCache
+
+
+class TestLRUCache(BaseTestCase):
+    """Tests for the in-process LRU cache."""
+
+    def test_lru_eviction(self):
+        """Ensure the least recently used entry is evicted first."""
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(1, cache.stats()['evictions'])
+
+    def test_expiry(self):
+        """Ensure expired entries are not handed out."""
+        cache = LRUCache()
+        cache.set('url', 'https://example.com', ttl=0.05)
+        self.assertEqual('https://example.com', cache.get('url'))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('url'))
+
+        stats = cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['expirations'])
+
+    def test_clear(self):
+        """Ensure clear drops the entries and resets the counters."""
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        cache.clear()
+
+        stats = cache.stats()
+        self.assertEqual(0, stats['size'])
+        self.assertEqual(0, stats['hits'])
+        self.assertEqual(0, stats['misses'])
+        self.assertIsNone(cache.get('a'))
+
+    def test_registered(self):
+        """Ensure caches registered with init_app are listed in the admin metrics."""
+        cache = LRUCache()
+        cache.init_app(self.app, 'test_cache', 10)
+        self.assertIs(cache, self.app.extensions['caches']['test_cache'])
+        response = self.client.get('/admin/caches')
+        self.assertEqual(10, response.json['photos']['test_cache']['maxsize'])
+
+
+if __name__ == '__main__':
+    unittest.main()
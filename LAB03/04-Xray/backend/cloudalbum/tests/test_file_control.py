@@ -0,0 +1,364 @@
+import hashlib
+import unittest
+from datetime import datetime
+from io import BytesIO
+from unittest import mock
+from urllib.parse import urlparse, parse_qs
+
+import botocore.session
+from botocore.config import Config
+
+from PIL import Image, features
+from werkzeug.datastructures import MIMEAccept, FileStorage
+
+from cloudalbum.tests.base import BaseTestCase
+from cloudalbum.util.file_control import make_renditions, decode_for_renditions, thumbnail_key
+from cloudalbum.util.file_control import negotiate_thumbnail_format, upload_stream_s3, presign_many
+from cloudalbum.util.file_control import parse_fields, photo_attributes, with_presigned_url, album_etag
+from cloudalbum.util.file_control import list_photos, upload_photos, delete_keys_s3, delete_photos, photo_keys
+from cloudalbum import photo_lists
+from cloudalbum.database.model_ddb import Photo
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def image_stream(size, fmt='JPEG'):
+    stream = BytesIO()
+    Image.new('RGB', size, (120, 80, 40)).save(stream, fmt)
+    stream.seek(0)
+    return stream
+
+
+class TestRenditions(BaseTestCase):
+    """Tests for the thumbnail rendition engine."""
+
+    renditions = {'grid': (300, 200), 'preview': (1024, 768), 'hero': (2048, 1536)}
+
+    def test_renditions_fit_their_boxes(self):
+        """Ensure every rendition is produced and fits its bounding box."""
+        result = make_renditions(image_stream((6000, 4000)), self.renditions, ['jpeg'])
+
+        self.assertEqual(set(self.renditions), set(result))
+        for name, box in self.renditions.items():
+            im = Image.open(BytesIO(result[name]['jpeg']))
+            self.assertEqual('JPEG', im.format)
+            self.assertTrue(im.width <= box[0] and im.height <= box[1])
+        self.assertEqual((2048, 1365), Image.open(BytesIO(result['hero']['jpeg'])).size)
+
+    def test_jpeg_decoded_with_draft(self):
+        """Ensure large JPEGs are decoded below native resolution."""
+        im = decode_for_renditions(image_stream((6000, 4000)), self.renditions)
+        self.assertEqual((3000, 2000), im.size)
+
+    def test_png_renditions(self):
+        """Ensure non-JPEG sources produce the same renditions."""
+        result = make_renditions(image_stream((1600, 1200), 'PNG'), self.renditions, ['jpeg'])
+        self.assertEqual((1600, 1200), Image.open(BytesIO(result['hero']['jpeg'])).size)
+        self.assertEqual(200, Image.open(BytesIO(result['grid']['jpeg'])).height)
+
+    @unittest.skipUnless(features.check('webp'), 'Pillow built without WebP')
+    def test_webp_renditions(self):
+        """Ensure renditions are encoded in every requested format."""
+        result = make_renditions(image_stream((1600, 1200)), self.renditions, ['webp', 'jpeg'])
+        self.assertEqual('WEBP', Image.open(BytesIO(result['grid']['webp'])).format)
+        self.assertEqual('JPEG', Image.open(BytesIO(result['grid']['jpeg'])).format)
+
+    def test_thumbnail_key(self):
+        """Ensure grid keeps the legacy thumbnail key."""
+        self.assertEqual('photos/a_at_b_dot_com/thumbnails/x.jpg', thumbnail_key('a@b.com', 'x.jpg'))
+        self.assertEqual('photos/a_at_b_dot_com/thumbnails/hero/x.jpg',
+                         thumbnail_key('a@b.com', 'x.jpg', 'hero'))
+        self.assertEqual('photos/a_at_b_dot_com/thumbnails/hero/x.jpg.webp',
+                         thumbnail_key('a@b.com', 'x.jpg', 'hero', 'webp'))
+
+    def test_negotiate_thumbnail_format(self):
+        """Ensure only explicitly accepted formats are negotiated."""
+        available = ['avif', 'webp', 'jpeg']
+        accept = MIMEAccept([('image/webp', 1), ('*/*', 0.8)])
+        self.assertEqual('webp', negotiate_thumbnail_format(accept, available))
+        self.assertEqual('jpeg', negotiate_thumbnail_format(MIMEAccept([('*/*', 1)]), available))
+        self.assertEqual('jpeg', negotiate_thumbnail_format(MIMEAccept([('image/avif', 0)]), available))
+
+
+class TestUploadStream(BaseTestCase):
+    """Tests for the streaming S3 uploader."""
+
+    def test_upload_stream(self):
+        """Ensure the stream is handed to the S3 transfer manager with the multipart settings."""
+        self.app.config['S3_MULTIPART_THRESHOLD'] = 5 * 1024 * 1024
+        self.app.config['S3_UPLOAD_CONCURRENCY'] = 3
+        s3_client = mock.Mock()
+        stream = BytesIO(b'x' * 1000)
+        stream.seek(10)
+
+        size = upload_stream_s3(s3_client, 'photos/key.jpg', stream, 'image/png')
+
+        self.assertEqual(1000, size)
+        args, kwargs = s3_client.upload_fileobj.call_args
+        self.assertIs(stream, args[0])
+        self.assertEqual(0, stream.tell())
+        self.assertEqual('image/png', kwargs['ExtraArgs']['ContentType'])
+        self.assertEqual(5 * 1024 * 1024, kwargs['Config'].multipart_threshold)
+        self.assertEqual(3, kwargs['Config'].max_concurrency)
+
+
+class TestPresignMany(BaseTestCase):
+    """Tests for the batch SigV4 presigner."""
+
+    keys = ['photos/a_at_b_dot_com/thumbnails/x y+z~\u00e9.jpg', 'photos/a_at_b_dot_com/thumbnails/hero/x.jpg.webp']
+
+    def assert_same_as_botocore(self, region, token=None):
+        self.app.config['S3_PHOTO_BUCKET'] = 'cloudalbum-test'
+        self.app.config['AWS_REGION'] = region
+        session = botocore.session.get_session()
+        session.set_credentials('AKIDEXAMPLE', 'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY', token)
+        s3_client = session.create_client('s3', region_name=region,
+                                          config=Config(signature_version='s3v4', s3={'addressing_style': 'virtual'}))
+
+        expected = [s3_client.generate_presigned_url('get_object', ExpiresIn=900,
+                                                     Params={'Bucket': 'cloudalbum-test', 'Key': key})
+                    for key in self.keys]
+        signed_at = datetime.strptime(parse_qs(urlparse(expected[0]).query)['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ')
+
+        self.assertEqual(expected, presign_many(self.keys, 900, session.get_credentials(), signed_at))
+
+    def test_regional_endpoint(self):
+        """Ensure urls match botocore byte for byte on a regional endpoint."""
+        self.assert_same_as_botocore('ap-southeast-1')
+
+    def test_session_token(self):
+        """Ensure temporary credentials add the security token like botocore."""
+        self.assert_same_as_botocore('ap-southeast-1', 'FwoGZXIvYXdzEXAMPLE/token+=')
+
+    def test_us_east_1(self):
+        """Ensure us-east-1 uses the global endpoint like botocore."""
+        self.assert_same_as_botocore('us-east-1')
+
+
+class TestSparseFields(BaseTestCase):
+    """Tests for fields= of the photo list."""
+
+    def test_parse_fields(self):
+        """Ensure fields are validated and mapped onto the attributes to read."""
+        self.assertIsNone(parse_fields(None))
+        self.assertEqual(['id', 'thumbSrc'], parse_fields('id, thumbSrc'))
+        self.assertRaises(ValueError, parse_fields, 'id,password')
+
+        self.assertIsNone(photo_attributes(None))
+        self.assertEqual(['filename', 'id', 'processing_state', 'taken_date', 'thumbnail_formats', 'user_id'],
+                         photo_attributes(['id', 'thumbSrc', 'taken_date']))
+
+    def test_only_requested_urls_signed(self):
+        """Ensure originalSrc is not signed for the grid view."""
+        photo = Photo('user', 'x.jpg', filename='x.jpg', processing_state='ready')
+        with mock.patch('cloudalbum.util.file_control.cached_presigned_urls',
+                        side_effect=lambda keys: ['signed:' + key for key in keys]) as signer:
+            result = with_presigned_url({'email': 'a@b.com'}, photo, fields=['id', 'thumbSrc'])
+
+        signer.assert_called_once_with(['photos/a_at_b_dot_com/thumbnails/x.jpg'])
+        self.assertEqual({'id': 'x.jpg', 'thumbSrc': 'signed:photos/a_at_b_dot_com/thumbnails/x.jpg'}, result)
+
+
+class TestAlbumEtag(BaseTestCase):
+    """Tests for the photo list ETag."""
+
+    def test_album_etag(self):
+        """Ensure the tag changes with the album version, the request variant and the presign period."""
+        self.app.config['S3_PRESIGNED_URL_EXPIRE_TIME'] = 3600
+        self.app.config['PRESIGNED_URL_REUSE_FRACTION'] = 0.5
+        with mock.patch('cloudalbum.util.file_control.time.time', return_value=1000.0):
+            etag = album_etag('user', 1, b'', 'jpeg')
+            self.assertEqual(etag, album_etag('user', 1, b'', 'jpeg'))
+            self.assertNotEqual(etag, album_etag('user', 2, b'', 'jpeg'))
+            self.assertNotEqual(etag, album_etag('user', 1, b'fields=id', 'jpeg'))
+            self.assertNotEqual(etag, album_etag('user', 1, b'', 'webp'))
+        with mock.patch('cloudalbum.util.file_control.time.time', return_value=1000.0 + 1800):
+            self.assertNotEqual(etag, album_etag('user', 1, b'', 'jpeg'))
+
+
+class TestPhotoListCache(BaseTestCase):
+    """Tests for the per-user photo list cache."""
+
+    def setUp(self):
+        photo_lists.clear()
+        self.photos = [Photo('user', 'p{0}'.format(i)) for i in range(5)]
+
+    def test_cached_pages(self):
+        """Ensure pages are served from the cache filled by a full list until the album version changes."""
+        with mock.patch.object(Photo, 'query', return_value=iter(self.photos)) as query:
+            self.assertEqual(['p0', 'p1', 'p2', 'p3', 'p4'], [photo.id for photo in list_photos('user', 1)[0]])
+            page, next_id = list_photos('user', 1, limit=2)
+            self.assertEqual((['p0', 'p1'], 'p1'), ([photo.id for photo in page], next_id()))
+            page, next_id = list_photos('user', 1, limit=2, after='p3')
+            self.assertEqual((['p4'], None), ([photo.id for photo in page], next_id()))
+            self.assertEqual(1, query.call_count)
+
+            query.return_value = iter(self.photos[:1])
+            page, _ = list_photos('user', 2)
+            self.assertEqual(['p0'], [photo.id for photo in page])
+            self.assertEqual(2, query.call_count)
+
+    def test_page_miss_reads_one_page(self):
+        """Ensure a projected page missing the cache reads one page from DynamoDB, not the whole album."""
+        result = mock.MagicMock()
+        result.__iter__.return_value = iter(self.photos[:2])
+        result.last_evaluated_key = {'user_id': {'S': 'user'}, 'id': {'S': 'p1'}}
+        with mock.patch.object(Photo, 'query', return_value=result) as query:
+            page, next_id = list_photos('user', 1, limit=2, fields=['id'])
+            self.assertEqual((['p0', 'p1'], 'p1'), ([photo.id for photo in page], next_id()))
+
+        self.assertEqual(1, query.call_count)
+        self.assertEqual(2, query.call_args[1]['limit'])
+        self.assertEqual(['id', 'user_id'], query.call_args[1]['attributes_to_get'])
+        self.assertIsNone(photo_lists.get('user'))
+
+    def test_large_album_not_cached(self):
+        """Ensure albums above PHOTO_LIST_CACHE_MAX_ITEMS are paged by DynamoDB."""
+        self.app.config['PHOTO_LIST_CACHE_MAX_ITEMS'] = 3
+        with mock.patch.object(Photo, 'query', side_effect=lambda *args, **kwargs: iter(self.photos)) as query:
+            list(list_photos('user', 1)[0])
+            list(list_photos('user', 1)[0])
+        self.assertEqual((None, None), (query.call_args_list[1][1].get('limit'),
+                                        query.call_args_list[2][1].get('limit')))
+        self.assertEqual(3, query.call_count)
+
+
+class TestBulkUpload(BaseTestCase):
+    """Tests for POST /photos/files."""
+
+    form = dict.fromkeys(['tags', 'desc', 'make', 'model', 'width', 'height', 'taken_date',
+                          'geotag_lat', 'geotag_lng', 'city', 'address', 'nation'])
+
+    def upload(self, filename, content):
+        return FileStorage(stream=BytesIO(content), filename=filename, content_type='image/jpeg')
+
+    def test_upload_photos(self):
+        """Ensure files are uploaded concurrently and written with one batch, with a result per file."""
+        self.app.config['BULK_UPLOAD_CONCURRENCY'] = 4
+        files = [self.upload('a.jpg', b'a'), self.upload('b.jpg', b'b'), self.upload('again.jpg', b'a'),
+                 self.upload('known.png', b'known'), self.upload('notes.txt', b'text')]
+        s3_client = mock.Mock()
+        with mock.patch('cloudalbum.util.file_control.boto3.client', return_value=s3_client), \
+                mock.patch('cloudalbum.util.file_control.find_duplicate',
+                           side_effect=lambda user_id, digest: 'old.png' if digest == content_hash(b'known') else None), \
+                mock.patch.object(Photo, 'batch_write') as batch_write, \
+                mock.patch('cloudalbum.util.file_control.bump_album_version') as bump, \
+                mock.patch('cloudalbum.util.file_control.photo_jobs') as photo_jobs:
+            results = upload_photos('user', 'a@b.com', files, self.form)
+
+        self.assertEqual(['a.jpg', 'b.jpg', 'again.jpg', 'known.png', 'notes.txt'],
+                         [result['filename'] for result in results])
+        self.assertEqual('pending', results[0]['processing_state'])
+        self.assertEqual({'filename': 'again.jpg', 'photo_id': results[0]['photo_id'], 'duplicate': True}, results[2])
+        self.assertEqual({'filename': 'known.png', 'photo_id': 'old.png', 'duplicate': True}, results[3])
+        self.assertEqual({'filename': 'notes.txt', 'error': 'file format is not supported'}, results[4])
+
+        self.assertEqual(2, s3_client.upload_fileobj.call_count)
+        saved = [call[0][0] for call in batch_write.return_value.__enter__.return_value.save.call_args_list]
+        self.assertEqual([results[0]['photo_id'], results[1]['photo_id']], [photo.id for photo in saved])
+        self.assertEqual(['a.jpg', 'b.jpg'], [photo.filename_orig for photo in saved])
+        bump.assert_called_once_with('user')
+        photo_jobs.enqueue_many.assert_called_once_with([('user', photo.id, 'a@b.com') for photo in saved])
+
+    def test_partial_batch_write_failure(self):
+        """Ensure only the photos whose items were not written lose their originals and are reported as failed."""
+        files = [self.upload('{0}.jpg'.format(i), str(i).encode('utf-8')) for i in range(30)]
+        s3_client = mock.Mock()
+        s3_client.delete_objects.return_value = {}
+        batch = mock.MagicMock()
+        batch.__exit__.side_effect = [None, Exception('throughput exceeded')]
+        with mock.patch('cloudalbum.util.file_control.boto3.client', return_value=s3_client), \
+                mock.patch('cloudalbum.util.file_control.find_duplicate', return_value=None), \
+                mock.patch.object(Photo, 'batch_write', return_value=batch), \
+                mock.patch.object(Photo, 'batch_get', side_effect=lambda keys, **kwargs: [
+                    Photo('user', photo_id) for _, photo_id in keys[:2]]) as batch_get, \
+                mock.patch('cloudalbum.util.file_control.bump_album_version') as bump, \
+                mock.patch('cloudalbum.util.file_control.photo_jobs') as photo_jobs:
+            results = upload_photos('user', 'a@b.com', files, self.form)
+
+        written = [result['photo_id'] for result in results[:27]]
+        self.assertEqual(written[25:], [photo_id for _, photo_id in batch_get.call_args[0][0][:2]])
+        self.assertEqual([{'filename': '{0}.jpg'.format(i), 'error': 'upload failed'} for i in range(27, 30)],
+                         results[27:])
+        deleted_keys = [item['Key'] for item in s3_client.delete_objects.call_args[1]['Delete']['Objects']]
+        self.assertEqual(3, len(deleted_keys))
+        self.assertFalse(any(key.endswith(photo_id) for key in deleted_keys for photo_id in written))
+        bump.assert_called_once_with('user')
+        self.assertEqual(written, [job[1] for job in photo_jobs.enqueue_many.call_args[0][0]])
+
+    def test_cleanup_failure_keeps_results(self):
+        """Ensure an S3 error while deleting the lost originals still returns the per-file results."""
+        files = [self.upload('a.jpg', b'a'), self.upload('b.jpg', b'b')]
+        s3_client = mock.Mock()
+        s3_client.delete_objects.side_effect = Exception('access denied')
+        batch = mock.MagicMock()
+        batch.__exit__.side_effect = Exception('throughput exceeded')
+        with mock.patch('cloudalbum.util.file_control.boto3.client', return_value=s3_client), \
+                mock.patch('cloudalbum.util.file_control.find_duplicate', return_value=None), \
+                mock.patch.object(Photo, 'batch_write', return_value=batch), \
+                mock.patch.object(Photo, 'batch_get', return_value=[]), \
+                mock.patch('cloudalbum.util.file_control.bump_album_version') as bump, \
+                mock.patch('cloudalbum.util.file_control.photo_jobs'):
+            results = upload_photos('user', 'a@b.com', files, self.form)
+
+        self.assertEqual([{'filename': 'a.jpg', 'error': 'upload failed'},
+                          {'filename': 'b.jpg', 'error': 'upload failed'}], results)
+        s3_client.delete_objects.assert_called_once()
+        bump.assert_not_called()
+
+    def test_upload_threads_join_the_trace(self):
+        """Ensure the upload threads run with the request's trace entity and drop it afterwards."""
+        entity = mock.Mock()
+        recorder = 'cloudalbum.util.file_control.xray_recorder'
+        with mock.patch(recorder + '.get_trace_entity', return_value=entity), \
+                mock.patch(recorder + '.set_trace_entity') as set_trace_entity, \
+                mock.patch(recorder + '.clear_trace_entities') as clear_trace_entities, \
+                mock.patch('cloudalbum.util.file_control.boto3.client', return_value=mock.Mock()), \
+                mock.patch('cloudalbum.util.file_control.find_duplicate', return_value=None), \
+                mock.patch.object(Photo, 'batch_write'), \
+                mock.patch('cloudalbum.util.file_control.bump_album_version'), \
+                mock.patch('cloudalbum.util.file_control.photo_jobs'):
+            upload_photos('user', 'a@b.com', [self.upload('a.jpg', b'a'), self.upload('b.jpg', b'b')], self.form)
+
+        self.assertEqual([mock.call(entity)] * 2, set_trace_entity.call_args_list)
+        self.assertEqual(2, clear_trace_entities.call_count)
+
+    def test_delete_keys_chunked(self):
+        """Ensure keys are deleted 1000 per DeleteObjects call and failures are returned."""
+        s3_client = mock.Mock()
+        s3_client.delete_objects.side_effect = [{}, {'Errors': [{'Key': 'k1499', 'Code': 'AccessDenied'}]}]
+        failed = delete_keys_s3(s3_client, ['k{0}'.format(i) for i in range(1500)])
+
+        self.assertEqual(['k1499'], failed)
+        self.assertEqual([1000, 500], [len(call[1]['Delete']['Objects'])
+                                       for call in s3_client.delete_objects.call_args_list])
+
+
+class TestBulkDelete(BaseTestCase):
+    """Tests for POST /photos/delete."""
+
+    def test_delete_photos(self):
+        """Ensure objects and items are deleted in batches and failures are reported per id."""
+        photos = [Photo('user', 'p1.jpg', filename='p1.jpg'), Photo('user', 'p2.jpg', filename='p2.jpg')]
+        s3_client = mock.Mock()
+        s3_client.delete_objects.return_value = {'Errors': [{'Key': photo_keys('a@b.com', 'p2.jpg')[-1]}]}
+        with mock.patch('cloudalbum.util.file_control.boto3.client', return_value=s3_client), \
+                mock.patch.object(Photo, 'batch_get', return_value=photos) as batch_get, \
+                mock.patch.object(Photo, 'batch_write') as batch_write, \
+                mock.patch('cloudalbum.util.file_control.bump_album_version') as bump:
+            results = delete_photos('user', 'a@b.com', ['p1.jpg', 'p2.jpg', 'gone.jpg', 'p1.jpg'])
+
+        self.assertEqual([{'photo_id': 'p1.jpg', 'deleted': True},
+                          {'photo_id': 'p2.jpg', 'error': 's3 delete failed'},
+                          {'photo_id': 'gone.jpg', 'error': 'not exist photo_id'}], results)
+        self.assertEqual([('user', 'p1.jpg'), ('user', 'p2.jpg'), ('user', 'gone.jpg')], batch_get.call_args[0][0])
+        deleted_keys = [item['Key'] for item in s3_client.delete_objects.call_args[1]['Delete']['Objects']]
+        self.assertEqual(photo_keys('a@b.com', 'p1.jpg') + photo_keys('a@b.com', 'p2.jpg'), deleted_keys)
+        batch_write.return_value.__enter__.return_value.delete.assert_called_once_with(photos[0])
+        bump.assert_called_once_with('user')
+
+
+if __name__ == '__main__':
+    unittest.main()
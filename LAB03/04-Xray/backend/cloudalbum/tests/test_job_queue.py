@@ -0,0 +1,102 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from cloudalbum.tests.base import BaseTestCase
+from cloudalbum.util.job_queue import PhotoJobQueue
+
+
+class TestPhotoJobQueue(BaseTestCase):
+    """Tests for the post-upload processing queue."""
+
+    def make_queue(self, handler, on_failure=None, workers=1, max_attempts=2, failed_retention=3600):
+        self.app.config['JOB_QUEUE_DB'] = os.path.join(tempfile.mkdtemp(), 'jobs.db')
+        self.app.config['JOB_QUEUE_WORKERS'] = workers
+        self.app.config['JOB_QUEUE_MAX_ATTEMPTS'] = max_attempts
+        self.app.config['JOB_QUEUE_POLL_INTERVAL'] = 0.05
+        self.app.config['JOB_QUEUE_FAILED_RETENTION'] = failed_retention
+        queue = PhotoJobQueue(self.app, handler, on_failure)
+        self.addCleanup(queue.stop)
+        return queue
+
+    def test_job_processed(self):
+        """Ensure a queued job runs on a worker and is removed."""
+        done = threading.Event()
+        calls = []
+
+        def handler(user_id, photo_id, email):
+            calls.append((user_id, photo_id, email))
+            done.set()
+
+        queue = self.make_queue(handler)
+        queue.enqueue('user', 'photo.jpg', 'user@example.com')
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual([('user', 'photo.jpg', 'user@example.com')], calls)
+
+    def test_job_failed_after_attempts(self):
+        """Ensure a failing job is retried and then reported as failed."""
+        failed = threading.Event()
+
+        def handler(user_id, photo_id, email):
+            raise ValueError('broken image')
+
+        queue = self.make_queue(handler, lambda user_id, photo_id, error: failed.set(), max_attempts=1)
+        queue.enqueue('user', 'photo.jpg', 'user@example.com')
+
+        self.assertTrue(failed.wait(5))
+        self.assertEqual(1, queue.stats()['failed'])
+
+    def test_failed_jobs_pruned(self):
+        """Ensure failed jobs are deleted once JOB_QUEUE_FAILED_RETENTION has passed."""
+        failed = threading.Event()
+
+        def handler(user_id, photo_id, email):
+            raise ValueError('broken image')
+
+        queue = self.make_queue(handler, lambda user_id, photo_id, error: failed.set(), max_attempts=1,
+                                failed_retention=0)
+        queue.enqueue('user', 'photo.jpg', 'user@example.com')
+
+        self.assertTrue(failed.wait(5))
+        queue._prune()
+        self.assertEqual(0, queue.stats()['failed'])
+
+    def test_inline_failure_reported(self):
+        """Ensure an inline job failure goes to on_failure instead of the upload request."""
+        failures = []
+
+        def handler(user_id, photo_id, email):
+            raise ValueError('broken image')
+
+        queue = self.make_queue(handler, lambda user_id, photo_id, error: failures.append(photo_id), workers=0)
+        queue.enqueue('user', 'photo.jpg', 'user@example.com')
+        self.assertEqual(['photo.jpg'], failures)
+
+    def test_inline_without_workers(self):
+        """Ensure jobs run synchronously when no worker is configured."""
+        calls = []
+        queue = self.make_queue(lambda *job: calls.append(job), workers=0)
+        queue.enqueue('user', 'photo.jpg', 'user@example.com')
+        self.assertEqual(1, len(calls))
+
+    def test_enqueue_many(self):
+        """Ensure every job of a bulk upload is queued and processed."""
+        done = threading.Semaphore(0)
+        calls = []
+
+        def handler(user_id, photo_id, email):
+            calls.append(photo_id)
+            done.release()
+
+        queue = self.make_queue(handler, workers=2)
+        queue.enqueue_many([('user', 'p{0}.jpg'.format(i), 'user@example.com') for i in range(5)])
+
+        for _ in range(5):
+            self.assertTrue(done.acquire(timeout=5))
+        self.assertEqual(['p{0}.jpg'.format(i) for i in range(5)], sorted(calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from unittest import mock
+
+from jose import jwk
+
+from cloudalbum.tests.base import BaseTestCase
+from cloudalbum.util.jwks import KeyRegistry
+
+# RFC 7517 appendix A.1 example public key
+JWK = {
+    'kty': 'RSA', 'alg': 'RS256', 'kid': '2011-04-29', 'e': 'AQAB',
+    'n': '0vx7agoebGcQSuuPiLJXZptN9nndrQmbXEps2aiAFbWhM78LhWx4cbbfAAtVT86zwu1RK7aPFFxuhDR1L6tSoc_BJECPebWKRXjBZCiFV4n'
+         '3oknjhMstn64tZ_2W-5JsGY4Hc5n9yBXArwl93lqt7_RN5w6Cf0h4QyQ5v-65YGjQR0_FDW2QvzqY368QQMicAtaSqzs8KJZgnYb9c7d0zgdA'
+         'ZHzu6qMQvRL5hajrn1n91CbOpbISD08qNLyrdkt-bFTWhAI4vMQFh6WeZu0fM4lFd2NcRwr3XPksINHaQ-G_xBniIqbw0Ls1jF44-csFCur-'
+         'kEgU8awapJzKnqDKgw',
+}
+
+
+def rotated(kid):
+    return dict(JWK, kid=kid)
+
+
+class TestKeyRegistry(BaseTestCase):
+    """Tests for the user pool signing key registry."""
+
+    def test_keys_constructed_once(self):
+        """Ensure keys are fetched and parsed once, not per token."""
+        registry = KeyRegistry(ttl=3600)
+        with mock.patch.object(registry, 'fetch', return_value=[JWK]) as fetch, \
+                mock.patch('cloudalbum.util.jwks.jwk.construct', wraps=jwk.construct) as construct:
+            key = registry.get('2011-04-29')
+            self.assertIs(key, registry.get('2011-04-29'))
+        self.assertEqual(1, fetch.call_count)
+        self.assertEqual(1, construct.call_count)
+
+    def test_unknown_kid_reload(self):
+        """Ensure an unknown kid reloads the keys, but at most once per min_reload_interval."""
+        registry = KeyRegistry(ttl=3600, min_reload_interval=0)
+        registry.load([JWK])
+        with mock.patch.object(registry, 'fetch', return_value=[JWK, rotated('new')]) as fetch:
+            self.assertIsNotNone(registry.get('new'))
+        self.assertEqual(1, fetch.call_count)
+
+        registry.min_reload_interval = 60
+        with mock.patch.object(registry, 'fetch', return_value=[]) as fetch:
+            self.assertIsNone(registry.get('forged'))
+        fetch.assert_not_called()
+
+    def test_stale_refresh(self):
+        """Ensure keys older than ttl are refreshed while the current keys keep being served."""
+        registry = KeyRegistry(ttl=0, background=False)
+        registry.load([JWK])
+        with mock.patch.object(registry, 'fetch', return_value=[rotated('next')]) as fetch:
+            self.assertIsNone(registry.get('2011-04-29'))
+            self.assertIsNotNone(registry.get('next'))
+        self.assertTrue(fetch.called)
+
+    def test_init_app(self):
+        """Ensure the registry is configured from the user pool settings."""
+        registry = KeyRegistry()
+        self.app.config['AWS_REGION'] = 'ap-southeast-1'
+        self.app.config['COGNITO_POOL_ID'] = 'ap-southeast-1_pool'
+        registry.init_app(self.app)
+        self.assertEqual('https://cognito-idp.ap-southeast-1.amazonaws.com/ap-southeast-1_pool/.well-known/jwks.json',
+                         registry.url)
+        self.assertIs(registry, self.app.extensions['jwks'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import time
+import unittest
+from unittest import mock
+
+from cloudalbum import verified_tokens, cognito_users
+from cloudalbum.tests.base import BaseTestCase
+from cloudalbum.util import jwt_helper
+from cloudalbum.util.revocation import RevocationStore
+
+
+class TestVerifiedTokenCache(BaseTestCase):
+    """Tests for the verified token cache."""
+
+    def setUp(self):
+        verified_tokens.clear()
+        self.claims = {'sub': 'user', 'jti': 'jti-1', 'exp': time.time() + 3600}
+
+    def test_signature_verified_once(self):
+        """Ensure a token presented again is served from the cache."""
+        with mock.patch.object(jwt_helper, 'verify_token', return_value=self.claims) as verify:
+            self.assertEqual(self.claims, jwt_helper.token_decoder('token'))
+            self.assertEqual(self.claims, jwt_helper.token_decoder('token'))
+        self.assertEqual(1, verify.call_count)
+        self.assertEqual(1, verified_tokens.stats()['hits'])
+
+    def test_expired_token_verified_again(self):
+        """Ensure claims are not cached past exp."""
+        self.claims['exp'] = time.time() - 1
+        with mock.patch.object(jwt_helper, 'verify_token', return_value=self.claims) as verify:
+            jwt_helper.token_decoder('token')
+            jwt_helper.token_decoder('token')
+        self.assertEqual(2, verify.call_count)
+
+    def test_revoked_token(self):
+        """Ensure sign-out evicts the cached claims and rejects the token."""
+        with mock.patch.object(jwt_helper, 'verify_token', return_value=self.claims), \
+                mock.patch.object(jwt_helper, 'revocations', RevocationStore()):
+            jwt_helper.token_decoder('token')
+            jwt_helper.add_token_to_set('token')
+            self.assertIsNone(verified_tokens.get(jwt_helper.token_digest('token')))
+            self.assertRaises(Exception, jwt_helper.token_decoder, 'token')
+
+
+class TestResolveUser(BaseTestCase):
+    """Tests for the user resolution from token claims."""
+
+    def setUp(self):
+        cognito_users.clear()
+
+    def test_id_token(self):
+        """Ensure ID token claims are used without calling Cognito."""
+        claims = {'sub': 'user', 'token_use': 'id', 'email': 'a@b.com', 'name': 'a', 'aud': 'client'}
+        with mock.patch.object(jwt_helper, 'solution_get_cognito_user_data') as get_user:
+            user = jwt_helper.resolve_user(claims, 'token')
+        get_user.assert_not_called()
+        self.assertEqual({'user_id': 'user', 'email': 'a@b.com', 'name': 'a'}, user)
+
+    def test_access_token_cached_by_sub(self):
+        """Ensure GetUser is called once per user, not per request."""
+        claims = {'sub': 'user', 'token_use': 'access'}
+        with mock.patch.object(jwt_helper, 'solution_get_cognito_user_data',
+                               return_value={'user_id': 'user', 'email': 'a@b.com'}) as get_user:
+            jwt_helper.resolve_user(claims, 'token')
+            user = jwt_helper.resolve_user(claims, 'other token')
+        self.assertEqual(1, get_user.call_count)
+        self.assertEqual('a@b.com', user['email'])
+
+
+if __name__ == '__main__':
+    unittest.main()
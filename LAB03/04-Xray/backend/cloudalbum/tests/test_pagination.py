@@ -0,0 +1,31 @@
+import unittest
+
+from cloudalbum.tests.base import BaseTestCase
+from cloudalbum.util.pagination import CursorError, encode_cursor, decode_cursor, page_args
+
+
+class TestPagination(BaseTestCase):
+    """Tests for photo list cursors."""
+
+    def test_cursor_round_trip(self):
+        """Ensure cursors are url safe and decode to the encoded position."""
+        cursor = encode_cursor('3f2b1c8e-0000-4000-8000-000000000000.jpg')
+        self.assertNotIn('=', cursor)
+        self.assertEqual('3f2b1c8e-0000-4000-8000-000000000000.jpg', decode_cursor(cursor))
+
+    def test_invalid_cursor(self):
+        """Ensure a tampered cursor is rejected."""
+        self.assertRaises(CursorError, decode_cursor, 'not a cursor')
+        self.assertRaises(CursorError, decode_cursor, encode_cursor({'id': 'x'}))
+
+    def test_page_args(self):
+        """Ensure pagination is opt-in and the page size is capped."""
+        self.assertEqual((None, None), page_args({}, 100))
+        self.assertEqual((100, None), page_args({'limit': '5000'}, 100))
+        self.assertEqual((10, 'a.jpg'), page_args({'limit': '10', 'cursor': encode_cursor('a.jpg')}, 100))
+        self.assertRaises(CursorError, page_args, {'limit': '0'}, 100)
+        self.assertRaises(CursorError, page_args, {'limit': 'ten'}, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
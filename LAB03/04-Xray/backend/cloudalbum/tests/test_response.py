@@ -0,0 +1,64 @@
+import json
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from unittest import mock
+
+from aws_xray_sdk.core import xray_recorder
+
+from cloudalbum.tests.base import BaseTestCase
+from cloudalbum.util.response import iter_json_list, stream_response, traced_items
+
+
+class TestStreamResponse(BaseTestCase):
+    """Tests for the streamed JSON list response."""
+
+    def test_iter_json_list(self):
+        """Ensure the chunks join into the same document m_response returns."""
+        items = [{'id': str(i), 'taken_date': datetime(2019, 8, 1, 10), 'filesize': Decimal(i),
+                  'geotag_lat': Decimal('37.5')} for i in range(100)]
+        chunks = list(iter_json_list(iter(items), chunk_size=256, cursor=lambda: 'next'))
+
+        self.assertGreater(len(chunks), 1)
+        body = json.loads(''.join(chunks))
+        self.assertEqual('next', body['cursor'])
+        self.assertEqual(100, len(body['photos']))
+        self.assertEqual({'id': '1', 'taken_date': '2019-08-01 10:00:00', 'filesize': 1, 'geotag_lat': 37.5},
+                         body['photos'][1])
+
+    def test_empty_list(self):
+        """Ensure an empty list is still a valid document."""
+        self.assertEqual({'ok': True, 'photos': []}, json.loads(''.join(iter_json_list([]))))
+
+    def test_stream_response(self):
+        """Ensure items are only consumed while the body is written."""
+        consumed = []
+
+        def items():
+            for i in range(3):
+                consumed.append(i)
+                yield {'id': i}
+
+        with self.app.test_request_context():
+            resp = stream_response(items(), 200)
+            self.assertEqual([], consumed)
+            self.assertEqual({'ok': True, 'photos': [{'id': 0}, {'id': 1}, {'id': 2}]}, json.loads(resp.get_data()))
+        self.assertEqual('application/json', resp.mimetype)
+
+    def test_traced_items(self):
+        """Ensure the request segment is sent once the streamed items are consumed, not when the view returns."""
+        emitter = mock.Mock()
+        with mock.patch.object(xray_recorder, '_emitter', emitter):
+            xray_recorder.begin_segment('request', sampling=True)
+            items = traced_items(iter([1, 2]), 'photos_list')
+            xray_recorder.end_segment()
+            emitter.send_entity.assert_not_called()
+
+            self.assertEqual([1, 2], list(items))
+        segment = emitter.send_entity.call_args[0][0]
+        self.assertEqual(['photos_list'], [subsegment.name for subsegment in segment.subsegments])
+        self.assertFalse(segment.subsegments[0].in_progress)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from cloudalbum.tests.base import BaseTestCase
+from cloudalbum.util.revocation import BloomFilter, RevocationStore, SQLiteRevocationBackend
+
+
+class TestRevocationStore(BaseTestCase):
+    """Tests for the token revocation store."""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_bloom_filter(self):
+        """Ensure added values are always found and the false positive rate stays near its target."""
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add('jti-{0}'.format(i))
+        self.assertTrue(all('jti-{0}'.format(i) in bloom for i in range(1000)))
+        self.assertLess(sum('other-{0}'.format(i) in bloom for i in range(1000)), 30)
+
+    def test_not_revoked_answered_locally(self):
+        """Ensure unknown tokens are answered by the filter without a backend lookup."""
+        store = RevocationStore(SQLiteRevocationBackend(self.path))
+        store.revoke('signed-out', time.time() + 60)
+
+        self.assertTrue(store.is_revoked('signed-out'))
+        self.assertFalse(store.is_revoked('active'))
+        self.assertEqual(1, store.stats()['filter_hits'])
+
+    def test_shared_between_workers(self):
+        """Ensure a revocation by one worker is seen by another after the sync interval."""
+        first = RevocationStore(SQLiteRevocationBackend(self.path), sync_interval=0.05)
+        second = RevocationStore(SQLiteRevocationBackend(self.path), sync_interval=0.05)
+        self.assertFalse(second.is_revoked('jti'))
+
+        first.revoke('jti', time.time() + 60)
+        time.sleep(0.1)
+        self.assertTrue(second.is_revoked('jti'))
+
+    def test_expired_entries_pruned(self):
+        """Ensure entries are dropped once the token has expired."""
+        backend = SQLiteRevocationBackend(self.path)
+        store = RevocationStore(backend, sync_interval=0)
+        store.revoke('expired', time.time() - 1)
+
+        self.assertFalse(store.is_revoked('expired'))
+        self.assertEqual([], backend.active())
+
+    def test_sync_does_not_block_checks(self):
+        """Ensure checks are answered from the current filter while another thread syncs."""
+        backend = SQLiteRevocationBackend(self.path)
+        store = RevocationStore(backend, sync_interval=0)
+        store.revoke('signed-out', time.time() + 60)
+        self.assertTrue(store.is_revoked('signed-out'))
+
+        started, finish = threading.Event(), threading.Event()
+        active = backend.active
+
+        def slow_active():
+            jtis = active()
+            started.set()
+            finish.wait(5)
+            return jtis
+
+        with mock.patch.object(backend, 'active', slow_active):
+            syncing = threading.Thread(target=store.sync)
+            syncing.start()
+            self.assertTrue(started.wait(5))
+            store.revoke('during-sync', time.time() + 60)
+            self.assertTrue(store.is_revoked('signed-out'))
+            self.assertFalse(store.is_revoked('active'))
+            finish.set()
+            syncing.join(5)
+
+        self.assertIn('during-sync', store._filter)
+        self.assertEqual(2, store.stats()['syncs'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,12 +4,24 @@ from PIL import Image
 from pathlib import Path
 from aws_xray_sdk.core import xray_recorder
 
-from cloudalbum.solution import solution_put_object_to_s3, solution_generate_s3_presigned_url
-from cloudalbum.database.model_ddb import Photo, photo_deserialize
+from cloudalbum.solution import solution_put_object_to_s3
+from cloudalbum.database.model_ddb import Photo, AlbumVersion, photo_deserialize
+from cloudalbum.database.model_ddb import PROCESSING_PENDING, PROCESSING_READY, PROCESSING_FAILED
+from cloudalbum import presigned_urls, photo_lists, photo_jobs
+from pynamodb.exceptions import UpdateError
+from werkzeug.utils import secure_filename
 
 import os
+import time
+import hmac
+import hashlib
+import functools
+from urllib.parse import quote
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import uuid
 import boto3
+from boto3.s3.transfer import TransferConfig
 
 
 def email_normalize(email):
@@ -41,21 +53,130 @@ def make_thumbnail(path, filename):
         app.logger.error(e)
 
 
+# Upload file extensions
+ALLOWED_EXTENSIONS = ['jpg', 'jpeg', 'bmp', 'gif', 'png']
+
+# Thumbnail formats -> content type. JPEG is always produced, other formats when Pillow can encode them.
+THUMBNAIL_MIMETYPES = {
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+
+
+def thumbnail_key(email, filename, rendition='grid', fmt='jpeg'):
+    """
+    S3 key of a thumbnail rendition.
+    The JPEG 'grid' rendition keeps the original thumbnail location,
+    other formats append their extension to the file name.
+    :param email: user email address
+    :param filename: secure file name
+    :param rendition: rendition name
+    :param fmt: thumbnail format, see THUMBNAIL_MIMETYPES
+    :return: S3 key
+    """
+    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
+    if rendition != 'grid':
+        prefix_thumb = "{0}{1}/".format(prefix_thumb, rendition)
+    if fmt != 'jpeg':
+        filename = "{0}.{1}".format(filename, fmt)
+    return "{0}{1}".format(prefix_thumb, filename)
+
+
+def thumbnail_formats():
+    """
+    Configured thumbnail formats in preference order, limited to what this Pillow build can encode.
+    :return: list of formats, always including 'jpeg'
+    """
+    Image.init()
+    formats = [fmt for fmt in app.config['THUMBNAIL_FORMATS'] if fmt in THUMBNAIL_MIMETYPES and fmt.upper() in Image.SAVE]
+    if 'jpeg' not in formats:
+        formats.append('jpeg')
+    return formats
+
+
+def negotiate_thumbnail_format(accept_mimetypes, available=None):
+    """
+    Pick the preferred thumbnail format the client explicitly accepts, JPEG otherwise.
+    Wildcards do not count: browsers send */* even for images they cannot decode.
+    :param accept_mimetypes: werkzeug MIMEAccept, e.g. request.accept_mimetypes
+    :param available: formats to choose from, thumbnail_formats() by default
+    :return: thumbnail format
+    """
+    accepted = set(value for value, quality in accept_mimetypes if quality > 0)
+    for fmt in available or thumbnail_formats():
+        if THUMBNAIL_MIMETYPES.get(fmt) in accepted:
+            return fmt
+    return 'jpeg'
+
+
+def _fit_scale(image_size, box):
+    return min(box[0] / image_size[0], box[1] / image_size[1], 1.0)
+
+
+def _covers(box, other):
+    return box[0] >= other[0] and box[1] >= other[1]
+
+
+def decode_for_renditions(file_p, renditions):
+    """
+    Decode an image once, at the smallest scale which still covers every rendition.
+    JPEG sources use draft mode, so the decoder itself scales by 1/2, 1/4 or 1/8;
+    other formats are reduced by an integer factor right after decoding.
+    :param file_p: file-like object (or path) of the original image
+    :param renditions: dict of rendition name -> (max width, max height)
+    :return: PIL.Image in RGB mode
+    """
+    im = Image.open(file_p)
+    scale = max(_fit_scale(im.size, box) for box in renditions.values())
+    needed = (max(1, int(im.width * scale + 0.5)), max(1, int(im.height * scale + 0.5)))
+
+    im.draft('RGB', needed)
+    im = im.convert('RGB')
+
+    factor = min(im.width // needed[0], im.height // needed[1]) // 2
+    if factor > 1 and hasattr(im, 'reduce'):
+        im = im.reduce(factor)
+    return im
+
+
 @xray_recorder.capture()
-def make_thumbnails_s3(file_p):
-    result_bytes_stream = BytesIO()
+def make_renditions(file_p, renditions=None, formats=None):
+    """
+    Generate every configured thumbnail rendition from a single decode of the original.
+    Renditions are resized largest first, and each one is derived from the previous
+    rendition whenever that one still covers its bounding box.
+    :param file_p: file-like object (or path) of the original image
+    :param renditions: dict of rendition name -> (max width, max height), THUMBNAIL_RENDITIONS by default
+    :param formats: thumbnail formats to encode, thumbnail_formats() by default
+    :return: dict of rendition name -> {format: encoded bytes}
+    """
+    renditions = renditions or app.config['THUMBNAIL_RENDITIONS']
+    formats = formats or thumbnail_formats()
+    quality = app.config['THUMBNAIL_QUALITY']
+    result = {}
 
     try:
-        im = Image.open(file_p)
-        im = im.convert('RGB')
-        im.thumbnail((app.config['THUMBNAIL_WIDTH'], app.config['THUMBNAIL_HEIGHT'], Image.ANTIALIAS))
-        im.save(result_bytes_stream, 'JPEG')
+        source = decode_for_renditions(file_p, renditions)
+        previous, previous_box = source, None
+
+        for name, box in sorted(renditions.items(), key=lambda item: item[1][0] * item[1][1], reverse=True):
+            im = previous if previous_box is None or _covers(previous_box, box) else source
+            im = im.copy()
+            im.thumbnail(box, Image.ANTIALIAS)
+
+            result[name] = {}
+            for fmt in formats:
+                result_bytes_stream = BytesIO()
+                im.save(result_bytes_stream, fmt.upper(), quality=quality)
+                result[name][fmt] = result_bytes_stream.getvalue()
+            previous, previous_box = im, box
     except Exception as e:
-        app.logger.debug(e)
-
-    return result_bytes_stream.getvalue()
-
+        app.logger.error("ERROR:thumbnail renditions creation error")
+        app.logger.error(e)
+        return {}
 
+    return result
 
 
 def delete(filename, email):
@@ -90,18 +211,22 @@ def delete(filename, email):
         raise e
 
 
-@xray_recorder.capture()
-def delete_s3(filename, email):
-    prefix = "photos/{0}/".format(email_normalize(email))
-    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
+def photo_keys(email, filename):
+    """
+    S3 keys of a photo: the original and every thumbnail rendition in every format.
+    """
+    return ["photos/{0}/{1}".format(email_normalize(email), filename)] + \
+        [thumbnail_key(email, filename, rendition, fmt)
+         for rendition in app.config['THUMBNAIL_RENDITIONS'] for fmt in THUMBNAIL_MIMETYPES]
 
-    key = "{0}{1}".format(prefix, filename)
-    key_thumb = "{0}{1}".format(prefix_thumb, filename)
 
+@xray_recorder.capture()
+def delete_s3(filename, email):
     s3_client = boto3.client('s3')
     try:
-        s3_client.delete_object(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key)
-        s3_client.delete_object(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key_thumb)
+        failed = delete_keys_s3(s3_client, photo_keys(email, filename))
+        if failed:
+            raise Exception('objects not deleted:{0}'.format(failed))
         app.logger.debug("success:s3 file delete done:{}".format(filename))
         return True
     except Exception as e:
@@ -139,37 +264,268 @@ def save(upload_file, filename, email):
         app.logger.error(e)
         raise e
 
+
+@xray_recorder.capture()
+def upload_stream_s3(s3_client, key, stream, content_type):
+    """
+    Stream a file object to S3 without reading it into memory.
+    Above S3_MULTIPART_THRESHOLD the object is sent as a multipart upload, parts are read from the
+    stream and uploaded by S3_UPLOAD_CONCURRENCY threads. A failed multipart upload is aborted,
+    so no orphaned parts are left in the bucket.
+    :param s3_client: boto3 S3 client
+    :param key: object key
+    :param stream: readable, seekable file object (e.g. the werkzeug upload stream)
+    :param content_type: object content type
+    :return: object size (byte)
+    """
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+
+    transfer_config = TransferConfig(multipart_threshold=app.config['S3_MULTIPART_THRESHOLD'],
+                                     multipart_chunksize=app.config['S3_MULTIPART_CHUNKSIZE'],
+                                     max_concurrency=app.config['S3_UPLOAD_CONCURRENCY'])
+    s3_client.upload_fileobj(stream, app.config['S3_PHOTO_BUCKET'], key,
+                             ExtraArgs={'ContentType': content_type, 'StorageClass': 'STANDARD'},
+                             Config=transfer_config)
+    return size
+
+
 @xray_recorder.capture()
 def save_s3(upload_file_stream, filename, email):
+    """
+    Upload the original photo to S3.
+    Thumbnail renditions are created afterwards by process_photo (see PhotoJobQueue).
+    :param upload_file_stream: werkzeug.datastructures.FileStorage
+    :param filename: secure filename for upload
+    :param email: user email address
+    :return: file size (byte)
+    """
     prefix = "photos/{0}/".format(email_normalize(email))
-    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
-
     key = "{0}{1}".format(prefix, filename)
-    key_thumb = "{0}{1}".format(prefix_thumb, filename)
 
     s3_client = boto3.client('s3')
-    original_bytes = upload_file_stream.stream.read()
 
     try:
-        solution_put_object_to_s3(s3_client, key, original_bytes)
+        filesize = upload_stream_s3(s3_client, key, upload_file_stream.stream,
+                                    upload_file_stream.mimetype or 'image/jpeg')
 
         app.logger.debug('success: s3://{0}/{1} uploaded'.format(app.config['S3_PHOTO_BUCKET'], key))
 
-        # Save thumbnail file
-        upload_file_stream.stream.seek(0)
-        solution_put_object_to_s3(s3_client, key_thumb, make_thumbnails_s3(upload_file_stream))
-
-        app.logger.debug('s3://{0}/{1} uploaded'.format(app.config['S3_PHOTO_BUCKET'], key_thumb))
-
-        return len(original_bytes)
+        return filesize
     except Exception as e:
         app.logger.error('Error occurred while saving file to S3:%s', e)
         raise e
 
 
-def create_photo_info(user_id, filename, filesize, form):
+def content_digest(upload_file_stream):
+    """
+    SHA-256 of an uploaded file, read in chunks. The stream is rewound afterwards.
+    :param upload_file_stream: werkzeug.datastructures.FileStorage
+    :return: hex digest
+    """
+    sha256 = hashlib.sha256()
+    stream = upload_file_stream.stream
+    for chunk in iter(lambda: stream.read(64 * 1024), b''):
+        sha256.update(chunk)
+    stream.seek(0)
+    return sha256.hexdigest()
+
+
+def find_duplicate(user_id, content_hash):
+    """
+    Look up a photo of the same user with identical content.
+    :param user_id: Cognito user id
+    :param content_hash: SHA-256 hex digest of the original file
+    :return: existing photo id or None
+    """
+    for photo in Photo.content_hash_index.query(user_id, Photo.content_hash == content_hash, limit=1):
+        return photo.id
+    return None
+
+
+def extract_metadata(file_p):
+    """
+    Read image size and basic EXIF information without decoding the image.
+    :param file_p: file-like object of the original image
+    :return: dict of Photo attribute -> value
+    """
+    im = Image.open(file_p)
+    metadata = {'width': str(im.width), 'height': str(im.height)}
+
+    exif = im._getexif() if hasattr(im, '_getexif') else None
+    if exif:
+        # 271: Make, 272: Model, 36867: DateTimeOriginal
+        if exif.get(271):
+            metadata['make'] = str(exif[271]).strip()
+        if exif.get(272):
+            metadata['model'] = str(exif[272]).strip()
+        try:
+            metadata['taken_date'] = datetime.strptime(str(exif[36867]), "%Y:%m:%d %H:%M:%S")
+        except (KeyError, ValueError):
+            pass
+    return metadata
+
+
+@xray_recorder.capture()
+def process_photo(user_id, photo_id, email):
+    """
+    Post-upload processing, run by the photo job queue:
+    upload thumbnail renditions and fill in metadata the upload form did not provide.
+    :param user_id: Cognito user id
+    :param photo_id: photo id
+    :param email: user email address
+    :return: None
+    """
+    try:
+        photo = Photo.get(user_id, photo_id)
+    except Photo.DoesNotExist:
+        app.logger.debug('photo deleted before processing:photo_id:{}'.format(photo_id))
+        return
+
+    s3_client = boto3.client('s3')
+    key = "photos/{0}/{1}".format(email_normalize(email), photo.filename)
+    original = BytesIO(s3_client.get_object(Bucket=app.config['S3_PHOTO_BUCKET'], Key=key)['Body'].read())
+
+    formats = thumbnail_formats()
+    renditions = make_renditions(original, formats=formats)
+    if not renditions:
+        raise Exception('thumbnail renditions creation failed:photo_id:{}'.format(photo_id))
+    for rendition, encoded in renditions.items():
+        for fmt, thumbnail_bytes in encoded.items():
+            solution_put_object_to_s3(s3_client, thumbnail_key(email, photo.filename, rendition, fmt),
+                                      thumbnail_bytes, THUMBNAIL_MIMETYPES[fmt])
+
+    original.seek(0)
+    actions = [Photo.processing_state.set(PROCESSING_READY), Photo.thumbnail_formats.set(set(formats))]
+    for name, value in extract_metadata(original).items():
+        if getattr(photo, name) in (None, ''):
+            actions.append(getattr(Photo, name).set(value))
+
+    try:
+        photo.update(actions=actions, condition=Photo.id.exists())
+        bump_album_version(user_id)
+        app.logger.debug('success:photo processed:photo_id:{}'.format(photo_id))
+    except UpdateError as e:
+        app.logger.debug('photo deleted while processing:photo_id:{0}:{1}'.format(photo_id, e))
+
+
+def mark_processing_failed(user_id, photo_id, error):
+    """
+    Flag a photo whose post-upload processing ran out of attempts.
+    """
+    try:
+        Photo(user_id, photo_id).update(actions=[Photo.processing_state.set(PROCESSING_FAILED)],
+                                        condition=Photo.id.exists())
+        bump_album_version(user_id)
+    except UpdateError as e:
+        app.logger.debug('photo deleted while processing:photo_id:{0}:{1}'.format(photo_id, e))
+
+
+def album_version(user_id):
+    """
+    Current version of a user's album, 0 before the first change.
+    :param user_id: Cognito user id
+    :return: int
+    """
+    try:
+        return int(AlbumVersion.get(user_id, consistent_read=True).version)
+    except AlbumVersion.DoesNotExist:
+        return 0
+
+
+def bump_album_version(user_id):
+    """
+    Atomically increment a user's album version. Call it after the Photo table write,
+    so a list rendered in between is never cached under the new version.
+    :param user_id: Cognito user id
+    :return: new version
+    """
+    version = AlbumVersion(user_id)
+    version.update(actions=[AlbumVersion.version.add(1)])
+    photo_lists.pop(user_id)
+    return int(version.version)
+
+
+def cached_user_photos(user_id, version, fill=True):
+    """
+    Every photo of a user, from the photo list cache while it holds the current album version.
+    Other processes bump the version too, so an entry for an older version is never served.
+    :param user_id: Cognito user id
+    :param version: current album version
+    :param fill: on a miss, read the whole album into the cache. Otherwise None is returned.
+    :return: list of Photo items ordered by id, None when the album is too large to be cached or not cached
+    """
+    cached = photo_lists.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    if not fill:
+        return None
+
+    max_items = app.config['PHOTO_LIST_CACHE_MAX_ITEMS']
+    photos = list(Photo.query(user_id, limit=max_items + 1))
+    if len(photos) > max_items:
+        photos = None
+    photo_lists.set(user_id, (version, photos), ttl=app.config['PHOTO_LIST_CACHE_TTL'])
+    return photos
+
+
+def list_photos(user_id, version, limit=None, after=None, fields=None):
+    """
+    One page of a user's photos, from the photo list cache or from DynamoDB.
+    :param user_id: Cognito user id
+    :param version: current album version
+    :param limit: page size, None for every photo
+    :param after: id of the last photo of the previous page
+    :param fields: requested output fields, projects the DynamoDB read
+    :return: (iterable of Photo items, callable returning the id to continue after, None on the last page).
+             DynamoDB results are read page by page while they are iterated, call the second item afterwards.
+    """
+    # The cache holds full items, only a full list reads them all anyway. A page or a projection
+    # missing the cache reads just what it returns from DynamoDB.
+    fill = limit is None and after is None and fields is None
+    photos = cached_user_photos(user_id, version, fill) if photo_lists.maxsize > 0 else None
+    if photos is not None:
+        if after is not None:
+            photos = [photo for photo in photos if photo.id > after]
+        if limit is None or len(photos) <= limit:
+            return photos, lambda: None
+        return photos[:limit], lambda: photos[limit - 1].id
+
+    attributes = photo_attributes(fields)
+    if limit is None:
+        return Photo.query(user_id, attributes_to_get=attributes), lambda: None
+
+    start_key = {'user_id': {'S': user_id}, 'id': {'S': after}} if after else None
+    result = Photo.query(user_id, limit=limit, page_size=limit, last_evaluated_key=start_key,
+                         attributes_to_get=attributes)
+
+    def next_id():
+        last_key = result.last_evaluated_key
+        return last_key['id']['S'] if last_key else None
+
+    return result, next_id
+
+
+def album_etag(user_id, version, *variant):
+    """
+    Strong ETag of a photo list response.
+    The presigned urls in the body are reissued every PRESIGNED_URL_REUSE_FRACTION of their lifetime,
+    so the tag changes with that period as well, and a revalidated list never holds expired urls.
+    :param user_id: Cognito user id
+    :param version: album version
+    :param variant: anything else the body depends on, e.g. query string and thumbnail format
+    :return: ETag value (unquoted)
+    """
+    period = max(1, int(int(app.config['S3_PRESIGNED_URL_EXPIRE_TIME']) * app.config['PRESIGNED_URL_REUSE_FRACTION']))
+    digest = hashlib.sha1(repr((user_id, version, int(time.time() // period)) + variant).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def create_photo_info(user_id, filename, filesize, form, content_hash=None):
     new_photo = Photo(user_id=user_id,
                       id=filename,
+                      content_hash=content_hash,
                       filename=filename,
                       filename_orig=form['file'].filename,
                       filesize=filesize,
@@ -178,31 +534,307 @@ def create_photo_info(user_id, filename, filesize, form):
                       desc=form['desc'],
                       geotag_lat=form['geotag_lat'],
                       geotag_lng=form['geotag_lng'],
-                      taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S"),
+                      taken_date=datetime.strptime(form['taken_date'], "%Y:%m:%d %H:%M:%S")
+                      if form['taken_date'] else None,
                       make=form['make'],
                       model=form['model'],
                       width=form['width'],
                       height=form['height'],
                       city=form['city'],
                       nation=form['nation'],
-                      address=form['address'])
+                      address=form['address'],
+                      processing_state=PROCESSING_PENDING)
 
     app.logger.debug('new_photo: {0}'.format(photo_deserialize(new_photo)))
     return new_photo
 
 
+def is_allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def delete_keys_s3(s3_client, keys):
+    """
+    Delete objects with DeleteObjects, 1000 keys (the API limit) per call.
+    :param s3_client: boto3 S3 client
+    :param keys: object keys
+    :return: list of keys S3 reported as not deleted
+    """
+    failed = []
+    for i in range(0, len(keys), 1000):
+        resp = s3_client.delete_objects(Bucket=app.config['S3_PHOTO_BUCKET'],
+                                        Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]],
+                                                'Quiet': True})
+        failed.extend(error['Key'] for error in resp.get('Errors', []))
+    return failed
+
+
+def save_photos_ddb(photos):
+    """
+    Write many photos with BatchWriteItem, 25 items per request.
+    Unprocessed items are retried by pynamodb.
+    """
+    with Photo.batch_write() as batch:
+        for photo in photos:
+            batch.save(photo)
+
+
+@xray_recorder.capture()
+def delete_photos(user_id, email, photo_ids):
+    """
+    Bulk delete. S3 objects go first, with DeleteObjects, so a photo whose objects could not
+    be deleted keeps its item and can be deleted again. The items are removed with one batch
+    write and the album version is bumped once.
+    :param user_id: Cognito user id
+    :param email: user email address
+    :param photo_ids: list of photo ids
+    :return: one result dict per distinct id, in input order
+    """
+    photo_ids = list(dict.fromkeys(photo_ids))
+    found = {photo.id: photo for photo in
+             Photo.batch_get([(user_id, photo_id) for photo_id in photo_ids],
+                             attributes_to_get=['user_id', 'id', 'filename'])}
+    results = {photo_id: {'photo_id': photo_id} for photo_id in photo_ids}
+    for photo_id in photo_ids:
+        if photo_id not in found:
+            results[photo_id]['error'] = 'not exist photo_id'
+
+    owners = {}
+    for photo in found.values():
+        for key in photo_keys(email, photo.filename):
+            owners[key] = photo.id
+    try:
+        failed = delete_keys_s3(boto3.client('s3'), list(owners))
+    except Exception as e:
+        app.logger.error('ERROR:bulk s3 delete failed:user_id:{0}:{1}'.format(user_id, e))
+        failed = list(owners)
+    for key in failed:
+        results[owners[key]]['error'] = 's3 delete failed'
+        found.pop(owners[key], None)
+
+    if found:
+        try:
+            with Photo.batch_write() as batch:
+                for photo in found.values():
+                    batch.delete(photo)
+            outcome = {'deleted': True}
+        except Exception as e:
+            # some items of the batch may be gone already, deleting them again is harmless
+            app.logger.error('ERROR:bulk photo delete failed:user_id:{0}:{1}'.format(user_id, e))
+            outcome = {'error': 'photo delete failed'}
+        bump_album_version(user_id)
+        for photo_id in found:
+            results[photo_id].update(outcome)
+    return [results[photo_id] for photo_id in photo_ids]
+
+
 @xray_recorder.capture()
-def presigned_url(filename, email, Thumbnail=True):
+def upload_photos(user_id, email, files, form):
+    """
+    Bulk upload: originals go to S3 through a pool of BULK_UPLOAD_CONCURRENCY threads,
+    the new photos are written with batch writes, the album version is bumped once and
+    the post-upload processing of every photo is queued in one transaction.
+    When a batch write fails, the photos whose items were not written are reported as failed
+    and their originals deleted.
+    :param user_id: Cognito user id
+    :param email: user email address
+    :param files: list of werkzeug.datastructures.FileStorage
+    :param form: parsed form, its fields (tags, desc, ...) apply to every file
+    :return: one result dict per file, in input order
+    """
+    results = [{'filename': upload.filename} for upload in files]
+    pending = []
+    hashes = {}
+    repeated = []
+    for upload, result in zip(files, results):
+        if not is_allowed_file(upload.filename or ''):
+            result['error'] = 'file format is not supported'
+            continue
+        content_hash = content_digest(upload)
+        if content_hash in hashes:
+            repeated.append((result, hashes[content_hash]))
+            continue
+        extension = upload.filename.rsplit('.', 1)[1].lower()
+        result['photo_id'] = secure_filename('{0}.{1}'.format(uuid.uuid4(), extension))
+        hashes[content_hash] = result
+        pending.append((upload, result, content_hash))
+
+    s3_client = boto3.client('s3')
+    prefix = "photos/{0}/".format(email_normalize(email))
+    flask_app = app._get_current_object()
+    # the pool threads have no trace entity of their own, their S3 and DynamoDB calls join the request's
+    entity = xray_recorder.get_trace_entity()
+
+    def store(entity, upload, result, content_hash):
+        if entity is not None:
+            xray_recorder.set_trace_entity(entity)
+        try:
+            with flask_app.app_context():
+                duplicate_id = find_duplicate(user_id, content_hash)
+                if duplicate_id:
+                    return duplicate_id, None
+                return None, upload_stream_s3(s3_client, prefix + result['photo_id'], upload.stream,
+                                              upload.mimetype or 'image/jpeg')
+        finally:
+            xray_recorder.clear_trace_entities()
+
+    photos = []
+    with ThreadPoolExecutor(max_workers=app.config['BULK_UPLOAD_CONCURRENCY']) as pool:
+        futures = [pool.submit(store, entity, *item) for item in pending]
+        for (upload, result, content_hash), future in zip(pending, futures):
+            try:
+                duplicate_id, filesize = future.result()
+            except Exception as e:
+                app.logger.error('ERROR:bulk upload failed:user_id:{0}:{1}:{2}'.format(user_id, upload.filename, e))
+                del result['photo_id']
+                result['error'] = 'upload failed'
+                continue
+            if duplicate_id:
+                result.update(photo_id=duplicate_id, duplicate=True)
+            else:
+                photo = create_photo_info(user_id, result['photo_id'], filesize, dict(form, file=upload), content_hash)
+                result['processing_state'] = photo.processing_state
+                photos.append(photo)
+
+    # one batch per BatchWriteItem request, so a failure leaves the earlier batches written
+    written = []
+    try:
+        for i in range(0, len(photos), 25):
+            save_photos_ddb(photos[i:i + 25])
+            written.extend(photos[i:i + 25])
+    except Exception as e:
+        app.logger.error('ERROR:bulk photo write failed:user_id:{0}:{1}'.format(user_id, e))
+        unconfirmed = photos[len(written):]
+        try:
+            stored = {photo.id for photo in Photo.batch_get([(user_id, photo.id) for photo in unconfirmed],
+                                                            attributes_to_get=['id'])}
+            lost = [photo for photo in unconfirmed if photo.id not in stored]
+        except Exception as e:
+            # the items may have been written, their originals are kept
+            app.logger.error('ERROR:bulk photo write check failed:user_id:{0}:{1}'.format(user_id, e))
+            stored, lost = set(), []
+        try:
+            delete_keys_s3(s3_client, [prefix + photo.filename for photo in lost])
+        except Exception as e:
+            # the per-file results are still returned, the originals are left behind
+            app.logger.error('ERROR:bulk upload cleanup failed:user_id:{0}:{1}'.format(user_id, e))
+        written.extend(photo for photo in unconfirmed if photo.id in stored)
+        failed = {photo.id for photo in unconfirmed if photo.id not in stored}
+        for result in results:
+            if result.get('photo_id') in failed:
+                del result['photo_id']
+                del result['processing_state']
+                result['error'] = 'upload failed'
+
+    if written:
+        bump_album_version(user_id)
+        photo_jobs.enqueue_many([(user_id, photo.id, email) for photo in written])
+
+    # the same content sent twice in one request is stored once
+    for result, first in repeated:
+        if 'error' in first:
+            result['error'] = first['error']
+        else:
+            result.update(photo_id=first['photo_id'], duplicate=True)
+    return results
+
+
+_session = None
+
+
+def _boto_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+
+@functools.lru_cache(maxsize=16)
+def _sigv4_signing_key(secret_key, datestamp, region):
+    key = hmac.new(('AWS4' + secret_key).encode('utf-8'), datestamp.encode('utf-8'), hashlib.sha256).digest()
+    for part in (region, 's3', 'aws4_request'):
+        key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+    return key
+
+
+def presign_many(keys, expires_in=None, credentials=None, now=None):
+    """
+    Presigned GET urls (SigV4 query auth, virtual hosted style) for many keys of the photo bucket.
+    The date scoped signing key is derived once, each url then costs one HMAC and some string formatting.
+    The urls are identical to botocore's s3v4 generate_presigned_url for the same timestamp.
+    :param keys: S3 object keys
+    :param expires_in: url lifetime in seconds, S3_PRESIGNED_URL_EXPIRE_TIME by default
+    :param credentials: botocore credentials, the default session's by default
+    :param now: signing time (UTC datetime), now by default
+    :return: list of urls in the order of keys
+    """
+    if expires_in is None:
+        expires_in = int(app.config['S3_PRESIGNED_URL_EXPIRE_TIME'])
+    credentials = (credentials or _boto_session().get_credentials()).get_frozen_credentials()
+    now = now or datetime.utcnow()
+    bucket, region = app.config['S3_PHOTO_BUCKET'], app.config['AWS_REGION']
+
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    scope = '{0}/{1}/s3/aws4_request'.format(amz_date[:8], region)
+    signing_key = _sigv4_signing_key(credentials.secret_key, amz_date[:8], region)
+    if region == 'us-east-1':
+        host = '{0}.s3.amazonaws.com'.format(bucket)
+    else:
+        host = '{0}.s3.{1}.amazonaws.com'.format(bucket, region)
+
+    params = [('X-Amz-Algorithm', 'AWS4-HMAC-SHA256'),
+              ('X-Amz-Credential', '{0}/{1}'.format(credentials.access_key, scope)),
+              ('X-Amz-Date', amz_date),
+              ('X-Amz-Expires', str(expires_in)),
+              ('X-Amz-SignedHeaders', 'host')]
+    if credentials.token:
+        params.append(('X-Amz-Security-Token', credentials.token))
+    query = '&'.join('{0}={1}'.format(name, quote(value, safe='-_.~')) for name, value in params)
+    canonical_query = '&'.join(sorted(query.split('&')))
+
+    urls = []
+    for key in keys:
+        path = '/' + quote(key, safe='/~')
+        canonical_request = 'GET\n{0}\n{1}\nhost:{2}\n\nhost\nUNSIGNED-PAYLOAD'.format(path, canonical_query, host)
+        string_to_sign = 'AWS4-HMAC-SHA256\n{0}\n{1}\n{2}'.format(
+            amz_date, scope, hashlib.sha256(canonical_request.encode('utf-8')).hexdigest())
+        signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        urls.append('https://{0}{1}?{2}&X-Amz-Signature={3}'.format(host, path, query, signature))
+    return urls
+
+
+def cached_presigned_urls(keys):
+    """
+    Presigned GET urls of photo objects, reused until PRESIGNED_URL_REUSE_FRACTION of
+    S3_PRESIGNED_URL_EXPIRE_TIME has elapsed. Stable urls let browsers cache the images.
+    Cache misses are signed together with presign_many.
+    :param keys: S3 object keys
+    :return: list of urls in the order of keys
+    """
+    expires_in = int(app.config['S3_PRESIGNED_URL_EXPIRE_TIME'])
+    bucket = app.config['S3_PHOTO_BUCKET']
+
+    urls = [presigned_urls.get((bucket, key, expires_in)) for key in keys]
+    missing = [i for i, url in enumerate(urls) if url is None]
+    if missing:
+        ttl = expires_in * app.config['PRESIGNED_URL_REUSE_FRACTION']
+        for i, url in zip(missing, presign_many([keys[i] for i in missing], expires_in)):
+            presigned_urls.set((bucket, keys[i], expires_in), url, ttl=ttl)
+            urls[i] = url
+    return urls
+
+
+@xray_recorder.capture()
+def presigned_url(filename, email, Thumbnail=True, fmt='jpeg'):
 
     try:
-        s3_client = boto3.client('s3')
         key = None
         if Thumbnail:
-            key = "photos/{0}/thumbnails/{1}".format(email_normalize(email), filename)
+            key = thumbnail_key(email, filename, fmt=fmt)
         else:
             key = "photos/{0}/{1}".format(email_normalize(email), filename)
 
-        url = solution_generate_s3_presigned_url(s3_client, key)
+        url, = cached_presigned_urls([key])
         return url
 
 
@@ -212,59 +844,106 @@ def presigned_url(filename, email, Thumbnail=True):
 
 
 
-def presigned_url_both(filename, email):
+def presigned_url_both(filename, email, fmt='jpeg'):
     """
     Return presigned urls both original image url and thumbnail image url
     :param filename:
     :param email:
+    :param fmt: thumbnail format
     :return:
     """
     prefix = "photos/{0}/".format(email_normalize(email))
-    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
-    key_thumb = "{0}{1}".format(prefix_thumb, filename)
+    key_thumb = thumbnail_key(email, filename, fmt=fmt)
     key_origin = "{0}{1}".format(prefix, filename)
     try:
-        s3_client = boto3.client('s3')
-        thumb_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': app.config['S3_PHOTO_BUCKET'], 'Key': key_thumb},
-            ExpiresIn=app.config['S3_PRESIGNED_URL_EXPIRE_TIME'])
-        origin_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': app.config['S3_PHOTO_BUCKET'], 'Key': key_origin},
-            ExpiresIn=app.config['S3_PRESIGNED_URL_EXPIRE_TIME'])
+        thumb_url, origin_url = cached_presigned_urls([key_thumb, key_origin])
     except Exception as e:
         raise e
     return thumb_url, origin_url
 
 
-def with_presigned_url(current_user, photo):
+def photo_thumbnail_format(photo, fmt):
+    """
+    The requested thumbnail format if the photo has renditions in it, JPEG otherwise.
+    :param photo: Photo item
+    :param fmt: negotiated thumbnail format
+    :return: thumbnail format
+    """
+    return fmt if fmt in (photo.thumbnail_formats or ()) else 'jpeg'
+
+
+# Photo list output fields -> Photo attributes needed to render them
+PHOTO_LIST_FIELDS = {
+    'address': ['address'], 'city': ['city'], 'desc': ['desc'], 'filename': ['filename'],
+    'filename_orig': ['filename_orig'], 'filesize': ['filesize'], 'geotag_lat': ['geotag_lat'],
+    'geotag_lng': ['geotag_lng'], 'height': ['height'], 'id': ['id'], 'make': ['make'], 'model': ['model'],
+    'nation': ['nation'], 'tags': ['tags'], 'taken_date': ['taken_date'], 'upload_date': ['upload_date'],
+    'user_id': ['user_id'], 'width': ['width'], 'processing_state': ['processing_state'],
+    'thumbSrc': ['filename', 'processing_state', 'thumbnail_formats'],
+    'originalSrc': ['filename'],
+}
+
+
+def parse_fields(value):
+    """
+    Parse the fields= query parameter of the photo list.
+    :param value: comma separated output field names, or None for every field
+    :return: list of field names or None, raises ValueError on an unknown field
+    """
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in PHOTO_LIST_FIELDS]
+    if unknown:
+        raise ValueError('unknown fields: {0}'.format(','.join(unknown)))
+    return fields
+
+
+def photo_attributes(fields):
+    """
+    Photo attributes to read from DynamoDB for the requested output fields (ProjectionExpression).
+    The table keys are always read, pagination resumes from them.
+    :param fields: list of output field names, None for every field
+    :return: list of attribute names or None
+    """
+    if fields is None:
+        return None
+    attributes = {'user_id', 'id'}
+    for name in fields:
+        attributes.update(PHOTO_LIST_FIELDS[name])
+    return sorted(attributes)
+
+
+def with_presigned_url(current_user, photo, fmt='jpeg', fields=None):
     """
     Append additional attributes for presigned URL access.
     :param current_user:
     :param photo:
+    :param fmt: negotiated thumbnail format
+    :param fields: output fields, None for every field. Urls which are not requested are not signed.
     :return:
     """
-    thumbSrc, originalSrc = presigned_url_both(photo.filename, current_user['email'])
+    fields = PHOTO_LIST_FIELDS if fields is None else fields
     temp = {}
-    temp['address'] = photo.address
-    temp['city'] = photo.city
-    temp['desc'] = photo.desc
-    temp['filename'] = photo.filename
-    temp['filename_orig'] = photo.filename_orig
-    temp['filesize'] = photo.filesize
-    temp['geotag_lat'] = float(photo.geotag_lat)
-    temp['geotag_lng'] = float(photo.geotag_lng)
-    temp['height'] = photo.height
-    temp['id'] = photo.id
-    temp['make'] = photo.make
-    temp['model'] = photo.model
-    temp['nation'] = photo.nation
-    temp['tags'] = photo.tags
-    temp['taken_date'] = photo.taken_date
-    temp['upload_date'] = photo.upload_date
-    temp['user_id'] = photo.user_id
-    temp['width'] = photo.width
-    temp['thumbSrc'] = thumbSrc
-    temp['originalSrc'] = originalSrc
+    for name in fields:
+        if name not in ('thumbSrc', 'originalSrc'):
+            temp[name] = getattr(photo, name)
+    for name in ('geotag_lat', 'geotag_lng'):
+        if name in temp:
+            temp[name] = float(temp[name])
+    if 'processing_state' in temp:
+        temp['processing_state'] = temp['processing_state'] or PROCESSING_READY
+
+    key_origin = "photos/{0}/{1}".format(email_normalize(current_user['email']), photo.filename)
+    keys = {}
+    if 'thumbSrc' in fields:
+        # Until its renditions exist, a pending photo is shown from the original
+        if (photo.processing_state or PROCESSING_READY) == PROCESSING_READY:
+            keys['thumbSrc'] = thumbnail_key(current_user['email'], photo.filename,
+                                             fmt=photo_thumbnail_format(photo, fmt))
+        else:
+            keys['thumbSrc'] = key_origin
+    if 'originalSrc' in fields:
+        keys['originalSrc'] = key_origin
+    temp.update(zip(keys, cached_presigned_urls(list(keys.values()))))
     return temp
\ No newline at end of file
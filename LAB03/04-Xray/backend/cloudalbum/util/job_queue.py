@@ -0,0 +1,191 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from aws_xray_sdk.core import xray_recorder
+
+
+class PhotoJobQueue(object):
+    """
+    Post-upload processing queue.
+    Thumbnail renditions and metadata extraction run on in-process worker threads after
+    the upload response has been sent. Jobs are kept in a local SQLite table until they
+    succeed, so jobs queued before a restart (or abandoned by a crashed worker) run again.
+    """
+
+    def __init__(self, app=None, handler=None, on_failure=None):
+        self.app = None
+        self.handler = None
+        self.on_failure = None
+        self._pending = threading.Semaphore(0)
+        self._stopped = threading.Event()
+        self._threads = []
+        if app is not None:
+            self.init_app(app, handler, on_failure)
+
+    def init_app(self, app, handler, on_failure=None):
+        """
+        :param app: Flask.application
+        :param handler: handler(user_id, photo_id, email), runs inside an application context
+        :param on_failure: on_failure(user_id, photo_id, error), called once a job ran out of attempts
+        """
+        self.app = app
+        self.handler = handler
+        self.on_failure = on_failure
+        self.db_path = app.config['JOB_QUEUE_DB']
+        self.workers = app.config['JOB_QUEUE_WORKERS']
+        self.max_attempts = app.config['JOB_QUEUE_MAX_ATTEMPTS']
+        self.poll_interval = app.config['JOB_QUEUE_POLL_INTERVAL']
+        self.lease = app.config['JOB_QUEUE_LEASE']
+        self.failed_retention = app.config['JOB_QUEUE_FAILED_RETENTION']
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS photo_job ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'user_id TEXT NOT NULL, photo_id TEXT NOT NULL, email TEXT NOT NULL, '
+                         'state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+                         'not_before REAL NOT NULL, claimed_at REAL, error TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS photo_job_state ON photo_job (state, not_before)')
+
+        self.stop()
+        self._stopped = threading.Event()
+        self._threads = [threading.Thread(target=self._work, args=(self._stopped,),
+                                          name='photo-job-{0}'.format(i), daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+        app.extensions['photo_jobs'] = self
+        app.logger.info('Photo job queue: workers:{0}, db:{1}'.format(self.workers, self.db_path))
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, user_id, photo_id, email):
+        """
+        Queue post-upload processing of a photo. Without workers the job runs right away.
+        """
+        self.enqueue_many([(user_id, photo_id, email)])
+
+    def enqueue_many(self, jobs):
+        """
+        Queue post-upload processing of many photos in one transaction.
+        :param jobs: list of (user_id, photo_id, email)
+        """
+        if not self.workers:
+            for job in jobs:
+                self._run_inline(*job)
+            return
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany("INSERT INTO photo_job (user_id, photo_id, email, state, not_before) "
+                             "VALUES (?, ?, ?, 'queued', ?)", [tuple(job) + (now,) for job in jobs])
+            conn.execute('COMMIT')
+        for _ in jobs:
+            self._pending.release()
+
+    def _run_inline(self, user_id, photo_id, email):
+        # no retries on the request thread, the photo is stored already so the upload still succeeds
+        try:
+            self.handler(user_id, photo_id, email)
+        except Exception as e:
+            self.app.logger.error('ERROR:photo job failed:photo_id:{0}:inline'.format(photo_id))
+            self.app.logger.error(e)
+            if self.on_failure is not None:
+                self.on_failure(user_id, photo_id, e)
+
+    def _prune(self):
+        # failed jobs are kept for inspection until JOB_QUEUE_FAILED_RETENTION after their last attempt
+        with self._connect() as conn:
+            conn.execute("DELETE FROM photo_job WHERE state = 'failed' AND not_before <= ?",
+                         (time.time() - self.failed_retention,))
+
+    def _claim(self):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            job = conn.execute("SELECT id, user_id, photo_id, email, attempts FROM photo_job "
+                               "WHERE (state = 'queued' AND not_before <= ?) "
+                               "OR (state = 'running' AND claimed_at <= ?) "
+                               "ORDER BY id LIMIT 1", (now, now - self.lease)).fetchone()
+            if job is not None:
+                conn.execute("UPDATE photo_job SET state = 'running', claimed_at = ? WHERE id = ?", (now, job[0]))
+            conn.execute('COMMIT')
+            return job
+
+    def _work(self, stopped):
+        while not stopped.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                self.app.logger.error('ERROR:photo job claim failed:{0}'.format(e))
+                job = None
+
+            if job is None:
+                try:
+                    self._prune()
+                except sqlite3.Error as e:
+                    self.app.logger.error('ERROR:photo job prune failed:{0}'.format(e))
+                self._pending.acquire(timeout=self.poll_interval)
+                continue
+            try:
+                self._run(*job)
+            except Exception as e:
+                self.app.logger.error('ERROR:photo job worker error:{0}'.format(e))
+
+    def _run(self, job_id, user_id, photo_id, email, attempts):
+        xray_recorder.begin_segment('CloudAlbum-photo-job')
+        try:
+            with self.app.app_context():
+                try:
+                    self.handler(user_id, photo_id, email)
+                except Exception as e:
+                    self._retry(job_id, user_id, photo_id, attempts + 1, e)
+                    return
+
+            with self._connect() as conn:
+                conn.execute('DELETE FROM photo_job WHERE id = ?', (job_id,))
+            self.app.logger.debug('success:photo job done:user_id:{0}, photo_id:{1}'.format(user_id, photo_id))
+        finally:
+            xray_recorder.end_segment()
+
+    def _retry(self, job_id, user_id, photo_id, attempts, error):
+        self.app.logger.error('ERROR:photo job failed:photo_id:{0}:attempt:{1}'.format(photo_id, attempts))
+        self.app.logger.error(error)
+
+        state = 'queued' if attempts < self.max_attempts else 'failed'
+        # a failed job's not_before is the time it failed, _prune expires it from there
+        not_before = time.time() + 2 ** attempts if state == 'queued' else time.time()
+        with self._connect() as conn:
+            conn.execute('UPDATE photo_job SET state = ?, attempts = ?, not_before = ?, error = ? WHERE id = ?',
+                         (state, attempts, not_before, str(error), job_id))
+
+        if state == 'failed' and self.on_failure is not None:
+            self.on_failure(user_id, photo_id, error)
+
+    def stats(self):
+        """
+        Number of jobs by state.
+        :return: dict
+        """
+        with self._connect() as conn:
+            rows = conn.execute('SELECT state, COUNT(*) FROM photo_job GROUP BY state').fetchall()
+        stats = {'queued': 0, 'running': 0, 'failed': 0}
+        stats.update(dict(rows))
+        stats['workers'] = self.workers
+        return stats
+
+    def stop(self):
+        self._stopped.set()
+        for _ in self._threads:
+            self._pending.release()
+        self._threads = []
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import requests
+from jose import jwk
+
+
+class KeyRegistry(object):
+    """
+    Cognito user pool signing keys, parsed once into ready verifiers.
+    Keys are refreshed in the background once they are older than ttl, and reloaded
+    (one fetch at a time) when a token names a kid the registry does not know.
+    """
+
+    def __init__(self, url=None, ttl=3600, min_reload_interval=30, background=True):
+        self.url = url
+        self.ttl = ttl
+        self.min_reload_interval = min_reload_interval
+        self.background = background
+        self._keys = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def init_app(self, app):
+        """
+        :param app: Flask.application
+        """
+        self.url = 'https://cognito-idp.{0}.amazonaws.com/{1}/.well-known/jwks.json'.format(
+            app.config['AWS_REGION'], app.config['COGNITO_POOL_ID'])
+        self.ttl = app.config['JWKS_TTL']
+        self.min_reload_interval = app.config['JWKS_MIN_RELOAD_INTERVAL']
+        with self._lock:
+            self._keys, self._loaded_at = {}, None
+        app.extensions['jwks'] = self
+
+    def fetch(self):
+        """
+        :return: list of JWK dicts published by the user pool
+        """
+        resp = requests.get(self.url, timeout=5)
+        resp.raise_for_status()
+        return resp.json()['keys']
+
+    def load(self, keys):
+        """
+        Replace the registry content.
+        :param keys: list of JWK dicts
+        """
+        constructed = {key['kid']: jwk.construct(key) for key in keys}
+        with self._lock:
+            self._keys, self._loaded_at = constructed, time.monotonic()
+
+    def refresh(self):
+        self.load(self.fetch())
+
+    def get(self, kid):
+        """
+        :param kid: key id from the token header
+        :return: public key with a verify(message, signature) method, None for an unknown kid
+        """
+        if self._loaded_at is None:
+            self._reload(kid)
+        elif time.monotonic() - self._loaded_at > self.ttl:
+            self._refresh_stale()
+
+        key = self._keys.get(kid)
+        if key is None:
+            self._reload(kid)
+            key = self._keys.get(kid)
+        return key
+
+    def _reload(self, kid):
+        # Single flight: concurrent callers wait for the fetch in progress instead of starting their own.
+        with self._lock:
+            if kid in self._keys:
+                return
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.min_reload_interval:
+                return
+            self._keys = {key['kid']: jwk.construct(key) for key in self.fetch()}
+            self._loaded_at = time.monotonic()
+
+    def _refresh_stale(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                # keep serving the current keys, retry after min_reload_interval
+                self._loaded_at = time.monotonic() - self.ttl + self.min_reload_interval
+            finally:
+                self._refreshing = False
+
+        if self.background:
+            threading.Thread(target=run, name='jwks-refresh', daemon=True).start()
+        else:
+            run()
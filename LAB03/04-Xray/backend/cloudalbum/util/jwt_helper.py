@@ -1,61 +1,55 @@
-import json
 import time
-import requests
+import hashlib
 from functools import wraps
-from flask import request, jsonify, make_response
-from sqlalchemy.orm.exc import NoResultFound
-from jose import jwk, jwt
+from flask import request, jsonify, make_response, g
+from jose import jwt
 from jose.utils import base64url_decode
 from flask import current_app as app
 
+from cloudalbum import jwks, verified_tokens, cognito_users, revocations
 from cloudalbum.solution import solution_get_cognito_user_data
 
-POOL_KEYS = None
-blacklist_set = set()
-
 def add_token_to_set(token):
     """
-    Adds a new token to the set. It is not revoked when it is added.
-    :param identity_claim:
+    Revoke a signed-out token until it expires.
+    :param token: access token
     """
     claims= token_decoder(token)
-    jti = claims['jti']
-    blacklist_set.add(jti)
+    revocations.revoke(claims['jti'], claims['exp'])
+    verified_tokens.pop(token_digest(token))
 
 def is_blacklisted_token_set(decoded_token):
     """
-    Checks if the given token is revoked or not. Because we are adding all the
-    tokens that we create into this database, if the token is not present
-    in the database we are going to consider it revoked, as we don't know where
-    it was created.
+    Checks if the given token is revoked or not.
     """
-    jti = decoded_token['jti']
-    try:
-        if jti in blacklist_set:
-            return True
-    except NoResultFound:
-        return False
-
-def set_cognito_data_global():
-    global POOL_KEYS
-    POOL_URL = 'https://cognito-idp.{}.amazonaws.com/{}/.well-known/jwks.json'.format(app.config['AWS_REGION'],
-                                                                                      app.config['COGNITO_POOL_ID'])
-    if POOL_KEYS is None:
-        aws_data = requests.get(POOL_URL)
-        POOL_KEYS = json.loads(aws_data.text)['keys']
-        app.logger.debug("COGNITO POOL_KEYS SET DONE!")
+    return revocations.is_revoked(decoded_token['jti'])
+
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
 
 def token_decoder(token):
-    set_cognito_data_global()
+    """
+    Verified claims of a Cognito token. Claims are cached until the token expires,
+    so the RSA signature of a session token is only verified once.
+    """
+    digest = token_digest(token)
+    claims = verified_tokens.get(digest)
+    if claims is None:
+        claims = verify_token(token)
+        verified_tokens.set(digest, claims, ttl=claims['exp'] - time.time())
+    if 'jti' in claims and revocations.is_revoked(claims['jti']):
+        app.logger.error('Token is revoked')
+        raise Exception
+    return claims
 
+def verify_token(token):
     headers = jwt.get_unverified_headers(token)
     kid = headers['kid']
 
-    result = {}
-    for item in POOL_KEYS:
-        result[item['kid']] = item
-
-    public_key = jwk.construct(result.get(kid))
+    public_key = jwks.get(kid)
+    if public_key is None:
+        app.logger.error('Unknown signing key: {0}'.format(kid))
+        raise Exception
 
     message, encoded_signature = str(token).rsplit('.', 1)
     decoded_signature = base64url_decode(encoded_signature.encode('utf-8'))
@@ -74,26 +68,75 @@ def token_decoder(token):
     return claims
 
 
+class Principal(object):
+    """
+    Authenticated caller of a request: the token, its verified claims and the user they resolve to.
+    The user is resolved on first use and kept for the rest of the request.
+    """
+
+    def __init__(self, token, claims):
+        self.token = token
+        self.claims = claims
+        self._user = None
+
+    @property
+    def user_id(self):
+        return self.claims['sub']
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = resolve_user(self.claims, self.token)
+        return self._user
+
+
 def cog_jwt_required(f):
+    """
+    Verify the bearer token once per request. The Principal is stored in flask.g
+    and passed to the handler as the principal keyword argument.
+    """
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not 'Authorization' in request.headers:
             return make_response(jsonify({'msg':'no token'}), 400)
 
-        token = request.headers['Authorization'].replace('Bearer ', '')
+        token = get_token_from_header(request)
 
         try:
-            if token_decoder(token) is not None:
-                return f(*args, **kwargs)
+            claims = token_decoder(token)
         except Exception as e:
-            print(e)
+            app.logger.error(e)
             return make_response(jsonify({'msg':'invalid token'}), 400)
 
+        g.principal = Principal(token, claims)
+        return f(*args, principal=g.principal, **kwargs)
+
     return decorated_function
 
 def get_cognito_user(access_token):
-    # TODO 8: Implement follwing solution code to get user data from Cognito user pool
-    return solution_get_cognito_user_data(access_token)
+    return resolve_user(token_decoder(access_token), access_token)
+
+
+def resolve_user(claims, access_token):
+    """
+    User data of a verified token. ID tokens carry the profile in their claims, access tokens
+    only carry sub, so their GetUser result is cached per sub for COGNITO_USER_CACHE_TTL seconds.
+    :param claims: verified token claims
+    :param access_token: token the claims were read from
+    :return: dict with user_id, email and the other user pool attributes
+    """
+    if claims.get('token_use') == 'id' and 'email' in claims:
+        user = {key: value for key, value in claims.items() if key in ('email', 'name', 'email_verified')}
+        user['user_id'] = claims['sub']
+        return user
+
+    user = cognito_users.get(claims['sub'])
+    if user is None:
+        # TODO 8: Implement follwing solution code to get user data from Cognito user pool
+        user = solution_get_cognito_user_data(access_token)
+        if user is not None:
+            cognito_users.set(claims['sub'], user, ttl=app.config['COGNITO_USER_CACHE_TTL'])
+    return user
 
 
 def get_token_from_header(request):
@@ -0,0 +1,57 @@
+import base64
+import binascii
+import json
+
+
+class CursorError(ValueError):
+    """
+    Malformed limit or cursor query parameter.
+    """
+
+
+def encode_cursor(value):
+    """
+    Opaque page cursor for a JSON serializable position.
+    :param value: position of the last returned item
+    :return: url safe cursor string
+    """
+    raw = json.dumps(value, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor, cursor_type=str):
+    """
+    Position encoded by encode_cursor.
+    :param cursor: cursor string from the query string
+    :param cursor_type: expected type of the position
+    :return: position of the last returned item
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value = json.loads(raw.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise CursorError('invalid cursor')
+    if not isinstance(value, cursor_type):
+        raise CursorError('invalid cursor')
+    return value
+
+
+def page_args(args, max_limit, cursor_type=str):
+    """
+    Read limit/cursor query parameters. Without both, the whole list is returned.
+    :param args: request.args
+    :param max_limit: largest page size a client may ask for
+    :param cursor_type: expected type of the cursor position
+    :return: (limit or None, decoded cursor or None)
+    """
+    limit, cursor = args.get('limit'), args.get('cursor')
+    if limit is None and cursor is None:
+        return None, None
+
+    try:
+        limit = int(limit) if limit is not None else max_limit
+    except ValueError:
+        raise CursorError('invalid limit')
+    if limit < 1:
+        raise CursorError('invalid limit')
+    return min(limit, max_limit), decode_cursor(cursor, cursor_type) if cursor else None
@@ -1,7 +1,86 @@
-from flask import make_response
+import datetime
+import decimal
+import json
 
-def m_response(data, code):
-    return make_response({'ok': True, 'photos': data}, code)
+from aws_xray_sdk.core import xray_recorder
+from flask import current_app as app, make_response, stream_with_context
+
+# Characters of encoded items buffered before a chunk is written to the client
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def json_default(o):
+    if isinstance(o, datetime.datetime):
+        return str(o)
+    if isinstance(o, decimal.Decimal):
+        return int(o) if o == o.to_integral_value() else float(o)
+    if isinstance(o, set):
+        return list(o)
+    raise TypeError('Object of type {0} is not JSON serializable'.format(type(o).__name__))
+
+
+_encoder = json.JSONEncoder(separators=(',', ':'), default=json_default)
+
+
+def m_response(data, code, **extra):
+    body = {'ok': True, 'photos': data}
+    body.update(extra)
+    return make_response(body, code)
+
+
+def iter_json_list(items, chunk_size=STREAM_CHUNK_SIZE, **extra):
+    """
+    Encode {'ok': true, 'photos': [...], **extra} chunk by chunk, items are pulled one at a time.
+    :param items: iterable of JSON serializable items
+    :param chunk_size: characters buffered before a chunk is yielded
+    :param extra: other top level keys, callables are called once every item has been encoded
+    :return: generator of str chunks
+    """
+    buffer, size = ['{"ok":true,"photos":['], 0
+    for count, item in enumerate(items):
+        encoded = _encoder.encode(item)
+        buffer.append(',' + encoded if count else encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    buffer.append(']')
+    for key, value in extra.items():
+        buffer.append(',{0}:{1}'.format(_encoder.encode(key), _encoder.encode(value() if callable(value) else value)))
+    buffer.append('}')
+    yield ''.join(buffer)
+
+
+def stream_response(items, code, **extra):
+    """
+    m_response for large lists: the body is written while the items are produced,
+    so memory use does not grow with the length of the list.
+    :param items: iterable of JSON serializable items
+    :param code: HTTP status code
+    :param extra: other top level keys, see iter_json_list
+    :return: streamed flask.Response
+    """
+    return app.response_class(stream_with_context(iter_json_list(items, **extra)), status=code,
+                              mimetype='application/json')
+
+def traced_items(items, name):
+    """
+    XRayMiddleware ends the request segment in after_request, before a streamed body is produced.
+    The subsegment opened here holds the segment back until the items are consumed, so the DynamoDB
+    and S3 calls made while streaming are recorded under it and sent with the request.
+    :param items: iterable consumed by a streamed response
+    :param name: subsegment name
+    :return: generator of the items
+    """
+    subsegment = xray_recorder.begin_subsegment(name)
+
+    def generate():
+        try:
+            yield from items
+        finally:
+            if subsegment is not None:
+                xray_recorder.end_subsegment()
+    return generate()
 
 def err_response(msg, code):
-    return make_response({'ok':False, 'Message': msg}, code)
\ No newline at end of file
+    return make_response({'ok':False, 'Message': msg}, code)
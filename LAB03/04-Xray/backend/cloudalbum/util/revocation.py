@@ -0,0 +1,240 @@
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+class BloomFilter(object):
+    """
+    Fixed size Bloom filter over strings. False positives are possible, false negatives are not.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        # m = -n ln(p) / ln(2)^2 bits, k = m / n ln(2) hash functions
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.sha256(value.encode('utf-8')).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class MemoryRevocationBackend(object):
+    """
+    Revoked jtis of this process only. Other workers do not see them.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, jti, exp):
+        with self._lock:
+            self._entries[jti] = exp
+
+    def is_revoked(self, jti):
+        exp = self._entries.get(jti)
+        return exp is not None and exp > time.time()
+
+    def active(self):
+        now = time.time()
+        with self._lock:
+            return [jti for jti, exp in self._entries.items() if exp > now]
+
+    def prune(self):
+        now = time.time()
+        with self._lock:
+            for jti in [jti for jti, exp in self._entries.items() if exp <= now]:
+                del self._entries[jti]
+
+
+class SQLiteRevocationBackend(object):
+    """
+    Revoked jtis in a SQLite file, shared by the workers of one host.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS revoked_tokens (jti TEXT PRIMARY KEY, exp REAL NOT NULL)')
+
+    @contextmanager
+    def _connection(self):
+        # one connection per call, sqlite3 connections can not be shared between threads
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def revoke(self, jti, exp):
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO revoked_tokens (jti, exp) VALUES (?, ?)', (jti, exp))
+
+    def is_revoked(self, jti):
+        with self._connection() as conn:
+            row = conn.execute('SELECT 1 FROM revoked_tokens WHERE jti = ? AND exp > ?', (jti, time.time())).fetchone()
+        return row is not None
+
+    def active(self):
+        with self._connection() as conn:
+            return [row[0] for row in conn.execute('SELECT jti FROM revoked_tokens WHERE exp > ?', (time.time(),))]
+
+    def prune(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM revoked_tokens WHERE exp <= ?', (time.time(),))
+
+
+class DynamoDBRevocationBackend(object):
+    """
+    Revoked jtis in the RevokedToken table, shared by every instance.
+    DynamoDB TTL deletes expired items, reads ignore the ones it has not deleted yet.
+    active() scans the whole table, sync it less often than the local backends.
+    """
+
+    def __init__(self, read_capacity_units=5, write_capacity_units=5):
+        # imported here, cloudalbum.database must not be loaded while cloudalbum is being imported
+        from cloudalbum.database.model_ddb import RevokedToken
+        self.model = RevokedToken
+        if not RevokedToken.exists():
+            RevokedToken.create_table(read_capacity_units=read_capacity_units,
+                                      write_capacity_units=write_capacity_units, wait=True)
+
+    def revoke(self, jti, exp):
+        self.model(jti, exp=datetime.fromtimestamp(exp, timezone.utc)).save()
+
+    def is_revoked(self, jti):
+        try:
+            item = self.model.get(jti, consistent_read=True)
+        except self.model.DoesNotExist:
+            return False
+        return item.exp.timestamp() > time.time()
+
+    def active(self):
+        now = time.time()
+        return [item.jti for item in self.model.scan() if item.exp.timestamp() > now]
+
+    def prune(self):
+        pass
+
+
+class RevocationStore(object):
+    """
+    Signed-out tokens by jti, each kept until the token's exp.
+    A local Bloom filter answers the common "not revoked" case without leaving the process. It is
+    rebuilt from the backend every sync_interval seconds, which also picks up the revocations of
+    other workers and prunes expired entries. Only filter hits are confirmed with the backend.
+    One thread syncs at a time, the others keep answering from the current filter meanwhile.
+    """
+
+    def __init__(self, backend=None, sync_interval=5, capacity=100000):
+        self.backend = backend or MemoryRevocationBackend()
+        self.sync_interval = sync_interval
+        self.capacity = capacity
+        self._filter = BloomFilter(capacity)
+        self._synced_at = None
+        self._pending = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._stats = dict(checks=0, filter_hits=0, revoked=0, syncs=0)
+
+    def init_app(self, app):
+        """
+        :param app: Flask.application
+        """
+        backend = app.config['REVOCATION_BACKEND']
+        self.sync_interval = app.config['REVOCATION_SYNC_INTERVAL']
+        if backend == 'sqlite':
+            self.backend = SQLiteRevocationBackend(app.config['REVOCATION_SQLITE_PATH'])
+        elif backend == 'dynamodb':
+            self.backend = DynamoDBRevocationBackend(app.config['DDB_RCU'], app.config['DDB_WCU'])
+            self.sync_interval = app.config['REVOCATION_DYNAMODB_SYNC_INTERVAL']
+        elif backend == 'memory':
+            self.backend = MemoryRevocationBackend()
+        else:
+            raise ValueError('Unknown REVOCATION_BACKEND: {0}'.format(backend))
+        self.capacity = app.config['REVOCATION_FILTER_CAPACITY']
+        with self._lock:
+            self._filter, self._synced_at = BloomFilter(self.capacity), None
+        app.extensions['revocations'] = self
+
+    def revoke(self, jti, exp):
+        """
+        :param jti: token id
+        :param exp: token expiry, epoch seconds
+        """
+        self.backend.revoke(jti, exp)
+        with self._lock:
+            self._filter.add(jti)
+            if self._pending is not None:
+                self._pending.append(jti)
+
+    def is_revoked(self, jti):
+        """
+        :param jti: token id
+        :return: True if the token was signed out
+        """
+        self._incr('checks')
+        if self._synced_at is None or time.monotonic() - self._synced_at > self.sync_interval:
+            self.sync()
+        if jti not in self._filter:
+            return False
+        self._incr('filter_hits')
+        revoked = self.backend.is_revoked(jti)
+        if revoked:
+            self._incr('revoked')
+        return revoked
+
+    def sync(self):
+        """
+        Prune expired entries and rebuild the filter from the backend.
+        Returns at once when another thread is syncing, except before the first sync.
+        """
+        if not self._sync_lock.acquire(blocking=self._synced_at is None):
+            return
+        try:
+            if self._synced_at is not None and time.monotonic() - self._synced_at <= self.sync_interval:
+                return
+            # revocations made while the backend is read are added to the new filter as well
+            with self._lock:
+                self._pending = []
+            self.backend.prune()
+            rebuilt = BloomFilter(self.capacity)
+            for jti in self.backend.active():
+                rebuilt.add(jti)
+            with self._lock:
+                for jti in self._pending:
+                    rebuilt.add(jti)
+                self._filter, self._synced_at = rebuilt, time.monotonic()
+                self._stats['syncs'] += 1
+        finally:
+            with self._lock:
+                self._pending = None
+            self._sync_lock.release()
+
+    def _incr(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """
+        Revocation check metrics.
+        :return: dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['backend'] = type(self.backend).__name__
+        return stats
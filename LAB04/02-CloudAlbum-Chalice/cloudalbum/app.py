@@ -11,18 +11,32 @@
 import boto3
 import logging
 import uuid
-import json
 from chalicelib import cognito
-from chalicelib.config import cors_config
-from chalicelib.util import pp, save_s3_chalice, get_parts, delete_s3
-from chalice import Chalice, Response, BadRequestError, AuthResponse, ChaliceViewError
-from chalicelib.model_ddb import Photo, create_photo_info, ModelEncoder, with_presigned_url
+from chalicelib.config import cors_config, conf
+from chalicelib.util import pp, save_s3_chalice, get_parts, delete_s3, page_args, encode_cursor
+from chalicelib.multipart import MultipartError
+from chalice import Chalice, Response, BadRequestError, AuthResponse, AuthRoute, ChaliceViewError
+from chalicelib.model_ddb import Photo, create_photo_info, with_presigned_url, delete_photos
+from chalicelib.model_ddb import parse_fields, photo_attributes, encode_photo_list
 
 app = Chalice(app_name='cloudalbum')
 app.debug = True
 app.log.setLevel(logging.DEBUG)
 
-@app.authorizer()
+BULK_DELETE_MAX_IDS = int(conf.get('BULK_DELETE_MAX_IDS', 1000))
+
+# API Gateway caches the policy per token and applies it to later requests on any route,
+# so it lists every route using jwt_auth rather than only the one being invoked.
+AUTHORIZED_ROUTES = [
+    AuthRoute('/photos', ['GET']),
+    AuthRoute('/photos/file', ['POST']),
+    AuthRoute('/photos/*', ['DELETE']),
+    AuthRoute('/photos/delete', ['POST']),
+    AuthRoute('/users/signout', ['POST']),
+]
+
+
+@app.authorizer(ttl_seconds=cognito.AUTHORIZER_TTL)
 def jwt_auth(auth_request):
     """
     JWT based authorizer
@@ -31,8 +45,9 @@ def jwt_auth(auth_request):
     """
     token = auth_request.token
     try:
-        decoded = cognito.token_decoder(token)
-        return AuthResponse(routes=['*'], principal_id=decoded['sub'])
+        # Resolve the user here once, routes read it back with cognito.current_user.
+        principal_id, context = cognito.authorize(token)
+        return AuthResponse(routes=AUTHORIZED_ROUTES, principal_id=principal_id, context=context)
     except Exception as e:
         app.log.error(e)
         return AuthResponse(routes=[''], principal_id='')
@@ -45,13 +60,18 @@ def upload():
     File upload with multipart/form data.
     :return:
     """
-    form = get_parts(app)
-    filename_orig = form['filename_orig'][0].decode('utf-8')
+    try:
+        form = get_parts(app)
+    except MultipartError as e:
+        raise BadRequestError(e)
+    if 'file' not in form.files:
+        raise BadRequestError('file is required')
+    filename_orig = form.fields['filename_orig']
     extension = (filename_orig.rsplit('.', 1)[1]).lower()
     try:
-        current_user = cognito.user_info(cognito.get_token(app.current_request))
+        current_user = cognito.current_user(app.current_request)
         filename = "{0}.{1}".format(uuid.uuid4(), extension)
-        filesize = save_s3_chalice(form['file'][0], filename, current_user['email'], app.log)
+        filesize = save_s3_chalice(form.files['file'].data, filename, current_user['email'], app.log)
 
         pp.pprint(current_user)
         new_photo = create_photo_info(current_user['user_id'], filename, filesize, form)
@@ -67,14 +87,33 @@ def upload():
 def photo_list():
     """
     Retrieve Photo table items with signed URL attribute.
+    With ?limit= (and ?cursor= from the previous page) one page is returned, plus the next cursor.
+    ?fields=id,thumbSrc,... returns (and reads) only those attributes.
     :return:
     """
-    current_user = cognito.user_info(cognito.get_token(app.current_request))
     try:
-        photos = Photo.query(current_user['user_id'])
-        data = {'ok': True, 'photos': []}
-        [data['photos'].append(with_presigned_url(current_user, photo)) for photo in photos]
-        body = json.dumps(data, cls=ModelEncoder)
+        limit, after = page_args(app.current_request.query_params)
+        fields = parse_fields((app.current_request.query_params or {}).get('fields'))
+    except ValueError as e:
+        raise BadRequestError(e)
+
+    current_user = cognito.current_user(app.current_request)
+    try:
+        attributes = photo_attributes(fields)
+        if limit is None:
+            photos = Photo.query(current_user['user_id'], attributes_to_get=attributes)
+        else:
+            start_key = {'user_id': {'S': current_user['user_id']}, 'id': {'S': after}} if after else None
+            photos = Photo.query(current_user['user_id'], limit=limit, page_size=limit, last_evaluated_key=start_key,
+                                 attributes_to_get=attributes)
+        items = (with_presigned_url(current_user, photo, fields) for photo in photos)
+        if limit is None:
+            body = encode_photo_list(items)
+        else:
+            def cursor():
+                last_key = photos.last_evaluated_key
+                return encode_cursor(last_key['id']['S']) if last_key else None
+            body = encode_photo_list(items, cursor=cursor)
         return Response(status_code=200, body=body,
                         headers={'Content-Type': 'application/json'})
     except Exception as e:
@@ -89,7 +128,7 @@ def delete(photo_id):
     :param photo_id:
     :return:
     """
-    current_user = cognito.user_info(cognito.get_token(app.current_request))
+    current_user = cognito.current_user(app.current_request)
     try:
         photo = Photo.get(current_user['user_id'], photo_id)
         file_deleted = delete_s3(app.log, photo.filename, current_user)
@@ -101,6 +140,29 @@ def delete(photo_id):
         raise ChaliceViewError(e)
 
 
+@app.route('/photos/delete', methods=['POST'], cors=cors_config,
+           authorizer=jwt_auth, content_types=['application/json'])
+def bulk_delete():
+    """
+    Delete many photos: {"photo_ids": [...]}
+    :return: one result per photo id, deleted or error
+    """
+    body = app.current_request.json_body
+    photo_ids = body.get('photo_ids') if isinstance(body, dict) else None
+    if not isinstance(photo_ids, list) or not all(isinstance(photo_id, str) for photo_id in photo_ids):
+        raise BadRequestError('photo_ids must be a list of photo ids')
+    if len(photo_ids) > BULK_DELETE_MAX_IDS:
+        raise BadRequestError('too many photo ids, max:{0}'.format(BULK_DELETE_MAX_IDS))
+
+    current_user = cognito.current_user(app.current_request)
+    try:
+        results = delete_photos(current_user['user_id'], current_user['email'], photo_ids, app.log)
+        return Response(status_code=200, body={'ok': True, 'results': results},
+                        headers={'Content-Type': 'application/json'})
+    except Exception as e:
+        raise ChaliceViewError(e)
+
+
 @app.route('/users/signin', methods=['POST'],
            cors=cors_config, content_types=['application/json'])
 def signin():
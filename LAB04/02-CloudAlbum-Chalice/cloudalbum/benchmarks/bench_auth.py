@@ -0,0 +1,112 @@
+"""
+    cloudalbum/benchmarks/bench_auth.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Per-request authentication cost, before and after the request principal.
+
+    Before: the JWK is parsed and the signature verified on every request, and the handler
+    calls Cognito GetUser for the user it already authenticated.
+    After: keys come from chalicelib.jwks.KeyRegistry, verified claims and users from LRU caches,
+    and the resolved user is handed to the handler once.
+
+    GetUser is simulated with a sleep, the network time it takes in your region.
+    Run from the project directory: python benchmarks/bench_auth.py [GetUser latency in ms] [requests]
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+import os
+import sys
+import time
+
+import rsa
+from jose import jwk, jwt
+from jose.utils import base64url_decode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chalicelib.cache import LRUCache  # noqa: E402
+from chalicelib.jwks import KeyRegistry  # noqa: E402
+
+KID = 'bench-key'
+
+
+def make_keys():
+    public, private = rsa.newkeys(2048)
+    jwks = [dict(jwk.construct(public.save_pkcs1().decode('ascii'), 'RS256').to_dict(), kid=KID)]
+    claims = {'sub': 'b9f1c5c0-user', 'token_use': 'access', 'jti': 'bench', 'exp': time.time() + 3600}
+    token = jwt.encode(claims, private.save_pkcs1().decode('ascii'), algorithm='RS256', headers={'kid': KID})
+    return jwks, token
+
+
+def verify(public_key, token):
+    message, encoded_signature = str(token).rsplit('.', 1)
+    if not public_key.verify(message.encode('utf8'), base64url_decode(encoded_signature.encode('utf-8'))):
+        raise Exception('Signature verification failed')
+    claims = jwt.get_unverified_claims(token)
+    if time.time() > claims['exp']:
+        raise Exception('Token is expired')
+    return claims
+
+
+class Before(object):
+    """Previous token_decoder + get_cognito_user."""
+
+    def __init__(self, jwks, get_user):
+        self.jwks = jwks
+        self.get_user = get_user
+
+    def request(self, token):
+        kid = jwt.get_unverified_headers(token)['kid']
+        keys = {item['kid']: item for item in self.jwks}
+        verify(jwk.construct(keys.get(kid)), token)
+        return self.get_user(token)
+
+
+class After(object):
+    """KeyRegistry, verified token cache and user cache, one lookup per request."""
+
+    def __init__(self, jwks, get_user):
+        self.registry = KeyRegistry(ttl=3600)
+        self.registry.load(jwks)
+        self.verified = LRUCache(maxsize=10000)
+        self.users = LRUCache(maxsize=10000)
+        self.get_user = get_user
+
+    def request(self, token):
+        digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        claims = self.verified.get(digest)
+        if claims is None:
+            claims = verify(self.registry.get(jwt.get_unverified_headers(token)['kid']), token)
+            self.verified.set(digest, claims, ttl=claims['exp'] - time.time())
+        user = self.users.get(claims['sub'])
+        if user is None:
+            user = self.get_user(token)
+            self.users.set(claims['sub'], user, ttl=300)
+        return user
+
+
+def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.02
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    jwks, token = make_keys()
+    calls = []
+
+    def get_user(access_token):
+        calls.append(access_token)
+        time.sleep(latency)
+        return {'user_id': 'b9f1c5c0-user', 'email': 'bench@example.com'}
+
+    print('GetUser latency: {0:.1f} ms, {1} requests with the same token'.format(latency * 1000, requests))
+    for name, flow in (('before', Before(jwks, get_user)), ('after', After(jwks, get_user))):
+        del calls[:]
+        start = time.perf_counter()
+        for _ in range(requests):
+            assert flow.request(token)['user_id'] == 'b9f1c5c0-user'
+        elapsed = time.perf_counter() - start
+        print('{0:<8} {1:>10.3f} ms/request {2:>6} GetUser calls'.format(name, elapsed / requests * 1000, len(calls)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+    cloudalbum/benchmarks/bench_multipart.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Compare chalicelib.multipart with the cgi.parse_multipart based parser it replaced.
+
+    Run from the project directory: python benchmarks/bench_multipart.py [body size in MB]
+    The cgi module was removed in Python 3.13, the baseline is skipped there.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chalicelib.multipart import parse_multipart  # noqa: E402
+
+try:
+    import cgi
+except ImportError:
+    cgi = None
+
+BOUNDARY = '----CloudAlbumBenchmarkBoundary'
+CONTENT_TYPE = 'multipart/form-data; boundary={0}'.format(BOUNDARY)
+FIELDS = ['filename_orig', 'tags', 'desc', 'geotag_lat', 'geotag_lng', 'taken_date', 'make', 'model',
+          'width', 'height', 'city', 'nation', 'address']
+
+
+def make_body(size):
+    parts = []
+    for name in FIELDS:
+        parts.append('--{0}\r\nContent-Disposition: form-data; name="{1}"\r\n\r\nvalue\r\n'
+                     .format(BOUNDARY, name).encode('utf-8'))
+    parts.append('--{0}\r\nContent-Disposition: form-data; name="file"; filename="photo.jpg"\r\n'
+                 'Content-Type: image/jpeg\r\n\r\n'.format(BOUNDARY).encode('utf-8'))
+    parts.append(os.urandom(size))
+    parts.append('\r\n--{0}--\r\n'.format(BOUNDARY).encode('utf-8'))
+    return b''.join(parts)
+
+
+def parse_cgi(body):
+    """Previous chalicelib.util.get_parts, followed by the field decoding done in app.upload."""
+    _, parameters = cgi.parse_header(CONTENT_TYPE)
+    parameters['boundary'] = parameters['boundary'].encode('utf-8')
+    parsed = cgi.parse_multipart(BytesIO(body), parameters)
+    # Since Python 3.7 cgi.parse_multipart already decodes text fields.
+    fields = {name: parsed[name][0] if isinstance(parsed[name][0], str) else parsed[name][0].decode('utf-8')
+              for name in FIELDS}
+    return fields, parsed['file'][0]
+
+
+def parse_new(body):
+    form = parse_multipart(body, CONTENT_TYPE)
+    return form.fields, form.files['file'].data
+
+
+def measure(name, fn, body, number=5):
+    seconds = min(timeit.repeat(lambda: fn(body), number=number, repeat=3)) / number
+    tracemalloc.start()
+    fn(body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('{0:<10} {1:>10.2f} ms {2:>10.2f} MB peak allocated'.format(name, seconds * 1000, peak / 1024 / 1024))
+
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 10 * 1024 * 1024
+    body = make_body(size)
+    print('body: {0:.2f} MB'.format(len(body) / 1024 / 1024))
+
+    fields, data = parse_new(body)
+    assert len(data) == size and fields['city'] == 'value'
+    if cgi is not None:
+        assert parse_cgi(body) == (fields, data.tobytes())
+        measure('cgi', parse_cgi, body)
+    measure('multipart', parse_new, body)
+
+
+if __name__ == '__main__':
+    main()
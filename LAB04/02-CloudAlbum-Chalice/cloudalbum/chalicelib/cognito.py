@@ -10,19 +10,35 @@
 import base64
 import hashlib
 import hmac
-import json
+import os
 import time
 import boto3
-import requests
-from jose import jwk, jwt
+from jose import jwt
 from chalicelib.config import conf
+from chalicelib.jwks import KeyRegistry
+from chalicelib.cache import LRUCache
 from chalice import UnauthorizedError
 from jose.utils import base64url_decode
 
-POOL_KEYS = None
 POOL_URL = 'https://cognito-idp.{}.amazonaws.com/{}/.well-known/jwks.json'.\
     format(conf['AWS_REGION'], conf['COGNITO_POOL_ID'])
 
+# Signing keys are parsed once per container and refreshed inline once older than JWKS_TTL.
+signing_keys = KeyRegistry(POOL_URL, ttl=int(conf.get('JWKS_TTL', 3600)), background=False)
+# Keys bundled at deploy time (see chalicelib/jwks.py), the first invocation then needs no JWKS fetch.
+JWKS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jwks.json')
+if os.path.exists(JWKS_FILE):
+    signing_keys.load_file(JWKS_FILE)
+
+# jwt_auth results per token, for at most AUTHORIZER_TTL seconds and never past the token's exp.
+# API Gateway caches the returned policy for the same AUTHORIZER_TTL.
+authorizations = LRUCache(maxsize=int(conf.get('AUTHORIZER_CACHE_SIZE', 10000)))
+AUTHORIZER_TTL = int(conf.get('AUTHORIZER_TTL', 300))
+
+# GetUser results by sub, shared by the warm invocations of a container.
+cognito_users = LRUCache(maxsize=int(conf.get('COGNITO_USER_CACHE_SIZE', 1000)))
+COGNITO_USER_CACHE_TTL = int(conf.get('COGNITO_USER_CACHE_TTL', 300))
+
 
 def remove_barer(token):
     return token.replace('Bearer ', '')
@@ -101,13 +117,6 @@ def generate_token(client, auth, req_data):
     return res_body
 
 
-def set_cognito_data_global():
-    global POOL_KEYS
-    if POOL_KEYS is None:
-        aws_data = requests.get(POOL_URL)
-        POOL_KEYS = json.loads(aws_data.text)['keys']
-
-
 def token_decoder(token):
     """
     The ID token expires one hour after the user authenticates.
@@ -116,17 +125,14 @@ def token_decoder(token):
     :param token:
     :return:
     """
-    set_cognito_data_global()
     token = remove_barer(token)
 
     headers = jwt.get_unverified_headers(token)
     kid = headers['kid']
 
-    result = {}
-    for item in POOL_KEYS:
-        result[item['kid']] = item
-
-    public_key = jwk.construct(result.get(kid))
+    public_key = signing_keys.get(kid)
+    if public_key is None:
+        raise UnauthorizedError('Invalid Token')
 
     message, encoded_signature = str(token).rsplit('.', 1)
     decoded_signature = base64url_decode(encoded_signature.encode('utf-8'))
@@ -166,23 +172,73 @@ def get_token(request):
     return token
 
 
-def user_info(access_token):
+def authorize(token):
+    """
+    Verify a token for the jwt_auth authorizer.
+    GetUser runs on every cache miss, so a signed-out token is rejected once its entry has expired.
+    :param token: Authorization header value
+    :return: (principal id, authorizer context with user_id and email)
+    """
+    token = remove_barer(token)
+    key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    result = authorizations.get(key)
+    if result is not None:
+        return result
+
+    claims = token_decoder(token)
+    user = user_info(token, use_cache=False)
+    result = (claims['sub'], {'user_id': user['user_id'], 'email': user['email']})
+    authorizations.set(key, result, ttl=min(AUTHORIZER_TTL, claims['exp'] - time.time()))
+    return result
+
+
+def current_user(request):
+    """
+    User of the request, resolved once by the jwt_auth authorizer and passed in its context.
+    Falls back to user_info when the request carries no authorizer context, e.g. under chalice local.
+    :param request: app.current_request
+    :return: dict with user_id and email
+    """
+    context = (request.context or {}).get('authorizer') or {}
+    if context.get('user_id') and context.get('email'):
+        return {'user_id': context['user_id'], 'email': context['email']}
+    return user_info(get_token(request))
+
+
+def user_info(access_token, use_cache=True):
     """
     Retrieve user information in the Cognito user pool.
+    The token was verified by the authorizer before the route runs, so its claims are read without verifying again.
+    ID tokens carry the profile in their claims, GetUser results for access tokens are cached per sub.
     :param access_token:
+    :param use_cache: False to always ask Cognito, which also checks that the token was not signed out
     :return:
     """
+    try:
+        claims = jwt.get_unverified_claims(access_token)
+    except Exception:
+        raise UnauthorizedError('Token is invalid!')
+    if claims.get('token_use') == 'id' and 'email' in claims:
+        user = {key: value for key, value in claims.items() if key in ('email', 'name', 'email_verified')}
+        user['user_id'] = claims['sub']
+        return user
+
+    user = cognito_users.get(claims['sub']) if use_cache else None
+    if user is not None:
+        return user
+
     client = boto3.client('cognito-idp')
     try:
         cognito_user = client.get_user(AccessToken=access_token)
-        user_info = {}
+        user = {}
         for attr in cognito_user['UserAttributes']:
             key = attr['Name']
             if key == 'sub':
                 key = 'user_id'
             val = attr['Value']
-            user_info[key] = val
-        return user_info
-    except Exception as e:
+            user[key] = val
+        cognito_users.set(claims['sub'], user, ttl=COGNITO_USER_CACHE_TTL)
+        return user
+    except Exception:
         raise UnauthorizedError('Token is invalid!')
 
@@ -0,0 +1,123 @@
+"""
+    cloudalbum/chalicelib/jwks.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Cognito user pool signing key registry.
+
+    The keys can be bundled with the deployment package so a cold start needs no JWKS fetch:
+    python chalicelib/jwks.py https://cognito-idp.<region>.amazonaws.com/<pool id>/.well-known/jwks.json
+    writes chalicelib/jwks.json, which chalicelib.cognito loads at import.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+from jose import jwk
+
+
+class KeyRegistry(object):
+    """
+    Cognito user pool signing keys, parsed once into ready verifiers.
+    Keys are refreshed once they are older than ttl, and reloaded (one fetch at a time)
+    when a token names a kid the registry does not know.
+    A Lambda container is frozen between invocations, so use background=False there.
+    """
+
+    def __init__(self, url=None, ttl=3600, min_reload_interval=30, background=True):
+        self.url = url
+        self.ttl = ttl
+        self.min_reload_interval = min_reload_interval
+        self.background = background
+        self._keys = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def fetch(self):
+        """
+        :return: list of JWK dicts published by the user pool
+        """
+        resp = requests.get(self.url, timeout=5)
+        resp.raise_for_status()
+        return resp.json()['keys']
+
+    def load(self, keys):
+        """
+        Replace the registry content.
+        :param keys: list of JWK dicts
+        """
+        constructed = {key['kid']: jwk.construct(key) for key in keys}
+        with self._lock:
+            self._keys, self._loaded_at = constructed, time.monotonic()
+
+    def load_file(self, path):
+        """
+        Load keys saved from the JWKS endpoint. They are refreshed like fetched keys once older than ttl.
+        :param path: JSON file with a 'keys' list
+        """
+        with open(path) as f:
+            self.load(json.load(f)['keys'])
+
+    def refresh(self):
+        self.load(self.fetch())
+
+    def get(self, kid):
+        """
+        :param kid: key id from the token header
+        :return: public key with a verify(message, signature) method, None for an unknown kid
+        """
+        if self._loaded_at is None:
+            self._reload(kid)
+        elif time.monotonic() - self._loaded_at > self.ttl:
+            self._refresh_stale()
+
+        key = self._keys.get(kid)
+        if key is None:
+            self._reload(kid)
+            key = self._keys.get(kid)
+        return key
+
+    def _reload(self, kid):
+        # Single flight: concurrent callers wait for the fetch in progress instead of starting their own.
+        with self._lock:
+            if kid in self._keys:
+                return
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.min_reload_interval:
+                return
+            self._keys = {key['kid']: jwk.construct(key) for key in self.fetch()}
+            self._loaded_at = time.monotonic()
+
+    def _refresh_stale(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                # keep serving the current keys, retry after min_reload_interval
+                self._loaded_at = time.monotonic() - self.ttl + self.min_reload_interval
+            finally:
+                self._refreshing = False
+
+        if self.background:
+            threading.Thread(target=run, name='jwks-refresh', daemon=True).start()
+        else:
+            run()
+
+
+if __name__ == '__main__':
+    registry = KeyRegistry(sys.argv[1])
+    keys = registry.fetch()
+    registry.load(keys)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jwks.json'), 'w') as f:
+        json.dump({'keys': keys}, f, indent=2)
+    print('{0} keys saved'.format(len(keys)))
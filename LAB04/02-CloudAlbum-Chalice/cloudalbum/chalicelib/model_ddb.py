@@ -9,10 +9,13 @@
 """
 import json
 from datetime import datetime
+from decimal import Decimal
 from tzlocal import get_localzone
 from pynamodb.models import Model
 from chalicelib.config import conf
-from chalicelib.util import presigned_url_both
+import boto3
+from chalicelib.util import presigned_url_both, cached_presigned_url, thumbnail_key, email_normalize
+from chalicelib.util import photo_keys, delete_keys_s3
 from pynamodb.attributes import UnicodeAttribute, NumberAttribute, UTCDateTimeAttribute
 
 
@@ -49,24 +52,71 @@ def create_photo_info(user_id, filename, filesize, form):
     new_photo = Photo(user_id=user_id,
                       id=filename,
                       filename=filename,
-                      filename_orig=form['filename_orig'][0].decode('utf-8'),
+                      filename_orig=form.fields['filename_orig'],
                       filesize=filesize,
                       upload_date=datetime.today(),
-                      tags=form['tags'][0].decode('utf-8'),
-                      desc=form['desc'][0].decode('utf-8'),
-                      geotag_lat=form['geotag_lat'][0].decode('utf-8'),
-                      geotag_lng=form['geotag_lng'][0].decode('utf-8'),
-                      taken_date=datetime.strptime(form['taken_date'][0].decode('utf-8'), "%Y:%m:%d %H:%M:%S"),
-                      make=form['make'][0].decode('utf-8'),
-                      model=form['model'][0].decode('utf-8'),
-                      width=form['width'][0].decode('utf-8'),
-                      height=form['height'][0].decode('utf-8'),
-                      city=form['city'][0].decode('utf-8'),
-                      nation=form['nation'][0].decode('utf-8'),
-                      address=form['address'][0].decode('utf-8'))
+                      tags=form.fields['tags'],
+                      desc=form.fields['desc'],
+                      geotag_lat=form.fields['geotag_lat'],
+                      geotag_lng=form.fields['geotag_lng'],
+                      taken_date=datetime.strptime(form.fields['taken_date'], "%Y:%m:%d %H:%M:%S"),
+                      make=form.fields['make'],
+                      model=form.fields['model'],
+                      width=form.fields['width'],
+                      height=form.fields['height'],
+                      city=form.fields['city'],
+                      nation=form.fields['nation'],
+                      address=form.fields['address'])
     return new_photo
 
 
+def delete_photos(user_id, email, photo_ids, logger):
+    """
+    Bulk delete. S3 objects go first, with DeleteObjects, so a photo whose objects could not
+    be deleted keeps its item and can be deleted again. The items are removed with one batch write.
+    :param user_id: Cognito user id
+    :param email: user email address
+    :param photo_ids: list of photo ids
+    :param logger:
+    :return: one result dict per distinct id, in input order
+    """
+    photo_ids = list(dict.fromkeys(photo_ids))
+    found = {photo.id: photo for photo in
+             Photo.batch_get([(user_id, photo_id) for photo_id in photo_ids],
+                             attributes_to_get=['user_id', 'id', 'filename'])}
+    results = {photo_id: {'photo_id': photo_id} for photo_id in photo_ids}
+    for photo_id in photo_ids:
+        if photo_id not in found:
+            results[photo_id]['error'] = 'not exist photo_id'
+
+    owners = {}
+    for photo in found.values():
+        for key in photo_keys(email, photo.filename):
+            owners[key] = photo.id
+    try:
+        failed = delete_keys_s3(boto3.client('s3'), list(owners))
+    except Exception as e:
+        logger.error('Error occurred while deleting files:%s', e)
+        failed = list(owners)
+    for key in failed:
+        results[owners[key]]['error'] = 's3 delete failed'
+        found.pop(owners[key], None)
+
+    if found:
+        try:
+            with Photo.batch_write() as batch:
+                for photo in found.values():
+                    batch.delete(photo)
+            outcome = {'deleted': True}
+        except Exception as e:
+            # some items of the batch may be gone already, deleting them again is harmless
+            logger.error('Error occurred while deleting photos:%s', e)
+            outcome = {'error': 'photo delete failed'}
+        for photo_id in found:
+            results[photo_id].update(outcome)
+    return [results[photo_id] for photo_id in photo_ids]
+
+
 class ModelEncoder(json.JSONEncoder):
     def default(self, obj):
         if hasattr(obj, 'attribute_values'):
@@ -76,38 +126,103 @@ class ModelEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+def _encode_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if hasattr(obj, 'attribute_values'):
+        return obj.attribute_values
+    raise TypeError('Object of type {0} is not JSON serializable'.format(type(obj).__name__))
+
+
+_list_encoder = json.JSONEncoder(separators=(',', ':'), default=_encode_default)
+
+
+def encode_photo_list(photos, **extra):
+    """
+    JSON body {"ok": true, "photos": [...], **extra}. Photos are encoded one at a time as they are
+    pulled from the iterable, so only the encoded body is held, never the whole list of dicts.
+    Lambda returns the body in one piece, it cannot be streamed to API Gateway.
+    :param photos: iterable of JSON serializable photo dicts
+    :param extra: other top level keys, callables are called once every photo has been encoded
+    :return: str
+    """
+    body = '{"ok":true,"photos":[' + ','.join(_list_encoder.encode(photo) for photo in photos) + ']'
+    for key, value in extra.items():
+        value = value() if callable(value) else value
+        body += ',{0}:{1}'.format(_list_encoder.encode(key), _list_encoder.encode(value))
+    return body + '}'
+
+
 if not Photo.exists():
     Photo.create_table(read_capacity_units=conf['DDB_RCU'], write_capacity_units=conf['DDB_WCU'], wait=True)
     print('DynamoDB Photo table created!')
 
 
-def with_presigned_url(current_user, photo):
+# Photo list output fields -> Photo attributes needed to render them
+PHOTO_LIST_FIELDS = {
+    'address': ['address'], 'city': ['city'], 'desc': ['desc'], 'filename': ['filename'],
+    'filename_orig': ['filename_orig'], 'filesize': ['filesize'], 'geotag_lat': ['geotag_lat'],
+    'geotag_lng': ['geotag_lng'], 'height': ['height'], 'id': ['id'], 'make': ['make'], 'model': ['model'],
+    'nation': ['nation'], 'tags': ['tags'], 'taken_date': ['taken_date'], 'upload_date': ['upload_date'],
+    'user_id': ['user_id'], 'width': ['width'],
+    'thumbSrc': ['filename'], 'originalSrc': ['filename'],
+}
+
+
+def parse_fields(value):
+    """
+    Parse the fields= query parameter of the photo list.
+    :param value: comma separated output field names, or None for every field
+    :return: list of field names or None, raises ValueError on an unknown field
+    """
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in PHOTO_LIST_FIELDS]
+    if unknown:
+        raise ValueError('unknown fields: {0}'.format(','.join(unknown)))
+    return fields
+
+
+def photo_attributes(fields):
+    """
+    Photo attributes to read from DynamoDB for the requested output fields (ProjectionExpression).
+    The table keys are always read, pagination resumes from them.
+    :param fields: list of output field names, None for every field
+    :return: list of attribute names or None
+    """
+    if fields is None:
+        return None
+    attributes = {'user_id', 'id'}
+    for name in fields:
+        attributes.update(PHOTO_LIST_FIELDS[name])
+    return sorted(attributes)
+
+
+def with_presigned_url(current_user, photo, fields=None):
     """
     Append additional attributes for presigned URL access.
     :param current_user:
     :param photo:
+    :param fields: output fields, None for every field. Urls which are not requested are not signed.
     :return:
     """
-    thumbSrc, originalSrc = presigned_url_both(photo.filename, current_user['email'])
+    fields = PHOTO_LIST_FIELDS if fields is None else fields
     temp = {}
-    temp['address'] = photo.address
-    temp['city'] = photo.city
-    temp['desc'] = photo.desc
-    temp['filename'] = photo.filename
-    temp['filename_orig'] = photo.filename_orig
-    temp['filesize'] = photo.filesize
-    temp['geotag_lat'] = float(photo.geotag_lat)
-    temp['geotag_lng'] = float(photo.geotag_lng)
-    temp['height'] = photo.height
-    temp['id'] = photo.id
-    temp['make'] = photo.make
-    temp['model'] = photo.model
-    temp['nation'] = photo.nation
-    temp['tags'] = photo.tags
-    temp['taken_date'] = photo.taken_date
-    temp['upload_date'] = photo.upload_date
-    temp['user_id'] = photo.user_id
-    temp['width'] = photo.width
-    temp['thumbSrc'] = thumbSrc
-    temp['originalSrc'] = originalSrc
+    for name in fields:
+        if name not in ('thumbSrc', 'originalSrc'):
+            temp[name] = getattr(photo, name)
+    for name in ('geotag_lat', 'geotag_lng'):
+        if name in temp:
+            temp[name] = float(temp[name])
+
+    if 'thumbSrc' in fields and 'originalSrc' in fields:
+        temp['thumbSrc'], temp['originalSrc'] = presigned_url_both(photo.filename, current_user['email'])
+    elif 'thumbSrc' in fields:
+        temp['thumbSrc'] = cached_presigned_url(thumbnail_key(current_user['email'], photo.filename))
+    elif 'originalSrc' in fields:
+        temp['originalSrc'] = cached_presigned_url(
+            "photos/{0}/{1}".format(email_normalize(current_user['email']), photo.filename))
     return temp
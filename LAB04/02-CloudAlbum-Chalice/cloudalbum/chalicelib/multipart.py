@@ -0,0 +1,205 @@
+"""
+    cloudalbum/chalicelib/multipart.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    multipart/form-data parser for API Gateway request bodies.
+
+    The whole body is already in memory (app.current_request.raw_body), so the parser only
+    locates boundaries in it: file parts are memoryview slices over the body, nothing is copied.
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import io
+import re
+
+_OPTION = re.compile(r';\s*([^=;\s]+)\s*=\s*("(?:\\.|[^"\\])*"|[^;]*)')
+
+MAX_HEADER_SIZE = 8 * 1024
+
+
+class MultipartError(ValueError):
+    """
+    Malformed multipart body or a limit exceeded.
+    """
+
+
+class FilePart(object):
+    """
+    Uploaded file. data is a memoryview over the request body.
+    """
+
+    def __init__(self, name, filename, content_type, data):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def reader(self):
+        """
+        New file-like object over the part, e.g. for boto3 put_object or PIL.
+        :return: BufferReader
+        """
+        return BufferReader(self.data)
+
+
+class MultipartForm(object):
+    """
+    Parsed form: fields maps names to decoded text, files maps names to FilePart.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.files = {}
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Seekable, read-only file object over a bytes-like object, without copying it the way BytesIO does.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._view) - self._pos
+        chunk = self._view[self._pos:self._pos + size].tobytes()
+        self._pos += len(chunk)
+        return chunk
+
+    def readall(self):
+        return self.read()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def __len__(self):
+        return len(self._view)
+
+
+def parse_options_header(value):
+    """
+    Split a header like 'form-data; name="file"; filename="a.jpg"' into its value and options.
+    :param value: header value
+    :return: (value, dict of options)
+    """
+    value = value or ''
+    main, _, rest = value.partition(';')
+    options = {}
+    for key, option in _OPTION.findall(';' + rest):
+        if option.startswith('"') and option.endswith('"'):
+            option = option[1:-1].replace('\\\\', '\\').replace('\\"', '"')
+        options[key.lower()] = option.strip()
+    return main.strip().lower(), options
+
+
+def _part_headers(block):
+    headers = {}
+    for line in block.decode('utf-8', 'replace').split('\r\n'):
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise MultipartError('Malformed part header')
+        headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def iter_parts(body, boundary, max_file_size=None, max_field_size=64 * 1024):
+    """
+    Yield the parts of a multipart body one at a time.
+    Limits are checked as soon as a part is located, before anything is decoded.
+    :param body: request body, bytes
+    :param boundary: multipart boundary from the Content-Type header
+    :param max_file_size: maximum size of a file part in bytes, None for no limit
+    :param max_field_size: maximum size of a text field in bytes
+    :return: generator of (name, filename or None, content type or None, memoryview)
+    """
+    view = memoryview(body)
+    delimiter = b'--' + boundary.encode('latin-1')
+
+    start = body.find(delimiter)
+    if start < 0:
+        raise MultipartError('Multipart boundary not found')
+    pos = start + len(delimiter)
+
+    while True:
+        if body[pos:pos + 2] == b'--':
+            return
+        if body[pos:pos + 2] != b'\r\n':
+            raise MultipartError('Malformed multipart boundary')
+        pos += 2
+
+        headers_end = body.find(b'\r\n\r\n', pos, pos + MAX_HEADER_SIZE)
+        if headers_end < 0:
+            raise MultipartError('Part headers are missing or too large')
+        headers = _part_headers(body[pos:headers_end])
+
+        data_start = headers_end + 4
+        data_end = body.find(b'\r\n' + delimiter, data_start)
+        if data_end < 0:
+            raise MultipartError('Closing multipart boundary not found')
+
+        disposition, options = parse_options_header(headers.get('content-disposition'))
+        if disposition != 'form-data' or 'name' not in options:
+            raise MultipartError('Part without form-data name')
+
+        filename = options.get('filename')
+        limit = max_file_size if filename is not None else max_field_size
+        if limit is not None and data_end - data_start > limit:
+            raise MultipartError('Part too large: {0}'.format(options['name']))
+
+        yield options['name'], filename, headers.get('content-type'), view[data_start:data_end]
+        pos = data_end + 2 + len(delimiter)
+
+
+def parse_multipart(body, content_type, max_body_size=None, max_file_size=None, max_field_size=64 * 1024):
+    """
+    Parse a multipart/form-data request body.
+    Text fields are decoded once, file parts are kept as memoryview slices of the body.
+    :param body: request body, bytes
+    :param content_type: Content-Type request header
+    :param max_body_size: maximum body size in bytes, None for no limit
+    :param max_file_size: maximum size of a file part in bytes, None for no limit
+    :param max_field_size: maximum size of a text field in bytes
+    :return: MultipartForm
+    """
+    mimetype, options = parse_options_header(content_type)
+    if mimetype != 'multipart/form-data' or not options.get('boundary'):
+        raise MultipartError('Not a multipart/form-data request')
+    if max_body_size is not None and len(body) > max_body_size:
+        raise MultipartError('Request body too large')
+
+    form = MultipartForm()
+    for name, filename, part_type, data in iter_parts(body, options['boundary'], max_file_size, max_field_size):
+        if filename is None:
+            try:
+                form.fields[name] = str(data, 'utf-8')
+            except UnicodeDecodeError:
+                raise MultipartError('Field is not valid UTF-8: {0}'.format(name))
+        else:
+            form.files[name] = FilePart(name, filename, part_type, data)
+    return form
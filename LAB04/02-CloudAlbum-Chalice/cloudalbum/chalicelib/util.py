@@ -8,31 +8,74 @@
     :license: MIT, see LICENSE for more details.
 """
 
-import os
-import cgi
+import json
 import boto3
+import base64
+import binascii
 import pprint
+import mimetypes
 from PIL import Image
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from chalicelib.config import conf
+from chalicelib.multipart import parse_multipart, BufferReader
+from chalicelib.cache import LRUCache
 from chalice import ChaliceViewError
 
 pp = pprint.PrettyPrinter(indent=2)
 
 
+# API Gateway rejects payloads above 10 MB anyway.
+MAX_UPLOAD_SIZE = int(conf.get('MAX_UPLOAD_SIZE', 10 * 1024 * 1024))
+
+
 def get_parts(app):
     """
     Parse Multipart-form data
     :param app:
-    :return:
+    :return: MultipartForm, raises MultipartError on a malformed or too large body
     """
-    rfile = BytesIO(app.current_request.raw_body)
-    content_type = app.current_request.headers['content-type']
-    _, parameters = cgi.parse_header(content_type)
-    parameters['boundary'] = parameters['boundary'].encode('utf-8')
-    parsed = cgi.parse_multipart(rfile, parameters)
-    return parsed
+    return parse_multipart(app.current_request.raw_body,
+                           app.current_request.headers['content-type'],
+                           max_body_size=MAX_UPLOAD_SIZE, max_file_size=MAX_UPLOAD_SIZE)
+
 
+PHOTO_PAGE_MAX_LIMIT = int(conf.get('PHOTO_PAGE_MAX_LIMIT', 1000))
+
+
+def page_args(query_params):
+    """
+    Read limit/cursor query parameters. Without both, the whole list is returned.
+    The cursor is the url safe base64 JSON of the last returned photo id.
+    :param query_params: app.current_request.query_params
+    :return: (limit or None, photo id to start after or None), raises ValueError on bad input
+    """
+    query_params = query_params or {}
+    limit, cursor = query_params.get('limit'), query_params.get('cursor')
+    if limit is None and cursor is None:
+        return None, None
+
+    limit = int(limit) if limit is not None else PHOTO_PAGE_MAX_LIMIT
+    if limit < 1:
+        raise ValueError('invalid limit')
+    after = None
+    if cursor:
+        try:
+            after = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise ValueError('invalid cursor')
+        if not isinstance(after, str):
+            raise ValueError('invalid cursor')
+    return min(limit, PHOTO_PAGE_MAX_LIMIT), after
+
+
+def encode_cursor(photo_id):
+    """
+    Opaque cursor for the next photo list page.
+    :param photo_id: id of the last returned photo
+    :return: cursor string
+    """
+    return base64.urlsafe_b64encode(json.dumps(photo_id).encode('utf-8')).rstrip(b'=').decode('ascii')
 
 
 def get_password_reset_url():
@@ -58,55 +101,137 @@ def email_normalize(email):
     return email.replace('@', '_at_').replace('.', '_dot_')
 
 
-def make_thumbnails(path, filename, app):
+# Thumbnail renditions encoded from one decode of each upload: name -> (max width, max height)
+RENDITIONS = {
+    'grid': (int(conf['THUMBNAIL_WIDTH']), int(conf['THUMBNAIL_HEIGHT'])),
+    'preview': (int(conf.get('PREVIEW_WIDTH', 1024)), int(conf.get('PREVIEW_HEIGHT', 768))),
+    'hero': (int(conf.get('HERO_WIDTH', 2048)), int(conf.get('HERO_HEIGHT', 1536))),
+}
+THUMBNAIL_QUALITY = int(conf.get('THUMBNAIL_QUALITY', 85))
+
+
+def thumbnail_key(email, filename, rendition='grid'):
     """
-    Generate thumbnail from original image file.
-    :param path: target path
+    S3 key of a thumbnail rendition. The 'grid' rendition keeps the original thumbnail location.
+    :param email: user email address.
     :param filename: secure file name
-    :param app: Falsk.application
-    :return: None
+    :param rendition: rendition name
+    :return: S3 key
     """
-    thumb_full_path = '/tmp/thumbnail.jpg'
-    im = Image.open(os.path.join(path, filename))
+    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
+    if rendition == 'grid':
+        return "{0}{1}".format(prefix_thumb, filename)
+    return "{0}{1}/{2}".format(prefix_thumb, rendition, filename)
+
+
+def decode_for_renditions(file_p, renditions):
+    """
+    Decode an image once, at the smallest scale which still covers every rendition.
+    JPEG sources use draft mode so the decoder itself scales by 1/2, 1/4 or 1/8.
+    :param file_p: file-like object or path of the original image
+    :param renditions: dict of rendition name -> (max width, max height)
+    :return: PIL.Image in RGB mode
+    """
+    im = Image.open(file_p)
+    scale = max(min(box[0] / im.width, box[1] / im.height, 1.0) for box in renditions.values())
+    needed = (max(1, int(im.width * scale + 0.5)), max(1, int(im.height * scale + 0.5)))
+
+    im.draft('RGB', needed)
     im = im.convert('RGB')
-    im.thumbnail((int(conf['THUMBNAIL_WIDTH']), int(conf['THUMBNAIL_HEIGHT']), Image.ANTIALIAS))
-    im.save(thumb_full_path)
-    return thumb_full_path
 
+    factor = min(im.width // needed[0], im.height // needed[1]) // 2
+    if factor > 1 and hasattr(im, 'reduce'):
+        im = im.reduce(factor)
+    return im
 
-def save_s3_chalice(bytes, filename, email, logger):
+
+def make_renditions(file_p, renditions=RENDITIONS):
+    """
+    Generate every thumbnail rendition from a single decode of the original image.
+    Renditions are resized largest first, each derived from the previous one
+    whenever that one still covers its bounding box.
+    :param file_p: file-like object or path of the original image
+    :param renditions: dict of rendition name -> (max width, max height)
+    :return: dict of rendition name -> JPEG bytes
+    """
+    source = decode_for_renditions(file_p, renditions)
+    previous, previous_box = source, None
+    result = {}
+
+    for name, box in sorted(renditions.items(), key=lambda item: item[1][0] * item[1][1], reverse=True):
+        covered = previous_box is None or (previous_box[0] >= box[0] and previous_box[1] >= box[1])
+        im = (previous if covered else source).copy()
+        im.thumbnail(box, Image.ANTIALIAS)
+
+        buffer = BytesIO()
+        im.save(buffer, 'JPEG', quality=THUMBNAIL_QUALITY)
+        result[name] = buffer.getvalue()
+        previous, previous_box = im, box
+    return result
+
+
+# S3 PUTs of one upload run concurrently. The pool outlives the invocation, so warm containers reuse its threads.
+upload_pool = ThreadPoolExecutor(max_workers=int(conf.get('S3_UPLOAD_CONCURRENCY', 4)))
+
+
+def save_s3_chalice(body, filename, email, logger):
     """
     File save from multipart-form data.
-    :param bytes:
+    Everything stays in memory: the original PUT starts right away and the thumbnail
+    renditions are encoded to buffers while it is in flight, then uploaded concurrently.
+    :param body: original image, bytes-like (e.g. FilePart.data)
     :param filename:
     :param email:
     :param logger:
-    :return:
+    :return: file size (byte)
     """
     prefix = "photos/{0}/".format(email_normalize(email))
-    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
     key = "{0}{1}".format(prefix, filename)
-    key_thumb = "{0}{1}".format(prefix_thumb, filename)
     logger.debug('key: {0}'.format(key))
-    logger.debug('key_thumb: {0}'.format(key_thumb))
     s3_client = boto3.client('s3')
     try:
-        temp_file = '/tmp/' + filename
-        with open(temp_file, 'wb') as f:
-            f.write(bytes)
-            statinfo = os.stat(temp_file)
-            logger.debug(statinfo)
-
-        s3_client.upload_file(temp_file, conf['S3_PHOTO_BUCKET'], key)
-        thumb_path = make_thumbnails('/tmp', temp_file, logger)
-        logger.debug('thumb_path for upload: {0}'.format(thumb_path))
-        logger.debug('prefix_thumb: {0}'.format(prefix_thumb))
-        logger.debug(os.stat(temp_file))
-        s3_client.upload_file(thumb_path, conf['S3_PHOTO_BUCKET'], key_thumb)
+        content_type = mimetypes.guess_type(filename)[0] or 'image/jpeg'
+        futures = [upload_pool.submit(s3_client.put_object, Bucket=conf['S3_PHOTO_BUCKET'], Key=key,
+                                      Body=BufferReader(body), ContentType=content_type)]
+
+        for rendition, thumbnail in make_renditions(BufferReader(body)).items():
+            key_thumb = thumbnail_key(email, filename, rendition)
+            logger.debug('key_thumb: {0}'.format(key_thumb))
+            futures.append(upload_pool.submit(s3_client.put_object, Bucket=conf['S3_PHOTO_BUCKET'], Key=key_thumb,
+                                              Body=thumbnail, ContentType='image/jpeg'))
+        for future in futures:
+            future.result()
     except Exception as e:
         logger.error('Error occurred while saving file:%s', e)
         raise ChaliceViewError('Error occurred while saving file.')
-    return len(bytes)
+    return len(body)
+
+
+def photo_keys(email, filename):
+    """
+    S3 keys of a photo: the original and every thumbnail rendition.
+    :param email: user email address.
+    :param filename: secure file name
+    :return: list of S3 keys
+    """
+    return ["photos/{0}/{1}".format(email_normalize(email), filename)] + \
+        [thumbnail_key(email, filename, rendition) for rendition in RENDITIONS]
+
+
+def delete_keys_s3(s3_client, keys):
+    """
+    Delete objects with DeleteObjects, 1000 keys (the API limit) per call, calls run on the upload pool.
+    :param s3_client: boto3 S3 client
+    :param keys: list of S3 keys
+    :return: list of keys S3 reported as not deleted
+    """
+    def delete_chunk(chunk):
+        resp = s3_client.delete_objects(Bucket=conf['S3_PHOTO_BUCKET'],
+                                        Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True})
+        return [error['Key'] for error in resp.get('Errors', [])]
+
+    chunks = [keys[i:i + 1000] for i in range(0, len(keys), 1000)]
+    return [key for failed in upload_pool.map(delete_chunk, chunks) for key in failed]
 
 
 def delete_s3(logger, filename, current_user):
@@ -117,21 +242,43 @@ def delete_s3(logger, filename, current_user):
     :param current_user:
     :return:
     """
-    prefix = "photos/{0}/".format(email_normalize(current_user['email']))
-    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(current_user['email']))
-    key = "{0}{1}".format(prefix, filename)
-    key_thumb = "{0}{1}".format(prefix_thumb, filename)
-    logger.debug('Attempting delete object: {0}'.format(key))
-    logger.debug('Attempting delete object: {0}'.format(key_thumb))
+    keys = photo_keys(current_user['email'], filename)
     try:
-        s3_client = boto3.client('s3')
-        s3_client.delete_object(Bucket=conf['S3_PHOTO_BUCKET'], Key=key)
-        s3_client.delete_object(Bucket=conf['S3_PHOTO_BUCKET'], Key=key_thumb)
+        logger.debug('Attempting delete objects: {0}'.format(keys))
+        failed = delete_keys_s3(boto3.client('s3'), keys)
+        if failed:
+            raise Exception('objects not deleted: {0}'.format(failed))
     except Exception as e:
         logger.error('Error occurred while deleting file:%s', e)
         raise ChaliceViewError('Error occurred while deleting file.')
 
 
+# Presigned URLs are handed out again until this fraction of S3_PRESIGNED_EXP has elapsed.
+presigned_urls = LRUCache(maxsize=int(conf.get('PRESIGNED_URL_CACHE_SIZE', 10000)))
+PRESIGNED_URL_REUSE_FRACTION = float(conf.get('PRESIGNED_URL_REUSE_FRACTION', 0.5))
+
+
+def cached_presigned_url(key, s3_client=None):
+    """
+    Presigned GET url of a photo object, reused while most of its lifetime is left.
+    Stable urls let browsers cache the images between page loads.
+    :param key: S3 object key
+    :param s3_client: boto3 S3 client, only created on a cache miss when not given
+    :return: presigned url
+    """
+    expires_in = int(conf['S3_PRESIGNED_EXP'])
+    cache_key = (conf['S3_PHOTO_BUCKET'], key, expires_in)
+
+    url = presigned_urls.get(cache_key)
+    if url is None:
+        url = (s3_client or boto3.client('s3')).generate_presigned_url(
+            'get_object',
+            Params={'Bucket': conf['S3_PHOTO_BUCKET'], 'Key': key},
+            ExpiresIn=expires_in)
+        presigned_urls.set(cache_key, url, ttl=expires_in * PRESIGNED_URL_REUSE_FRACTION)
+    return url
+
+
 def presigned_url_both(filename, email):
     """
     Return presigned urls both original image url and thumbnail image url
@@ -140,19 +287,11 @@ def presigned_url_both(filename, email):
     :return:
     """
     prefix = "photos/{0}/".format(email_normalize(email))
-    prefix_thumb = "photos/{0}/thumbnails/".format(email_normalize(email))
-    key_thumb = "{0}{1}".format(prefix_thumb, filename)
+    key_thumb = thumbnail_key(email, filename)
     key_origin = "{0}{1}".format(prefix, filename)
     try:
-        s3_client = boto3.client('s3')
-        thumb_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': conf['S3_PHOTO_BUCKET'], 'Key': key_thumb},
-            ExpiresIn=conf['S3_PRESIGNED_EXP'])
-        origin_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': conf['S3_PHOTO_BUCKET'], 'Key': key_origin},
-            ExpiresIn=conf['S3_PRESIGNED_EXP'])
+        thumb_url = cached_presigned_url(key_thumb)
+        origin_url = cached_presigned_url(key_origin)
     except Exception as e:
         raise ChaliceViewError(e)
     return thumb_url, origin_url
@@ -0,0 +1,135 @@
+"""
+    cloudalbum/tests/test_multipart.py
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    Test cases for the multipart/form-data parser used by the upload route.
+
+    Run from the project directory: python -m unittest discover tests
+
+    :description: CloudAlbum is a fully featured sample application for 'Moving to AWS serverless' training course
+    :copyright: © 2019 written by Dayoungle Jun, Sungshik Jou.
+    :license: MIT, see LICENSE for more details.
+"""
+import unittest
+
+from chalicelib.multipart import MultipartError, parse_multipart
+
+BOUNDARY = '----CloudAlbumTestBoundary'
+CONTENT_TYPE = 'multipart/form-data; boundary={0}'.format(BOUNDARY)
+
+
+def field(name, value, boundary=BOUNDARY):
+    return ('--{0}\r\nContent-Disposition: form-data; name="{1}"\r\n\r\n'
+            .format(boundary, name).encode('utf-8') + value + b'\r\n')
+
+
+def file(name, filename, data, boundary=BOUNDARY):
+    return ('--{0}\r\nContent-Disposition: form-data; name="{1}"; filename="{2}"\r\n'
+            'Content-Type: image/jpeg\r\n\r\n'.format(boundary, name, filename).encode('utf-8') + data + b'\r\n')
+
+
+def closing(boundary=BOUNDARY):
+    return '--{0}--\r\n'.format(boundary).encode('utf-8')
+
+
+class TestParseMultipart(unittest.TestCase):
+    def test_fields_and_file(self):
+        """Ensure text fields and file parts are parsed."""
+        body = field('tags', 'café'.encode('utf-8')) + file('file', 'photo.jpg', b'\xff\xd8\xff') + closing()
+        form = parse_multipart(body, CONTENT_TYPE)
+        self.assertEqual(form.fields, {'tags': 'café'})
+        photo = form.files['file']
+        self.assertEqual(photo.filename, 'photo.jpg')
+        self.assertEqual(photo.content_type, 'image/jpeg')
+        self.assertEqual(photo.reader().read(), b'\xff\xd8\xff')
+
+    def test_quoted_boundary(self):
+        """Ensure a quoted boundary parameter is accepted."""
+        body = field('desc', b'hello') + closing()
+        form = parse_multipart(body, 'multipart/form-data; boundary="{0}"'.format(BOUNDARY))
+        self.assertEqual(form.fields['desc'], 'hello')
+
+    def test_preamble_and_epilogue_ignored(self):
+        """Ensure text before the first and after the closing boundary is ignored."""
+        body = b'preamble\r\n' + field('desc', b'hello') + closing() + b'epilogue'
+        form = parse_multipart(body, CONTENT_TYPE)
+        self.assertEqual(form.fields, {'desc': 'hello'})
+
+    def test_boundary_like_data(self):
+        """Ensure boundary text without a leading CRLF, or cut short, is kept as data."""
+        data = b'--' + BOUNDARY.encode('utf-8') + b'xx\r\n--' + BOUNDARY[:-1].encode('utf-8')
+        body = file('file', 'photo.jpg', b'a' + data) + closing()
+        form = parse_multipart(body, CONTENT_TYPE)
+        self.assertEqual(form.files['file'].reader().read(), b'a' + data)
+
+    def test_empty_part(self):
+        """Ensure an empty field is parsed as an empty string."""
+        body = field('desc', b'') + closing()
+        form = parse_multipart(body, CONTENT_TYPE)
+        self.assertEqual(form.fields, {'desc': ''})
+
+    def test_missing_boundary_parameter(self):
+        """Ensure a content type without a boundary is rejected."""
+        body = field('desc', b'hello') + closing()
+        with self.assertRaises(MultipartError):
+            parse_multipart(body, 'multipart/form-data')
+        with self.assertRaises(MultipartError):
+            parse_multipart(body, 'application/json')
+
+    def test_boundary_not_in_body(self):
+        """Ensure a body without the announced boundary is rejected."""
+        body = field('desc', b'hello', boundary='other') + closing(boundary='other')
+        with self.assertRaises(MultipartError):
+            parse_multipart(body, CONTENT_TYPE)
+
+    def test_malformed_boundary(self):
+        """Ensure a boundary followed by something else than CRLF or -- is rejected."""
+        body = '--{0}xx\r\n'.format(BOUNDARY).encode('utf-8') + field('desc', b'hello') + closing()
+        with self.assertRaises(MultipartError):
+            parse_multipart(body, CONTENT_TYPE)
+
+    def test_truncated_body(self):
+        """Ensure a body cut off before the closing boundary is rejected."""
+        body = field('desc', b'hello') + file('file', 'photo.jpg', b'\xff\xd8\xff') + closing()
+        for size in (len(body) // 2, len(body) - len(closing()) - 2):
+            with self.assertRaises(MultipartError):
+                parse_multipart(body[:size], CONTENT_TYPE)
+
+    def test_truncated_headers(self):
+        """Ensure a part without the blank line after its headers is rejected."""
+        body = '--{0}\r\nContent-Disposition: form-data; name="desc"'.format(BOUNDARY).encode('utf-8')
+        with self.assertRaises(MultipartError):
+            parse_multipart(body, CONTENT_TYPE)
+
+    def test_part_without_name(self):
+        """Ensure a part without a form-data name is rejected."""
+        body = '--{0}\r\nContent-Type: text/plain\r\n\r\nhello\r\n'.format(BOUNDARY).encode('utf-8') + closing()
+        with self.assertRaises(MultipartError):
+            parse_multipart(body, CONTENT_TYPE)
+
+    def test_non_utf8_field(self):
+        """Ensure a text field which is not UTF-8 raises MultipartError."""
+        body = field('desc', 'café'.encode('latin-1')) + closing()
+        with self.assertRaises(MultipartError):
+            parse_multipart(body, CONTENT_TYPE)
+
+    def test_non_utf8_file(self):
+        """Ensure file parts are kept as bytes whatever they contain."""
+        body = file('file', 'photo.jpg', b'\xe9\xff') + closing()
+        form = parse_multipart(body, CONTENT_TYPE)
+        self.assertEqual(form.files['file'].reader().read(), b'\xe9\xff')
+
+    def test_size_limits(self):
+        """Ensure body, file and field size limits are enforced."""
+        body = field('desc', b'x' * 10) + file('file', 'photo.jpg', b'y' * 100) + closing()
+        with self.assertRaises(MultipartError):
+            parse_multipart(body, CONTENT_TYPE, max_body_size=len(body) - 1)
+        with self.assertRaises(MultipartError):
+            parse_multipart(body, CONTENT_TYPE, max_file_size=99)
+        with self.assertRaises(MultipartError):
+            parse_multipart(body, CONTENT_TYPE, max_field_size=9)
+        form = parse_multipart(body, CONTENT_TYPE, max_body_size=len(body), max_file_size=100, max_field_size=10)
+        self.assertEqual(len(form.files['file']), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()